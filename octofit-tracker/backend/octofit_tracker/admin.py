@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import User, Team, Activity, Leaderboard, Workout
+from .models import User, Team, Activity, Leaderboard, TeamLeaderboard, Workout
 
 
 @admin.register(User)
@@ -31,6 +31,14 @@ class LeaderboardAdmin(admin.ModelAdmin):
     ordering = ['rank']
 
 
+@admin.register(TeamLeaderboard)
+class TeamLeaderboardAdmin(admin.ModelAdmin):
+    list_display = ['id', 'team_id', 'total_points', 'member_count', 'average_points', 'rank', 'updated_at']
+    search_fields = ['team_id']
+    list_filter = ['updated_at']
+    ordering = ['rank']
+
+
 @admin.register(Workout)
 class WorkoutAdmin(admin.ModelAdmin):
     list_display = ['id', 'name', 'difficulty_level', 'duration', 'category', 'created_at']
@@ -0,0 +1,448 @@
+"""
+In-process columnar cache for activity statistics.
+
+With OCTOFIT_ANALYTICS_CACHE on, the stats endpoints are answered from
+NumPy arrays instead of aggregate queries. Each activity field is kept as
+one column. ``user_id`` and ``activity_type`` are dictionary encoded as
+small integer codes. Dates are stored as epoch seconds plus a local day
+number for the day, week and month buckets. That comes to about 60 bytes
+per activity, against well over a kilobyte for a model instance.
+
+Next to the rows, a day cube holds the count and the sums per
+(activity type, day). Most dashboard queries are answered from it: those
+with no ``user_id`` filter whose date range starts and ends on local day
+boundaries. Their cost therefore depends on the number of types and days,
+not on the number of activities. The other queries are answered from the
+rows, with vectorized masks and ``bincount`` calls.
+
+The cache is refreshed at most every OCTOFIT_ANALYTICS_REFRESH_INTERVAL
+seconds by loading the activities created since the last refresh (by
+``created_at``), so answers may lag writes by up to that interval. Editing
+or deleting an activity records its id as an ActivityChange row, which the
+cache of every process reads on refresh: the changed rows are taken out of
+the columns and the day cube and loaded again by id. Changes are kept for
+CHANGE_RETENTION_SECONDS; a process that has not refreshed for that long
+reloads everything.
+"""
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+
+import numpy as np
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.utils import timezone
+
+from .models import Activity, ActivityChange
+from .stats import STAT_FIELDS, stat_summary
+
+COLUMNS = {
+    'id': np.int64,
+    'created': np.float64,
+    'date': np.float64,
+    'day': np.int32,
+    'user': np.int32,
+    'type': np.int16,
+    'duration': np.int64,
+    'distance': np.float64,
+    'calories': np.int64,
+}
+# What is summed per group: the row count, each stat field (missing
+# distances as 0) and the number of rows that have a distance
+MEASURES = ('count',) + STAT_FIELDS + ('distance_count',)
+# Integer fields are summed exactly; distance is a float and may be missing
+INTEGER_FIELDS = ('duration', 'calories')
+LOAD_FIELDS = ('id', 'created_at', 'date', 'user_id', 'activity_type', 'duration', 'distance', 'calories')
+LOAD_CHUNK = 10000
+# Rows stamped this long before the last refresh are fetched again, so rows
+# committed a little after their created_at are not missed
+OVERLAP_SECONDS = 60
+# ActivityChange rows older than this are deleted by the next refresh
+CHANGE_RETENTION_SECONDS = 86400
+# Dates spread wider than this many days are only answered from the rows
+MAX_CUBE_DAYS = 20000
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+def _local_days(seconds):
+    """Local day ordinals of epoch seconds in the current time zone"""
+    tz = timezone.get_current_timezone()
+    hours, positions = np.unique(np.floor_divide(seconds, 3600), return_inverse=True)
+    # UTC offsets only change on the hour, so one lookup per distinct hour
+    offsets = np.array([
+        datetime.fromtimestamp(hour * 3600, tz).utcoffset().total_seconds()
+        for hour in hours.tolist()
+    ])
+    return (np.floor_divide(seconds + offsets[positions.ravel()], 86400) + EPOCH_ORDINAL).astype(np.int64)
+
+
+def _bucket_days(days, period):
+    """Start of the day, ISO week or month of each day ordinal"""
+    if period == 'day':
+        return days
+    if period == 'week':
+        return days - (days - 1) % 7
+    months = (days - EPOCH_ORDINAL).astype('datetime64[D]').astype('datetime64[M]')
+    return months.astype('datetime64[D]').astype(np.int64) + EPOCH_ORDINAL
+
+
+def _day_bound(value, end):
+    """
+    The local day ordinal a ``date_from``/``date_to`` value starts or ends,
+    or None when it falls within a day.
+    """
+    local = timezone.localtime(value + timedelta(microseconds=1) if end else value)
+    if (local.hour, local.minute, local.second, local.microsecond) != (0, 0, 0, 0):
+        return None
+    return local.date().toordinal() - (1 if end else 0)
+
+
+class _DayCube:
+    """Measures summed per (activity type code, local day)"""
+
+    def __init__(self):
+        self.first_day = None
+        self.sums = None
+
+    @property
+    def nbytes(self):
+        return sum(values.nbytes for values in self.sums.values()) if self.sums else 0
+
+    def _fit(self, types, first_day, last_day):
+        """Grow the arrays to cover ``types`` type codes and the day range"""
+        if self.sums is None:
+            old_types, old_first, old_days = 0, first_day, 0
+        else:
+            old_types, old_days = self.sums['count'].shape
+            old_first = self.first_day
+        new_first = min(old_first, first_day)
+        new_days = max(old_first + old_days, last_day + 1) - new_first
+        new_types = max(old_types, types)
+        if self.sums is not None and (new_types, new_days, new_first) == (old_types, old_days, old_first):
+            return
+        shift = old_first - new_first
+        grown = {}
+        for measure in MEASURES:
+            values = np.zeros((new_types, new_days))
+            if self.sums is not None:
+                values[:old_types, shift:shift + old_days] = self.sums[measure]
+            grown[measure] = values
+        self.sums, self.first_day = grown, new_first
+
+    def add(self, types, days, values):
+        """Add rows with type codes ``types``, day ordinals ``days`` and MEASURES ``values``"""
+        self._fit(int(types.max()) + 1, int(days.min()), int(days.max()))
+        width = self.sums['count'].shape[1]
+        cells = types.astype(np.int64) * width + (days - self.first_day)
+        size = self.sums['count'].size
+        for measure in MEASURES:
+            self.sums[measure] += np.bincount(cells, weights=values[measure], minlength=size).reshape(
+                self.sums['count'].shape
+            )
+
+    def cells(self, type_codes, first_day, last_day):
+        """
+        ``(types, days, values)`` for the non-empty cells of the given types
+        (None: all) within the day range (None: open ended).
+        """
+        if self.sums is None:
+            return np.zeros(0, np.int64), np.zeros(0, np.int64), {m: np.zeros(0) for m in MEASURES}
+        count_types, width = self.sums['count'].shape
+        start = 0 if first_day is None else min(max(first_day - self.first_day, 0), width)
+        stop = width if last_day is None else min(max(last_day - self.first_day + 1, start), width)
+        rows = np.arange(count_types) if type_codes is None else np.array(
+            [code for code in type_codes if 0 <= code < count_types], np.int64
+        )
+        counts = self.sums['count'][rows, start:stop]
+        type_index, day_index = np.nonzero(counts)
+        values = {
+            measure: self.sums[measure][rows, start:stop][type_index, day_index]
+            for measure in MEASURES
+        }
+        return rows[type_index], day_index + self.first_day + start, values
+
+
+class ActivityColumns:
+    """Activities as growable column arrays, with dictionary-encoded strings"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+        self.checked = None
+
+    def reset(self):
+        self.size = 0
+        self.arrays = {name: np.empty(0, dtype) for name, dtype in COLUMNS.items()}
+        self.users, self.user_codes = [], {}
+        self.types, self.type_codes = [], {}
+        self.cube = _DayCube()
+        self.watermark = None
+        # Wall clock time of the last refresh, and the changes read since
+        # OVERLAP_SECONDS before it
+        self.synced = None
+        self.applied = set()
+
+    def column(self, name):
+        return self.arrays[name][:self.size]
+
+    @property
+    def nbytes(self):
+        return sum(self.column(name).nbytes for name in COLUMNS) + self.cube.nbytes
+
+    @staticmethod
+    def _code(values, codes, value):
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(values)
+            values.append(value)
+        return code
+
+    def append(self, rows):
+        """Append ``LOAD_FIELDS`` tuples"""
+        if not rows:
+            return
+        ids, created, dates, users, types, durations, distances, calories = zip(*rows)
+        columns = {
+            'id': ids,
+            'created': [value.timestamp() for value in created],
+            'date': np.array([value.timestamp() for value in dates]),
+            'user': [self._code(self.users, self.user_codes, value) for value in users],
+            'type': np.array([self._code(self.types, self.type_codes, value) for value in types]),
+            'duration': durations,
+            'distance': [np.nan if value is None else value for value in distances],
+            'calories': calories,
+        }
+        columns['day'] = _local_days(columns['date'])
+
+        start, size = self.size, self.size + len(rows)
+        for name, values in columns.items():
+            array = self.arrays[name]
+            if size > len(array):
+                grown = np.empty(max(size, 2 * len(array), 1024), COLUMNS[name])
+                grown[:start] = array[:start]
+                self.arrays[name] = array = grown
+            array[start:size] = values
+        self.size = size
+        self.watermark = max(self.watermark or 0, max(columns['created']))
+        self.cube.add(columns['type'], columns['day'], self._measures(slice(start, size)))
+
+    def remove(self, ids):
+        """Take the rows of these activity ids out of the columns and the day cube"""
+        mask = np.isin(self.column('id'), list(ids))
+        if not mask.any():
+            return
+        rows = np.flatnonzero(mask)
+        values = {measure: -np.asarray(column, np.float64) for measure, column in self._measures(rows).items()}
+        self.cube.add(self.column('type')[rows], self.column('day')[rows], values)
+        keep = np.flatnonzero(~mask)
+        for name in COLUMNS:
+            array = self.arrays[name]
+            array[:len(keep)] = array[keep]
+        self.size = len(keep)
+
+    def _measures(self, rows):
+        """MEASURES for the rows selected by ``rows`` (a slice or index array)"""
+        distance = self.column('distance')[rows]
+        has_distance = ~np.isnan(distance)
+        values = {field: self.column(field)[rows] for field in INTEGER_FIELDS}
+        values['count'] = np.ones(len(distance))
+        values['distance'] = np.where(has_distance, distance, 0.0)
+        values['distance_count'] = has_distance
+        return values
+
+    def refresh(self, force=False):
+        """Load new and changed activities, at most every OCTOFIT_ANALYTICS_REFRESH_INTERVAL seconds"""
+        now = time.monotonic()
+        if not force and self.checked is not None and now - self.checked < settings.OCTOFIT_ANALYTICS_REFRESH_INTERVAL:
+            return
+        synced = time.time()
+        if self.synced is not None and synced - self.synced > CHANGE_RETENTION_SECONDS - OVERLAP_SECONDS:
+            # Changes since the last refresh may have been deleted
+            self.reset()
+
+        # Read before the rows, so a change made while they load is applied next time
+        changes = ActivityChange.objects.filter(
+            changed_at__gte=datetime.fromtimestamp((self.synced or synced) - OVERLAP_SECONDS, tz=dt_timezone.utc)
+        ).values_list('id', 'activity_id')
+        changed = set()
+        applied = set()
+        for change_id, activity_id in changes:
+            applied.add(change_id)
+            if self.synced is not None and change_id not in self.applied:
+                changed.add(activity_id)
+
+        queryset = Activity.objects.order_by('created_at', 'id')
+        loaded = set()
+        if self.watermark is not None:
+            cutoff = self.watermark - OVERLAP_SECONDS
+            queryset = queryset.filter(
+                created_at__gte=datetime.fromtimestamp(cutoff, tz=dt_timezone.utc)
+            )
+            loaded = set(self.column('id')[self.column('created') >= cutoff].tolist())
+
+        batch = []
+        for row in queryset.values_list(*LOAD_FIELDS).iterator(chunk_size=LOAD_CHUNK):
+            if row[0] not in loaded:
+                batch.append(row)
+            if len(batch) >= LOAD_CHUNK:
+                self.append(batch)
+                batch = []
+        self.append(batch)
+
+        if changed:
+            self.remove(changed)
+            ids = sorted(changed)
+            for start in range(0, len(ids), LOAD_CHUNK):
+                self.append(list(
+                    Activity.objects.filter(id__in=ids[start:start + LOAD_CHUNK]).values_list(*LOAD_FIELDS)
+                ))
+            ActivityChange.objects.filter(
+                changed_at__lt=datetime.fromtimestamp(synced - CHANGE_RETENTION_SECONDS, tz=dt_timezone.utc)
+            ).delete()
+        self.synced, self.applied = synced, applied
+        self.checked = now
+
+    def _type_codes(self, filters):
+        if not filters['activity_types']:
+            return None
+        return [self.type_codes.get(name, -1) for name in filters['activity_types']]
+
+    def _cube_cells(self, filters):
+        """Cells answering ``filters`` from the day cube, or None when it cannot"""
+        if filters['user_id'] or self.cube.sums is None:
+            return None
+        if self.cube.sums['count'].shape[1] > MAX_CUBE_DAYS:
+            return None
+        first_day = last_day = None
+        if filters['date_from']:
+            first_day = _day_bound(filters['date_from'], end=False)
+            if first_day is None:
+                return None
+        if filters['date_to']:
+            last_day = _day_bound(filters['date_to'], end=True)
+            if last_day is None:
+                return None
+        return self.cube.cells(self._type_codes(filters), first_day, last_day)
+
+    def _row_cells(self, filters):
+        """One cell per activity matching ``filters``"""
+        mask = None
+
+        def narrow(condition):
+            nonlocal mask
+            mask = condition if mask is None else mask & condition
+
+        if filters['user_id']:
+            narrow(self.column('user') == self.user_codes.get(filters['user_id'], -1))
+        type_codes = self._type_codes(filters)
+        if type_codes is not None:
+            narrow(np.isin(self.column('type'), type_codes))
+        if filters['date_from']:
+            narrow(self.column('date') >= filters['date_from'].timestamp())
+        if filters['date_to']:
+            narrow(self.column('date') <= filters['date_to'].timestamp())
+
+        rows = slice(None) if mask is None else np.flatnonzero(mask)
+        return self.column('type')[rows], self.column('day')[rows], self._measures(rows)
+
+    def stats(self, filters, group_by):
+        """The same response as stats.activity_stats(), for parsed filter values"""
+        with self.lock:
+            self.refresh()
+            cells = self._cube_cells(filters)
+            if cells is None:
+                cells = self._row_cells(filters)
+            types, days, values = cells
+
+            totals = _summary({measure: values[measure].sum() for measure in MEASURES})
+            groups = []
+            keys, labels = self._group_keys(group_by, types, days)
+            if len(keys):
+                width = int(keys.max()) + 1
+                sums = {
+                    measure: np.bincount(keys, weights=values[measure], minlength=width).tolist()
+                    for measure in MEASURES
+                }
+                for key, count in enumerate(sums['count']):
+                    if count:
+                        group = labels(key)
+                        group.update(_summary({measure: sums[measure][key] for measure in MEASURES}))
+                        groups.append(group)
+                columns = ['period_start' if column != 'activity_type' else column for column in group_by]
+                groups.sort(key=lambda group: [group[column] for column in columns])
+
+            return {'group_by': group_by, 'totals': totals, 'groups': groups}
+
+    def _group_keys(self, group_by, types, days):
+        """
+        Dense integer group keys for the cells and a function turning a key
+        back into the group's columns.
+        """
+        codes = types.astype(np.int64) if 'activity_type' in group_by else None
+        periods = [key for key in group_by if key != 'activity_type']
+        first, offsets, span = 0, None, 1
+        if periods and len(days):
+            buckets = _bucket_days(days.astype(np.int64), periods[0])
+            first = int(buckets.min())
+            offsets = buckets - first
+            span = int(offsets.max()) + 1
+
+        if codes is None:
+            keys = offsets if offsets is not None else np.zeros(0, np.int64)
+        elif offsets is None:
+            keys = codes
+        else:
+            keys = codes * span + offsets
+
+        def labels(key):
+            group = {}
+            if codes is not None:
+                group['activity_type'] = self.types[key // span]
+            if periods:
+                group['period_start'] = date.fromordinal(first + key % span)
+            return group
+
+        return keys, labels
+
+
+def _summary(sums):
+    """stat_summary() for summed MEASURES"""
+    count = int(sums['count'])
+    row = {'count': count}
+    for field in STAT_FIELDS:
+        values = int(sums['distance_count']) if field == 'distance' else count
+        total = int(round(sums[field])) if field in INTEGER_FIELDS else float(sums[field])
+        row[f'{field}_sum'] = total if values else None
+        row[f'{field}_avg'] = total / values if values else None
+    return stat_summary(row)
+
+
+_columns_lock = threading.Lock()
+_cache = None
+
+
+def get_columns():
+    """This process's column cache, created on first use"""
+    global _cache
+    if _cache is None:
+        with _columns_lock:
+            if _cache is None:
+                _cache = ActivityColumns()
+    return _cache
+
+
+def activity_stats(filters, group_by):
+    """stats.activity_stats() over the column cache, for parsed filter values"""
+    return get_columns().stats(filters, group_by)
+
+
+def _activity_changed(sender, instance, created=False, **kwargs):
+    # New rows are picked up by created_at; the others are loaded again by id
+    if not created and settings.OCTOFIT_ANALYTICS_CACHE:
+        ActivityChange.objects.create(activity_id=instance.pk)
+
+
+def connect_signals():
+    """Record edited and deleted activities for the caches of every process"""
+    post_save.connect(_activity_changed, sender=Activity, dispatch_uid='octofit-analytics-save')
+    post_delete.connect(_activity_changed, sender=Activity, dispatch_uid='octofit-analytics-delete')
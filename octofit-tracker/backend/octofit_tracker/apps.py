@@ -0,0 +1,16 @@
+from django.apps import AppConfig
+
+
+class OctofitTrackerConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'octofit_tracker'
+
+    def ready(self):
+        from . import analytics
+        from .caching import connect_signals
+        from .health import register_pool_listener
+        from .profiling import register_command_listener
+        connect_signals()
+        analytics.connect_signals()
+        register_pool_listener()
+        register_command_listener()
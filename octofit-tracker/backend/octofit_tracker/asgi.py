@@ -2,6 +2,8 @@
 ASGI config for octofit_tracker project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Requests for the leaderboard event stream are answered by a small ASGI app
+(see ``octofit_tracker.events``); everything else goes to Django.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/4.1/howto/deployment/asgi/
@@ -13,4 +15,15 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'octofit_tracker.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from octofit_tracker.events import STREAM_PATH, leaderboard_stream  # noqa: E402
+from octofit_tracker import writebehind  # noqa: E402
+
+writebehind.start_server_worker()
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'http' and scope['path'] == STREAM_PATH:
+        return await leaderboard_stream(scope, receive, send)
+    return await django_application(scope, receive, send)
@@ -0,0 +1,113 @@
+"""
+Async read endpoints for dashboard polling under ASGI.
+
+These are plain Django async views rather than DRF viewsets (DRF views are
+synchronous), so a request awaits its database round trip instead of
+holding a worker thread for it. Rows are rendered with the same
+RowSerializer as the sync list endpoints, and each response matches the
+``results`` of the first page of the corresponding sync endpoint.
+Leaderboard and activity rows come from the hot-path repository.
+"""
+from asgiref.sync import sync_to_async
+from django.http import HttpResponseNotAllowed, JsonResponse
+from rest_framework.exceptions import ValidationError
+from rest_framework.utils.encoders import JSONEncoder
+
+from .fastpath import row_serializer_for
+from .filters import activity_filter_values
+from .models import Workout
+from .pagination import (
+    ActivityCursorPagination,
+    LeaderboardCursorPagination,
+    WorkoutCursorPagination
+)
+from .repository import get_repository
+from .serializers import ActivitySerializer, LeaderboardSerializer, WorkoutSerializer
+
+
+def _limit(request, pagination_class):
+    """``?limit=`` (or ``?page_size=``) capped at the endpoint's maximum"""
+    value = request.GET.get('limit') or request.GET.get('page_size')
+    try:
+        limit = int(value) if value else pagination_class.page_size
+    except ValueError:
+        raise ValidationError({'limit': 'Must be an integer.'})
+    return max(1, min(limit, pagination_class.max_page_size))
+
+
+async def _orm_rows(queryset, serializer_class, pagination_class, limit):
+    row_serializer = row_serializer_for(serializer_class)
+    ordering = pagination_class.ordering
+    queryset = queryset.order_by(*ordering).values(
+        *(set(row_serializer.sources) | {field.lstrip('-') for field in ordering})
+    )
+    return [row_serializer.to_representation(row) async for row in queryset[:limit]]
+
+
+async def _repository_rows(fetch, serializer_class, limit):
+    row_serializer = row_serializer_for(serializer_class)
+    repository = get_repository()
+    rows = await sync_to_async(fetch, thread_sensitive=repository.thread_sensitive)(
+        repository, limit, sorted(row_serializer.sources)
+    )
+    return [row_serializer.to_representation(row) for row in rows]
+
+
+async def _respond(request, rows):
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    try:
+        results = await rows()
+    except ValidationError as exc:
+        return JsonResponse(exc.detail, status=400, encoder=JSONEncoder)
+    return JsonResponse(
+        {'results': results},
+        encoder=JSONEncoder,
+        json_dumps_params={'separators': (',', ':')},
+    )
+
+
+async def leaderboard_list(request):
+    """Top of the leaderboard by rank"""
+    def rows():
+        limit = _limit(request, LeaderboardCursorPagination)
+        return _repository_rows(
+            lambda repository, limit, fields: repository.leaderboard_top(limit, fields),
+            LeaderboardSerializer,
+            limit,
+        )
+    return await _respond(request, rows)
+
+
+leaderboard_list.replica_max_staleness = 30
+
+
+async def activity_list(request):
+    """Activities, with the same filters as /api/activities/"""
+    def rows():
+        limit = _limit(request, ActivityCursorPagination)
+        filters = activity_filter_values(request.GET)
+        return _repository_rows(
+            lambda repository, limit, fields: repository.activities(filters, limit, fields),
+            ActivitySerializer,
+            limit,
+        )
+    return await _respond(request, rows)
+
+
+activity_list.replica_max_staleness = 10
+
+
+async def workout_list(request):
+    """Workouts"""
+    def rows():
+        return _orm_rows(
+            Workout.objects.all(),
+            WorkoutSerializer,
+            WorkoutCursorPagination,
+            _limit(request, WorkoutCursorPagination),
+        )
+    return await _respond(request, rows)
+
+
+workout_list.replica_max_staleness = 300
@@ -0,0 +1,203 @@
+"""
+Repeatable REST API benchmark scenarios, run by ``manage.py benchmark_api``.
+
+Each scenario drives the viewsets through the in-process test client with
+a seeded random generator, so two runs against the same dataset issue the
+same requests. Every request is timed and its ORM statements and Mongo
+round trips are counted with the profiling hooks. Scenarios that write run
+last, so the read scenarios always see the freshly seeded data.
+"""
+import statistics
+import threading
+import time
+from datetime import timedelta
+
+from django.db import connection
+from django.test import Client
+
+from .profiling import end_profile, start_profile
+
+# Dataset sizes as (users, activities per user)
+DATASETS = {
+    '1k': (100, 10),
+    '100k': (2000, 50),
+    '1m': (10000, 100),
+}
+SEED = 42
+END_DATE = '2026-10-01'
+ACTIVITY_TYPES = ['Running', 'Cycling', 'Swimming', 'Weightlifting', 'Yoga', 'Combat Training']
+
+# Metrics compared against the baseline: latency and memory may grow by the
+# tolerance, round trips may not grow at all
+TIMED_METRICS = ('p95_ms', 'p99_ms')
+MEMORY_METRICS = ('traced_peak_mb',)
+COUNT_METRICS = ('queries_per_request', 'round_trips_per_request')
+
+
+def measure(call):
+    """
+    Run ``call()`` and return ``(sample, response)``, where the sample is
+    ``(seconds, queries, round_trips, status)``.
+    """
+    profile, token = start_profile()
+    try:
+        with profile.capture_queries():
+            started = time.perf_counter()
+            response = call()
+            seconds = time.perf_counter() - started
+    finally:
+        end_profile(token)
+    return (seconds, profile.counts['db'], profile.counts['mongo'], response.status_code), response
+
+
+def activity_payload(rng, user_id, end_date):
+    activity_type = rng.choice(ACTIVITY_TYPES)
+    duration = rng.randint(15, 90)
+    return {
+        'user_id': user_id,
+        'activity_type': activity_type,
+        'duration': duration,
+        'distance': round(duration * rng.uniform(0.1, 0.3), 2),
+        'calories': duration * rng.randint(5, 12),
+        'date': (end_date - timedelta(minutes=rng.randint(0, 60 * 24 * 30))).isoformat(),
+    }
+
+
+def list_activities(context):
+    """Walk the activity list page by page, starting over at the end"""
+    client = Client(raise_request_exception=False)
+    samples = []
+    url, params = '/api/activities/', {'page_size': 100}
+    for _ in range(context['requests']):
+        sample, response = measure(lambda: client.get(url, params))
+        samples.append(sample)
+        next_url = response.json().get('next') if response.status_code == 200 else None
+        if next_url:
+            url, params = next_url, None
+        else:
+            url, params = '/api/activities/', {'page_size': 100}
+    return samples
+
+
+def filter_activities(context):
+    """Filtered activity lists: one user's types over a date range"""
+    client = Client(raise_request_exception=False)
+    rng = context['rng']
+    samples = []
+    for _ in range(context['requests']):
+        days = rng.choice([7, 30, 90])
+        params = {
+            'user_id': rng.choice(context['user_ids']),
+            'activity_type': ','.join(rng.sample(ACTIVITY_TYPES, 2)),
+            'date_from': (context['end_date'] - timedelta(days=days)).date().isoformat(),
+        }
+        samples.append(measure(lambda: client.get('/api/activities/', params))[0])
+    return samples
+
+
+def bulk_ingest(context):
+    """POST batches of 200 activities to the bulk endpoint"""
+    client = Client(raise_request_exception=False)
+    rng = context['rng']
+    samples = []
+    for _ in range(max(1, context['requests'] // 10)):
+        payload = [
+            activity_payload(rng, rng.choice(context['user_ids']), context['end_date'])
+            for _ in range(200)
+        ]
+        samples.append(measure(
+            lambda: client.post('/api/activities/bulk/', payload, content_type='application/json')
+        )[0])
+    return samples
+
+
+def leaderboard_under_writes(context, writers=2):
+    """
+    Read the leaderboard (first page, top 10 and around a user) while
+    ``writers`` threads keep posting single activities.
+    """
+    rng = context['rng']
+    stop = threading.Event()
+
+    def write(seed):
+        client = Client(raise_request_exception=False)
+        writer_rng = type(rng)(seed)
+        try:
+            while not stop.is_set():
+                client.post(
+                    '/api/activities/',
+                    activity_payload(writer_rng, writer_rng.choice(context['user_ids']), context['end_date']),
+                    content_type='application/json',
+                )
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=write, args=(SEED + index,)) for index in range(writers)]
+    for thread in threads:
+        thread.start()
+    client = Client(raise_request_exception=False)
+    samples = []
+    try:
+        for index in range(context['requests']):
+            kind = index % 3
+            if kind == 0:
+                params = {}
+            elif kind == 1:
+                params = {'top': 10}
+            else:
+                params = {'around': rng.choice(context['user_ids']), 'radius': 5}
+            samples.append(measure(lambda: client.get('/api/leaderboard/', params))[0])
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+    return samples
+
+
+SCENARIOS = {
+    'list': list_activities,
+    'filter': filter_activities,
+    'bulk_ingest': bulk_ingest,
+    'leaderboard_under_writes': leaderboard_under_writes,
+}
+
+
+def summarize(samples, elapsed, traced_peak=None):
+    """Latency percentiles, round trips per request and memory for a scenario"""
+    latencies = sorted(seconds * 1000 for seconds, _, _, _ in samples)
+    if len(latencies) > 1:
+        cuts = statistics.quantiles(latencies, n=100, method='inclusive')
+    else:
+        cuts = latencies * 99
+    count = len(samples)
+    return {
+        'requests': count,
+        'errors': sum(1 for *_, status in samples if status >= 400),
+        'throughput': round(count / elapsed, 1) if elapsed else None,
+        'p50_ms': round(cuts[49], 2),
+        'p95_ms': round(cuts[94], 2),
+        'p99_ms': round(cuts[98], 2),
+        'queries_per_request': round(sum(s[1] for s in samples) / count, 2),
+        'round_trips_per_request': round(sum(s[2] for s in samples) / count, 2),
+        'traced_peak_mb': round(traced_peak / 2 ** 20, 2) if traced_peak is not None else None,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Human-readable regressions of ``results`` against ``baseline``"""
+    regressions = []
+    for scenario, result in results.items():
+        expected = baseline.get(scenario)
+        if not expected:
+            continue
+        for metric in TIMED_METRICS + MEMORY_METRICS:
+            value, limit = result.get(metric), expected.get(metric)
+            if value is not None and limit is not None and value > limit * (1 + tolerance):
+                regressions.append(f'{scenario} {metric}: {value} > {limit} (+{tolerance:.0%})')
+        for metric in COUNT_METRICS:
+            value, limit = result.get(metric), expected.get(metric)
+            if value is not None and limit is not None and value > limit:
+                regressions.append(f'{scenario} {metric}: {value} > {limit}')
+        if result['errors'] > expected.get('errors', 0):
+            regressions.append(f'{scenario} errors: {result["errors"]} > {expected.get("errors", 0)}')
+    return regressions
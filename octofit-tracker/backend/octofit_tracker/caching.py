@@ -0,0 +1,132 @@
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+from .models import Leaderboard, LeaderboardBucket, Team, TeamLeaderboard, User, Workout
+
+# Cached resources and the models whose writes make them stale. Leaderboard
+# responses can embed user and team summaries (?expand=), so those count too.
+RESOURCE_MODELS = {
+    'leaderboard': [Leaderboard, LeaderboardBucket, User, Team],
+    'team-leaderboard': [TeamLeaderboard],
+    'teams': [Team],
+    'workouts': [Workout],
+}
+
+
+def get_cache():
+    return caches[settings.OCTOFIT_API_CACHE_ALIAS]
+
+
+def _generation_key(resource):
+    return f'octofit:gen:{resource}'
+
+
+def get_generation(resource):
+    """Current generation of ``resource``; bumped by every invalidation"""
+    return get_cache().get_or_set(_generation_key(resource), 1, timeout=None)
+
+
+def _bump(resources):
+    cache = get_cache()
+    for resource in resources:
+        key = _generation_key(resource)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 2, timeout=None)
+
+
+def invalidate(*resources):
+    """
+    Make every cached response of ``resources`` stale.
+
+    Entries are keyed by the resource's generation, so bumping it orphans
+    all of them at once; they then age out of the cache on their own. Inside
+    a transaction the generation is bumped again on commit, so a response
+    cached from pre-commit data by another request does not survive.
+    """
+    _bump(resources)
+    connection = transaction.get_connection()
+    if connection.in_atomic_block:
+        transaction.on_commit(lambda: _bump(resources))
+
+
+def response_cache_key(resource, request):
+    """Cache key for a GET request: resource generation, host and full path"""
+    raw = f'{request.get_host()}{request.get_full_path()}'
+    digest = hashlib.md5(raw.encode()).hexdigest()
+    return f'octofit:resp:{resource}:{get_generation(resource)}:{digest}'
+
+
+def _read_from_replica(request):
+    reads = getattr(request, 'replica_reads', None)
+    return reads is not None and reads.used
+
+
+def _etag(key):
+    return '"%s"' % hashlib.md5(key.encode()).hexdigest()
+
+
+def _if_none_match(request):
+    header = request.META.get('HTTP_IF_NONE_MATCH', '')
+    return {tag.strip() for tag in header.split(',') if tag.strip()}
+
+
+class CachedResponseMixin:
+    """
+    Caches list and retrieve responses of a viewset.
+
+    Responses are stored as plain JSON-compatible data keyed by the request
+    path and query string. The ETag is derived from the cache key, so a
+    matching ``If-None-Match`` is answered with 304 before any query or
+    serialization runs. Responses read from the replica may predate the
+    current generation, so they are neither cached nor given an ETag.
+    """
+    cache_resource = None
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        if not settings.OCTOFIT_API_CACHE_ENABLED:
+            return handler(request, *args, **kwargs)
+
+        key = response_cache_key(self.cache_resource, request)
+        etag = _etag(key)
+        if etag in _if_none_match(request):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+        cache = get_cache()
+        data = cache.get(key)
+        if data is not None:
+            return Response(data, headers={'ETag': etag, 'X-Cache': 'HIT'})
+
+        response = handler(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK and not _read_from_replica(request):
+            data = json.loads(json.dumps(response.data, cls=JSONEncoder))
+            cache.set(key, data, timeout=settings.OCTOFIT_API_CACHE_TIMEOUT)
+            response['ETag'] = etag
+            response['X-Cache'] = 'MISS'
+        return response
+
+
+def connect_signals():
+    """Invalidate a resource whenever one of its models is saved or deleted"""
+    for resource, models in RESOURCE_MODELS.items():
+        def handler(sender, resource=resource, **kwargs):
+            invalidate(resource)
+        for model in models:
+            dispatch_uid = f'octofit-cache-{resource}-{model.__name__}'
+            post_save.connect(handler, sender=model, weak=False, dispatch_uid=dispatch_uid)
+            post_delete.connect(handler, sender=model, weak=False, dispatch_uid=dispatch_uid)
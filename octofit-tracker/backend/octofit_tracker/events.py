@@ -0,0 +1,147 @@
+"""
+Server-Sent Events stream of leaderboard changes.
+
+One broadcaster per ASGI process polls the leaderboard for rows whose
+``updated_at`` moved since its last tick, encodes the diff once and fans it
+out to every connected client. Bursts of writes between two ticks coalesce
+into a single event, and the cost per tick is one indexed query however many
+clients are listening. The stream is mounted in ``asgi.py``.
+"""
+import asyncio
+import json
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import Leaderboard
+
+STREAM_PATH = '/api/leaderboard/stream/'
+
+
+async def fetch_changes(since):
+    """Leaderboard rows updated at or after ``since``"""
+    queryset = Leaderboard.objects.filter(updated_at__gte=since).values(
+        'user_id', 'total_points', 'total_activities', 'rank', 'updated_at'
+    )
+    return [row async for row in queryset]
+
+
+def encode_event(event, data):
+    return f'event: {event}\ndata: {json.dumps(data, separators=(",", ":"))}\n\n'.encode()
+
+
+class LeaderboardBroadcaster:
+    """Polls for leaderboard changes while anyone is subscribed"""
+
+    def __init__(self, interval=None, queue_size=100):
+        self.interval = interval
+        self.queue_size = queue_size
+        self.subscribers = set()
+        self.task = None
+        self.sent = {}
+
+    def subscribe(self):
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self.subscribers.add(queue)
+        if (
+            self.task is None
+            or self.task.done()
+            or self.task.get_loop() is not asyncio.get_running_loop()
+        ):
+            self.task = asyncio.ensure_future(self.run())
+        return queue
+
+    def unsubscribe(self, queue):
+        self.subscribers.discard(queue)
+
+    def broadcast(self, message):
+        for queue in list(self.subscribers):
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                # A client too slow to keep up has missed diffs; tell it to
+                # reload the full standings instead of queueing more
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(encode_event('resync', {}))
+
+    def diff(self, rows):
+        """Rows whose points or rank differ from what was last broadcast"""
+        changes = []
+        for row in rows:
+            state = (row['total_points'], row['total_activities'], row['rank'])
+            if self.sent.get(row['user_id']) != state:
+                self.sent[row['user_id']] = state
+                changes.append({
+                    'user_id': row['user_id'],
+                    'total_points': row['total_points'],
+                    'total_activities': row['total_activities'],
+                    'rank': row['rank'],
+                })
+        return changes
+
+    async def run(self):
+        interval = self.interval or settings.OCTOFIT_STREAM_INTERVAL
+        watermark = timezone.now()
+        while self.subscribers:
+            await asyncio.sleep(interval)
+            rows = await fetch_changes(watermark)
+            if rows:
+                # >= with de-duplication, so rows committed with the same
+                # timestamp as the previous tick are not missed
+                watermark = max(row['updated_at'] for row in rows)
+                changes = self.diff(rows)
+                if changes:
+                    self.broadcast(encode_event('leaderboard', {'changes': changes}))
+        self.sent.clear()
+
+
+broadcaster = LeaderboardBroadcaster()
+
+
+async def wait_for_disconnect(receive):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+
+
+async def leaderboard_stream(scope, receive, send):
+    """ASGI app streaming leaderboard diffs as ``text/event-stream``"""
+    if scope['method'] != 'GET':
+        await send({'type': 'http.response.start', 'status': 405, 'headers': [(b'allow', b'GET')]})
+        await send({'type': 'http.response.body', 'body': b''})
+        return
+
+    headers = [
+        (b'content-type', b'text/event-stream'),
+        (b'cache-control', b'no-cache'),
+        (b'x-accel-buffering', b'no'),
+    ]
+    if settings.CORS_ALLOW_ALL_ORIGINS:
+        headers.append((b'access-control-allow-origin', b'*'))
+    await send({'type': 'http.response.start', 'status': 200, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': b'retry: 3000\n\n', 'more_body': True})
+
+    queue = broadcaster.subscribe()
+    disconnect = asyncio.ensure_future(wait_for_disconnect(receive))
+    try:
+        while True:
+            message = asyncio.ensure_future(queue.get())
+            done, _ = await asyncio.wait(
+                {message, disconnect},
+                timeout=settings.OCTOFIT_STREAM_HEARTBEAT,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if disconnect in done:
+                message.cancel()
+                break
+            if message in done:
+                body = message.result()
+            else:
+                message.cancel()
+                body = b': keep-alive\n\n'
+            await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+    finally:
+        broadcaster.unsubscribe(queue)
+        disconnect.cancel()
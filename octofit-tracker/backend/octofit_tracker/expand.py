@@ -0,0 +1,69 @@
+from django.core.exceptions import ValidationError as DjangoValidationError
+from rest_framework.exceptions import ValidationError
+
+from .models import Team, User
+
+
+def parse_expand(request, allowed):
+    """
+    Read the ``?expand=`` query parameter as a set of relation names.
+
+    Unknown names are rejected so that typos do not silently return
+    unexpanded rows.
+    """
+    value = request.query_params.get('expand', '') if request is not None else ''
+    expand = {name.strip() for name in value.split(',') if name.strip()}
+    unknown = expand - set(allowed)
+    if unknown:
+        raise ValidationError({
+            'expand': f'Cannot expand {", ".join(sorted(unknown))}. '
+                      f'Choose from: {", ".join(allowed)}.'
+        })
+    return expand
+
+
+def _valid_ids(model, ids):
+    """Drop ids that cannot be a primary key of ``model``"""
+    pk = model._meta.pk
+    valid = set()
+    for value in ids:
+        if not value:
+            continue
+        try:
+            valid.add(pk.to_python(value))
+        except DjangoValidationError:
+            continue
+    return valid
+
+
+def _summaries(model, ids, fields):
+    """Fetch ``fields`` for all ``ids`` in one query, keyed by string id"""
+    ids = _valid_ids(model, ids)
+    if not ids:
+        return {}
+    return {
+        str(row['id']): {**row, 'id': str(row['id'])}
+        for row in model.objects.filter(id__in=ids).values('id', *fields)
+    }
+
+
+def load_expansions(objects, expand):
+    """
+    Resolve the users and teams referenced by ``objects``.
+
+    ``objects`` may carry a ``user_id`` (activities, leaderboard rows) or a
+    ``team_id`` (users). Each expanded relation costs one ``id__in`` query for
+    the whole page, never one per row.
+    """
+    expansions = {'expand': expand}
+    user_ids = {getattr(obj, 'user_id', None) for obj in objects} - {None}
+    team_ids = {getattr(obj, 'team_id', None) for obj in objects} - {None}
+
+    if user_ids and expand & {'user', 'team'}:
+        expansions['users'] = _summaries(User, user_ids, ['name', 'email', 'team_id'])
+        team_ids |= {user['team_id'] for user in expansions['users'].values()}
+
+    if 'team' in expand:
+        expansions['teams'] = _summaries(Team, team_ids, ['name', 'description'])
+
+    return expansions
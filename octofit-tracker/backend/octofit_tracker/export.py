@@ -0,0 +1,92 @@
+import csv
+import io
+import json
+import zlib
+
+from django.db.models import Q
+
+from .fastpath import row_serializer_for
+from .serializers import ActivitySerializer
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+def after_watermark(queryset, after_date=None, after_id=None):
+    """
+    Rows strictly after the ``(date, id)`` watermark, in watermark order.
+
+    Pass the date and id of the last exported row to resume an export.
+    """
+    if after_date is not None:
+        if after_id is not None:
+            queryset = queryset.filter(
+                Q(date__gt=after_date) | Q(date=after_date, id__gt=after_id)
+            )
+        else:
+            queryset = queryset.filter(date__gt=after_date)
+    return queryset.order_by('date', 'id')
+
+
+def iter_activities(queryset, chunk_size=2000):
+    """
+    Yield activities as API-shaped dicts, reading ``chunk_size`` rows at a
+    time through a server-side cursor so memory use stays flat.
+    """
+    row_serializer = row_serializer_for(ActivitySerializer)
+    for row in queryset.values(*row_serializer.sources).iterator(chunk_size=chunk_size):
+        yield row_serializer.to_representation(row)
+
+
+def ndjson_lines(items):
+    """One JSON document per line"""
+    for item in items:
+        yield json.dumps(item) + '\n'
+
+
+def csv_lines(items, fields=None):
+    """CSV with a header row, one line per item; columns default to the readable activity fields"""
+    fields = fields or row_serializer_for(ActivitySerializer).fields
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fields, extrasaction='ignore')
+    writer.writeheader()
+    for item in items:
+        writer.writerow(item)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+    yield buffer.getvalue()
+
+
+def encode_lines(items, output='ndjson'):
+    """Encode exported dicts as NDJSON or CSV text lines"""
+    if output == 'csv':
+        return csv_lines(items)
+    return ndjson_lines(items)
+
+
+def gzip_chunks(chunks):
+    """Gzip a stream of text chunks incrementally"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def batch_text(chunks, batch_bytes=64 * 1024):
+    """Join small text chunks into larger writes"""
+    parts = []
+    size = 0
+    for chunk in chunks:
+        parts.append(chunk)
+        size += len(chunk)
+        if size >= batch_bytes:
+            yield ''.join(parts)
+            parts = []
+            size = 0
+    if parts:
+        yield ''.join(parts)
@@ -0,0 +1,94 @@
+from rest_framework import serializers
+from rest_framework.response import Response
+
+from .profiling import timed
+
+_row_serializers = {}
+
+
+class RowSerializer:
+    """
+    Read-only serializer for ``.values()`` rows.
+
+    The field plan (output name, source column, representation function) is
+    taken from a ModelSerializer once, so rows come out exactly as the
+    serializer would render them, without per-row field binding, attribute
+    lookups or SerializerMethodField dispatch. Method fields are filled in by
+    the serializer's ``derive_row(row)``, which computes them in one pass.
+    """
+
+    def __init__(self, serializer_class):
+        fields = serializer_class().fields
+        self.plan = []
+        self.derive_row = None
+        sources = set()
+        for name, field in fields.items():
+            if field.write_only:
+                continue
+            if isinstance(field, serializers.SerializerMethodField):
+                self.derive_row = serializer_class.derive_row
+                self.plan.append((name, None, None))
+                continue
+            self.plan.append((name, field.source, field.to_representation))
+            sources.add(field.source)
+        if self.derive_row is not None:
+            sources.update(serializer_class.derive_row_sources)
+        self.sources = sources
+        # Output names in serializer order (write-only fields excluded)
+        self.fields = [name for name, _, _ in self.plan]
+
+    def to_representation(self, row):
+        derived = self.derive_row(row) if self.derive_row else None
+        data = {}
+        for name, source, to_representation in self.plan:
+            if source is None:
+                data[name] = derived[name]
+            else:
+                value = row[source]
+                data[name] = None if value is None else to_representation(value)
+        return data
+
+
+def row_serializer_for(serializer_class):
+    """Shared RowSerializer for ``serializer_class``"""
+    row_serializer = _row_serializers.get(serializer_class)
+    if row_serializer is None:
+        row_serializer = _row_serializers[serializer_class] = RowSerializer(serializer_class)
+    return row_serializer
+
+
+class FastListMixin:
+    """
+    Serves ``list`` from ``.values()`` rows through a RowSerializer.
+
+    Views fall back to the regular serializer whenever ``use_fast_list``
+    says so, e.g. when the response must embed related objects.
+    """
+    fast_list = True
+
+    def use_fast_list(self, request):
+        return self.fast_list and 'expand' not in request.query_params
+
+    def list(self, request, *args, **kwargs):
+        if not self.use_fast_list(request):
+            return super().list(request, *args, **kwargs)
+
+        row_serializer = row_serializer_for(self.get_serializer_class())
+        columns = set(row_serializer.sources)
+        ordering = getattr(self.paginator, 'ordering', None) or ()
+        if isinstance(ordering, str):
+            ordering = (ordering,)
+        columns.update(field.lstrip('-') for field in ordering)
+
+        rows = self.filter_queryset(self.get_queryset()).values(*columns)
+        page = self.paginate_queryset(rows)
+        if page is None:
+            rows = list(rows)
+        with timed('serialize'):
+            data = [
+                row_serializer.to_representation(row)
+                for row in (page if page is not None else rows)
+            ]
+        if page is not None:
+            return self.get_paginated_response(data)
+        return Response(data)
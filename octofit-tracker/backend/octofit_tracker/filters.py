@@ -0,0 +1,79 @@
+from datetime import datetime, time
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.exceptions import ValidationError
+
+
+def parse_date_param(name, value, end_of_day=False):
+    """
+    Parse an ISO date or datetime query parameter into an aware datetime.
+
+    A bare date (``2026-10-12``) means the start of that day, or its end when
+    ``end_of_day`` is set, so ``date_to=2026-10-12`` includes the whole day.
+    """
+    try:
+        # Bare dates first: parse_datetime() also accepts them, as midnight
+        day = parse_date(value)
+        if day is not None:
+            parsed = datetime.combine(day, time.max if end_of_day else time.min)
+        else:
+            parsed = parse_datetime(value)
+            if parsed is None:
+                raise ValueError
+    except ValueError:
+        raise ValidationError({name: f'Invalid date: {value!r}. Use YYYY-MM-DD or ISO 8601.'})
+
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed, timezone.get_default_timezone())
+    return parsed
+
+
+def activity_filter_values(params):
+    """
+    Parse the supported activity query parameters.
+
+    Returns a dict with ``user_id``, ``activity_types`` (a list), ``date_from``
+    and ``date_to`` (inclusive, aware datetimes); absent parameters are None.
+    """
+    activity_type = params.get('activity_type')
+    types = [value for value in activity_type.split(',') if value] if activity_type else []
+    date_from = params.get('date_from')
+    date_to = params.get('date_to')
+    return {
+        'user_id': params.get('user_id') or None,
+        'activity_types': types or None,
+        'date_from': parse_date_param('date_from', date_from) if date_from else None,
+        'date_to': parse_date_param('date_to', date_to, end_of_day=True) if date_to else None,
+    }
+
+
+def apply_activity_filters(queryset, values):
+    """Narrow ``queryset`` by parsed ``activity_filter_values``"""
+    if values['user_id']:
+        queryset = queryset.filter(user_id=values['user_id'])
+
+    types = values['activity_types']
+    if types:
+        if len(types) == 1:
+            queryset = queryset.filter(activity_type=types[0])
+        else:
+            queryset = queryset.filter(activity_type__in=types)
+
+    if values['date_from']:
+        queryset = queryset.filter(date__gte=values['date_from'])
+    if values['date_to']:
+        queryset = queryset.filter(date__lte=values['date_to'])
+    return queryset
+
+
+def filter_activities(queryset, params):
+    """
+    Push the supported activity query parameters down into the queryset.
+
+    Supported parameters: ``user_id``, ``activity_type`` (comma separated for
+    several types), ``date_from`` and ``date_to`` (inclusive). Each maps onto
+    the leading columns of the ``(user_id, date)`` and ``(activity_type, date)``
+    indexes on Activity.
+    """
+    return apply_activity_filters(queryset, activity_filter_values(params))
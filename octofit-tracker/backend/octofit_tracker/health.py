@@ -0,0 +1,145 @@
+"""
+Database health and MongoDB connection pool statistics.
+
+Pool numbers come from pymongo's connection pool monitoring events. The
+listener is registered globally when the app loads, so it sees both
+djongo's client and the repository's client; figures are per server
+address and per process.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, connection
+
+_pool_listener = None
+
+
+def is_mongo():
+    return settings.DATABASES['default']['ENGINE'] == 'djongo'
+
+
+def _new_pool_listener():
+    from pymongo import monitoring
+
+    class PoolStats(monitoring.ConnectionPoolListener):
+        """Counts pool events per server address"""
+
+        def __init__(self):
+            self.lock = threading.Lock()
+            self.pools = {}
+
+        def _pool(self, address):
+            pool = self.pools.get(address)
+            if pool is None:
+                pool = self.pools[address] = {
+                    'max_pool_size': None,
+                    'min_pool_size': None,
+                    'open': 0,
+                    'in_use': 0,
+                    'checkouts': 0,
+                    'checkout_failures': 0,
+                    'checkout_timeouts': 0,
+                    'cleared': 0,
+                }
+            return pool
+
+        def _count(self, address, **deltas):
+            with self.lock:
+                pool = self._pool(address)
+                for name, delta in deltas.items():
+                    pool[name] += delta
+
+        def pool_created(self, event):
+            with self.lock:
+                pool = self._pool(event.address)
+                pool['max_pool_size'] = event.options.get('maxPoolSize')
+                pool['min_pool_size'] = event.options.get('minPoolSize')
+
+        def pool_cleared(self, event):
+            self._count(event.address, cleared=1)
+
+        def pool_closed(self, event):
+            pass
+
+        def connection_created(self, event):
+            self._count(event.address, open=1)
+
+        def connection_ready(self, event):
+            pass
+
+        def connection_closed(self, event):
+            self._count(event.address, open=-1)
+
+        def connection_check_out_started(self, event):
+            pass
+
+        def connection_check_out_failed(self, event):
+            if event.reason == monitoring.ConnectionCheckOutFailedReason.TIMEOUT:
+                self._count(event.address, checkout_failures=1, checkout_timeouts=1)
+            else:
+                self._count(event.address, checkout_failures=1)
+
+        def connection_checked_out(self, event):
+            self._count(event.address, in_use=1, checkouts=1)
+
+        def connection_checked_in(self, event):
+            self._count(event.address, in_use=-1)
+
+        def snapshot(self):
+            with self.lock:
+                return [
+                    dict(pool, address=f'{host}:{port}', idle=pool['open'] - pool['in_use'])
+                    for (host, port), pool in self.pools.items()
+                ]
+
+    return PoolStats()
+
+
+def register_pool_listener():
+    """Start counting pool events for every Mongo client created from now on"""
+    global _pool_listener
+    if _pool_listener is None and is_mongo():
+        from pymongo import monitoring
+
+        _pool_listener = _new_pool_listener()
+        monitoring.register(_pool_listener)
+
+
+def pool_stats():
+    """Per-server pool statistics, or None when not running on MongoDB"""
+    if _pool_listener is None:
+        return None
+    return _pool_listener.snapshot()
+
+
+def ping():
+    """Round trip to the database; raises DatabaseError if it is unreachable"""
+    if is_mongo():
+        from pymongo.errors import PyMongoError
+
+        from .repository import mongo_client
+
+        try:
+            mongo_client().admin.command('ping')
+        except PyMongoError as exc:
+            raise DatabaseError(str(exc)) from exc
+    else:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+
+
+def database_health():
+    """``(healthy, report)`` for the default database"""
+    report = {
+        'engine': settings.DATABASES['default']['ENGINE'],
+        'pools': pool_stats(),
+    }
+    started = time.perf_counter()
+    try:
+        ping()
+    except DatabaseError as exc:
+        report['error'] = str(exc)
+        return False, report
+    report['ping_ms'] = round((time.perf_counter() - started) * 1000, 2)
+    return True, report
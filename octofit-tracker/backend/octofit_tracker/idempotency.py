@@ -0,0 +1,45 @@
+"""
+Idempotency keys for activity ingestion.
+
+Wearables retry uploads, so every activity carries a unique
+``idempotency_key``. A client may send its own key (the ``idempotency_key``
+field, or the ``Idempotency-Key`` header on a single POST), which is scoped
+to the activity's user. Otherwise the key is derived from the activity
+itself: ``user_id``, ``activity_type``, ``date`` to the second and
+``duration``. Either way the stored value is a SHA-256 hex digest, so client
+keys cannot collide with derived ones and the column has a fixed width.
+
+A retry is found with one lookup on the unique index, and the existing
+activity is returned instead of inserting a second copy.
+"""
+import hashlib
+from datetime import timezone as dt_timezone
+
+from django.utils import timezone
+
+KEY_LENGTH = 64
+
+
+def _digest(*parts):
+    return hashlib.sha256('\x1f'.join(str(part) for part in parts).encode()).hexdigest()
+
+
+def derived_key(user_id, activity_type, date, duration):
+    """Key for an activity without a client key: the same workout, uploaded again"""
+    if timezone.is_naive(date):
+        date = timezone.make_aware(date, dt_timezone.utc)
+    moment = date.astimezone(dt_timezone.utc).replace(microsecond=0).isoformat()
+    return _digest('activity', user_id, activity_type, moment, duration)
+
+
+def client_key(user_id, key):
+    """Key for a client-supplied idempotency key, scoped to the user"""
+    return _digest('client', user_id, key)
+
+
+def activity_key(attrs, key=None):
+    """The stored key for validated activity ``attrs``, given an optional client key"""
+    if key:
+        return client_key(attrs['user_id'], key)
+    return derived_key(attrs['user_id'], attrs['activity_type'], attrs['date'], attrs['duration'])
+
@@ -0,0 +1,683 @@
+from bisect import bisect_right
+from datetime import datetime, timedelta
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Case, Count, DateField, F, Q, Sum, Value, When
+from django.db.models.functions import TruncDay, TruncMonth, TruncWeek
+from django.utils import timezone
+
+from .caching import invalidate
+from .models import Activity, Leaderboard, LeaderboardBucket, RankLock, TeamLeaderboard, User
+from .repository import get_repository
+
+# Distinct points values whose ranks are counted by one aggregate query
+RANK_COUNT_CHUNK = 500
+
+BUCKET_PERIODS = {
+    'day': TruncDay,
+    'week': TruncWeek,
+    'month': TruncMonth,
+}
+
+
+def activity_points(activity):
+    """Points an activity contributes to the leaderboard (its calories)"""
+    return activity.calories or 0
+
+
+def _points_range(low, high):
+    """``low <= total_points < high``; ``low`` None leaves the range open below"""
+    condition = Q(total_points__lt=high)
+    if low is not None:
+        condition &= Q(total_points__gte=low)
+    return condition
+
+
+def _rank_shifts(moves):
+    """
+    Rank changes of the rows that do not move, given the moved rows'
+    ``(old_points, new_points)`` (``old_points`` None for a new row).
+
+    Under competition ranking a row's rank changes by the number of moved
+    rows that now have more points than it, minus the number that had more
+    before. Returns ``[(low, high, shift)]`` for the points ranges where that
+    is non-zero, from the highest range down.
+    """
+    steps = {}
+    for old_points, new_points in moves:
+        steps[new_points] = steps.get(new_points, 0) + 1
+        if old_points is not None:
+            steps[old_points] = steps.get(old_points, 0) - 1
+    bounds = sorted(steps, reverse=True)
+
+    shifts = []
+    shift = 0
+    for high, low in zip(bounds, bounds[1:] + [None]):
+        shift += steps[high]
+        if not shift:
+            continue
+        if shifts and shifts[-1][0] == high and shifts[-1][2] == shift:
+            shifts[-1] = (low, shifts[-1][1], shift)
+        else:
+            shifts.append((low, high, shift))
+    return shifts
+
+
+def _count_above(queryset, points_values):
+    """
+    Return ``{points: rows of queryset with more points}`` for each value,
+    counted by one query per RANK_COUNT_CHUNK values.
+    """
+    points_values = sorted(points_values)
+    if len(points_values) == 1:
+        return {points_values[0]: queryset.filter(total_points__gt=points_values[0]).count()}
+    above = {}
+    for offset in range(0, len(points_values), RANK_COUNT_CHUNK):
+        chunk = points_values[offset:offset + RANK_COUNT_CHUNK]
+        counts = queryset.aggregate(**{
+            f'above_{index}': Count('pk', filter=Q(total_points__gt=points))
+            for index, points in enumerate(chunk)
+        })
+        above.update((points, counts[f'above_{index}']) for index, points in enumerate(chunk))
+    return above
+
+
+def _lock_ranks(model):
+    """
+    Hold ``model``'s sentinel RankLock row until the transaction ends.
+
+    Rank shifts update ranges of rows, so two of them running at once lock
+    overlapping rows in different orders and can deadlock, or, without row
+    locks, both compute ranks from counts the other is about to change.
+    Taking this lock first serializes rank maintenance per table; callers
+    lock Leaderboard before TeamLeaderboard. Backends without SELECT ... FOR
+    UPDATE (djongo) ignore it, so concurrent writes there can leave ranks
+    off by a few places; find_mismatches() and the recompute_ranks and
+    rebuild_leaderboard commands detect and repair that.
+    """
+    RankLock.objects.select_for_update().get_or_create(table=model._meta.db_table)
+
+
+def _move_entries(model, key_field, deltas):
+    """
+    Apply points and counter deltas to several rows of a ranked table.
+
+    ``deltas`` maps each row's ``key_field`` value to ``(points_delta,
+    {counter: delta})``; missing rows are created. Ranks use competition
+    ranking (1 + number of rows with more points), so moving rows only
+    shifts the ranks of the rows whose points lie between their old and new
+    values. The rows are fetched with one query, every shift is applied by
+    one UPDATE, the moved rows' new ranks come from one count, and they are
+    written back with one bulk update and one bulk insert, however many rows
+    move. Must run in a transaction, which holds the table's rank lock
+    (_lock_ranks) until it ends. Returns ``{key: row}``.
+    """
+    deltas = {
+        key: (points_delta, counter_deltas)
+        for key, (points_delta, counter_deltas) in deltas.items()
+        if points_delta or any(counter_deltas.values())
+    }
+    if not deltas:
+        return {}
+
+    _lock_ranks(model)
+
+    entries = {
+        getattr(entry, key_field): entry
+        for entry in model.objects.select_for_update().filter(
+            **{f'{key_field}__in': list(deltas)}
+        ).order_by(key_field)
+    }
+    moves = []
+    counters = set()
+    for key, (points_delta, counter_deltas) in deltas.items():
+        entry = entries.get(key)
+        if entry is None:
+            entry = entries[key] = model(**{key_field: key}, total_points=0)
+            old_points = None
+        else:
+            old_points = entry.total_points
+        entry.total_points = (old_points or 0) + points_delta
+        for field, delta in counter_deltas.items():
+            setattr(entry, field, max((getattr(entry, field) or 0) + delta, 0))
+        counters.update(counter_deltas)
+        moves.append((old_points, entry.total_points))
+
+    others = model.objects.exclude(**{f'{key_field}__in': list(deltas)})
+    # update() and bulk_update() skip auto_now, so touch updated_at for change streams
+    now = timezone.now()
+    shifts = _rank_shifts(moves)
+    if len(shifts) == 1:
+        low, high, shift = shifts[0]
+        others.filter(_points_range(low, high)).update(rank=F('rank') + shift, updated_at=now)
+    elif shifts:
+        others.filter(_points_range(shifts[-1][0], shifts[0][1])).update(
+            rank=F('rank') + Case(
+                *(When(_points_range(low, high), then=Value(shift)) for low, high, shift in shifts),
+                default=Value(0),
+            ),
+            updated_at=now,
+        )
+
+    above = _count_above(others, {entry.total_points for entry in entries.values()})
+    moved_points = sorted(entry.total_points for entry in entries.values())
+    for entry in entries.values():
+        moved_above = len(moved_points) - bisect_right(moved_points, entry.total_points)
+        entry.rank = above[entry.total_points] + moved_above + 1
+        entry.updated_at = now
+        if isinstance(entry, TeamLeaderboard):
+            entry.update_average_points()
+
+    fields = ['total_points', 'rank', 'updated_at', *sorted(counters)]
+    if model is TeamLeaderboard:
+        fields.append('average_points')
+    model.objects.bulk_update([entry for entry in entries.values() if entry.pk], fields)
+    model.objects.bulk_create([entry for entry in entries.values() if not entry.pk])
+    return entries
+
+
+def _move_entry(model, lookup, points_delta, **counter_deltas):
+    """Apply a points delta (and counter deltas) to one row of a ranked table"""
+    (key_field, key), = lookup.items()
+    return _move_entries(model, key_field, {key: (points_delta, counter_deltas)}).get(key)
+
+
+def valid_user_ids(user_ids):
+    """The ids in ``user_ids`` that can be User primary keys (activities may name others)"""
+    valid_ids = []
+    for user_id in user_ids:
+        try:
+            User._meta.pk.to_python(user_id)
+        except ValidationError:
+            continue
+        valid_ids.append(user_id)
+    return valid_ids
+
+
+def teams_of(user_ids):
+    """Return ``{user_id: team_id}`` for the users in ``user_ids`` that have a team"""
+    rows = User.objects.filter(pk__in=valid_user_ids(user_ids)).exclude(
+        team_id__isnull=True
+    ).exclude(team_id='').values_list('pk', 'team_id')
+    return {str(pk): team_id for pk, team_id in rows}
+
+
+def apply_deltas(user_deltas):
+    """
+    Apply ``{user_id: (points_delta, activities_delta)}`` to the users'
+    leaderboard entries and to the entries of the teams they belong to.
+    """
+    team_deltas = {}
+    for user_id, team_id in teams_of(user_deltas).items():
+        points, count = user_deltas[user_id]
+        team_points, team_count = team_deltas.get(team_id, (0, 0))
+        team_deltas[team_id] = (team_points + points, team_count + count)
+
+    with transaction.atomic():
+        entries = _move_entries(Leaderboard, 'user_id', {
+            user_id: (points, {'total_activities': count})
+            for user_id, (points, count) in user_deltas.items()
+        })
+        _move_entries(TeamLeaderboard, 'team_id', {
+            team_id: (points, {'total_activities': count})
+            for team_id, (points, count) in team_deltas.items()
+        })
+    return entries
+
+
+def record_membership_change(user_id, old_team_id, new_team_id):
+    """
+    Move a user, with their current points, from one team's totals to another.
+
+    Either team id may be empty when a user joins their first team or leaves
+    without joining another.
+    """
+    if old_team_id == new_team_id:
+        return
+
+    with transaction.atomic():
+        entry = Leaderboard.objects.filter(user_id=user_id).first()
+        points = entry.total_points if entry else 0
+        activities = entry.total_activities if entry else 0
+        if old_team_id:
+            _move_entry(
+                TeamLeaderboard, {'team_id': old_team_id}, -points,
+                total_activities=-activities, member_count=-1
+            )
+        if new_team_id:
+            _move_entry(
+                TeamLeaderboard, {'team_id': new_team_id}, points,
+                total_activities=activities, member_count=1
+            )
+    invalidate('team-leaderboard')
+
+
+def record_team_deleted(team_id):
+    """
+    Drop a deleted team's standings and close the gap in the ranking.
+
+    The team's members are left without a team, so their later activities
+    do not bring the team's row back.
+    """
+    with transaction.atomic():
+        User.objects.filter(team_id=team_id).update(team_id=None)
+        _lock_ranks(TeamLeaderboard)
+        entry = TeamLeaderboard.objects.select_for_update().filter(team_id=team_id).first()
+        if entry is not None:
+            TeamLeaderboard.objects.filter(
+                total_points__lt=entry.total_points
+            ).update(rank=F('rank') - 1, updated_at=timezone.now())
+            entry.delete()
+    # Members are updated with update(), which sends no signals
+    invalidate('leaderboard', 'team-leaderboard')
+
+
+def period_starts(moment):
+    """Return ``{period: start date}`` of the buckets a date or datetime falls in"""
+    if isinstance(moment, datetime):
+        day = timezone.localtime(moment).date() if timezone.is_aware(moment) else moment.date()
+    else:
+        day = moment
+    return {
+        'day': day,
+        'week': day - timedelta(days=day.weekday()),
+        'month': day.replace(day=1),
+    }
+
+
+def apply_bucket_deltas(bucket_deltas):
+    """
+    Add ``{(user_id, period, period_start): (points_delta, activities_delta)}``
+    to the rollup buckets, creating them on first use.
+    """
+    bucket_deltas = {key: delta for key, delta in bucket_deltas.items() if any(delta)}
+    if not bucket_deltas:
+        return
+    windows = Q()
+    for period, start in {(period, start) for _, period, start in bucket_deltas}:
+        windows |= Q(period=period, period_start=start)
+    buckets = {
+        (bucket.user_id, bucket.period, bucket.period_start): bucket
+        for bucket in LeaderboardBucket.objects.select_for_update().filter(
+            windows, user_id__in={user_id for user_id, _, _ in bucket_deltas}
+        ).order_by('id')
+    }
+
+    changed = []
+    created = []
+    for (user_id, period, start), (points, count) in bucket_deltas.items():
+        bucket = buckets.get((user_id, period, start))
+        if bucket is None:
+            created.append(LeaderboardBucket(
+                user_id=user_id,
+                period=period,
+                period_start=start,
+                total_points=points,
+                total_activities=count,
+            ))
+        else:
+            bucket.total_points += points
+            bucket.total_activities += count
+            changed.append(bucket)
+    LeaderboardBucket.objects.bulk_update(changed, ['total_points', 'total_activities'])
+    LeaderboardBucket.objects.bulk_create(created)
+
+
+def record_activity_changes(added=(), removed=()):
+    """
+    Apply added and removed activities to the leaderboard and rollup buckets.
+
+    Deltas are summed per user and per bucket first and then applied to all
+    affected rows together, so the number of queries does not depend on how
+    many activities or users a call covers.
+    """
+    user_deltas = {}
+    bucket_deltas = {}
+    for activities, sign in ((added, 1), (removed, -1)):
+        for activity in activities:
+            points = sign * activity_points(activity)
+            user_points, user_count = user_deltas.get(activity.user_id, (0, 0))
+            user_deltas[activity.user_id] = (user_points + points, user_count + sign)
+            for period, start in period_starts(activity.date).items():
+                key = (activity.user_id, period, start)
+                bucket_points, bucket_count = bucket_deltas.get(key, (0, 0))
+                bucket_deltas[key] = (bucket_points + points, bucket_count + sign)
+
+    with transaction.atomic():
+        apply_deltas(user_deltas)
+        apply_bucket_deltas(bucket_deltas)
+    # Rows are written with update() and bulk operations, which send no signals
+    invalidate('leaderboard', 'team-leaderboard')
+    return len(user_deltas)
+
+
+def record_activity_created(activity):
+    """Add a newly stored activity to its user's leaderboard totals"""
+    return record_activity_changes(added=[activity])
+
+
+def record_activities_created(activities):
+    """Add a batch of new activities to the leaderboard"""
+    return record_activity_changes(added=activities)
+
+
+def record_activity_deleted(activity):
+    """Remove a deleted activity from its user's leaderboard totals"""
+    return record_activity_changes(removed=[activity])
+
+
+def record_activity_updated(old_activity, activity):
+    """
+    Replace an edited activity's contribution, possibly moving it between
+    users or buckets. ``old_activity`` is a copy taken before the edit.
+    """
+    return record_activity_changes(added=[activity], removed=[old_activity])
+
+
+def compute_totals():
+    """Aggregate every user's totals from the Activity table"""
+    rows = (
+        Activity.objects.values('user_id')
+        .annotate(total_points=Sum('calories'), total_activities=Count('id'))
+        .order_by()
+    )
+    return {
+        row['user_id']: (row['total_points'] or 0, row['total_activities'])
+        for row in rows
+    }
+
+
+RANKING_METHODS = ('competition', 'dense')
+
+
+def ranked(items, points, method='competition'):
+    """
+    Yield ``(item, rank)`` for ``items`` sorted from most to fewest points,
+    where ``points(item)`` gives an item's points.
+
+    Ties share a rank either way. Competition ranking ("1224") skips the
+    ranks taken by the tied rows; dense ranking ("1223") does not.
+    """
+    if method not in RANKING_METHODS:
+        raise ValueError(f'Unknown ranking method: {method}')
+    previous_points = None
+    rank = 0
+    for position, item in enumerate(items, start=1):
+        value = points(item)
+        if value != previous_points:
+            rank = position if method == 'competition' else rank + 1
+            previous_points = value
+        yield item, rank
+
+
+def assign_ranks(totals, method='competition'):
+    """Return ``{user_id: rank}`` ranking ``totals`` by points"""
+    ordered = sorted(totals.items(), key=lambda item: -item[1])
+    return {
+        user_id: rank
+        for (user_id, _), rank in ranked(ordered, lambda item: item[1], method)
+    }
+
+
+def compute_team_totals(totals):
+    """
+    Aggregate per-team totals from per-user ``totals``.
+
+    Returns ``{team_id: (points, activities, member_count)}`` for every team
+    with at least one member.
+    """
+    team_totals = {}
+    for user_id, team_id in User.objects.exclude(team_id__isnull=True).exclude(
+        team_id=''
+    ).values_list('id', 'team_id').iterator():
+        points, count = totals.get(str(user_id), (0, 0))
+        team_points, team_count, members = team_totals.get(team_id, (0, 0, 0))
+        team_totals[team_id] = (team_points + points, team_count + count, members + 1)
+    return team_totals
+
+
+def find_mismatches():
+    """Compare stored leaderboard rows with totals recomputed from activities"""
+    totals = compute_totals()
+    ranks = assign_ranks({user_id: points for user_id, (points, _) in totals.items()})
+    entries = {
+        entry.user_id: (entry.total_points, entry.total_activities, entry.rank)
+        for entry in Leaderboard.objects.all()
+    }
+
+    mismatches = []
+    for user_id in sorted(set(totals) | set(entries)):
+        actual = entries.get(user_id)
+        if user_id in totals:
+            points, count = totals[user_id]
+            expected = (points, count, ranks[user_id])
+        elif actual[:2] == (0, 0):
+            # Users whose activities were all deleted keep an empty row
+            continue
+        else:
+            expected = None
+        if actual != expected:
+            mismatches.append((user_id, actual, expected))
+    return mismatches
+
+
+def find_team_mismatches():
+    """Compare stored team standings with totals recomputed from activities"""
+    team_totals = compute_team_totals(compute_totals())
+    ranks = assign_ranks({team_id: points for team_id, (points, _, _) in team_totals.items()})
+    entries = {
+        entry.team_id: (entry.total_points, entry.total_activities, entry.member_count, entry.rank)
+        for entry in TeamLeaderboard.objects.all()
+    }
+
+    mismatches = []
+    for team_id in sorted(set(team_totals) | set(entries)):
+        actual = entries.get(team_id)
+        if team_id in team_totals:
+            expected = (*team_totals[team_id], ranks[team_id])
+        elif actual[:3] == (0, 0, 0):
+            # Teams whose members all left keep an empty row
+            continue
+        else:
+            expected = None
+        if actual != expected:
+            mismatches.append((team_id, actual, expected))
+    return mismatches
+
+
+def rebuild_leaderboard(batch_size=None):
+    """Recompute every user and team leaderboard row from scratch"""
+    totals = compute_totals()
+    ranks = assign_ranks({user_id: points for user_id, (points, _) in totals.items()})
+
+    with transaction.atomic():
+        _lock_ranks(Leaderboard)
+        Leaderboard.objects.all().delete()
+        Leaderboard.objects.bulk_create([
+            Leaderboard(
+                user_id=user_id,
+                total_points=points,
+                total_activities=count,
+                rank=ranks[user_id],
+            )
+            for user_id, (points, count) in totals.items()
+        ], batch_size=batch_size)
+        rebuild_team_leaderboard(totals, batch_size=batch_size)
+        rebuild_buckets(batch_size=batch_size)
+    invalidate('leaderboard', 'team-leaderboard')
+    return len(totals)
+
+
+def rebuild_team_leaderboard(totals=None, batch_size=None):
+    """Recompute every team leaderboard row from per-user totals"""
+    if totals is None:
+        totals = compute_totals()
+    team_totals = compute_team_totals(totals)
+    ranks = assign_ranks({team_id: points for team_id, (points, _, _) in team_totals.items()})
+
+    with transaction.atomic():
+        _lock_ranks(TeamLeaderboard)
+        TeamLeaderboard.objects.all().delete()
+        TeamLeaderboard.objects.bulk_create([
+            TeamLeaderboard(
+                team_id=team_id,
+                total_points=points,
+                total_activities=count,
+                member_count=members,
+                average_points=points / members,
+                rank=ranks[team_id],
+            )
+            for team_id, (points, count, members) in team_totals.items()
+        ], batch_size=batch_size)
+    invalidate('team-leaderboard')
+    return len(team_totals)
+
+
+def rebuild_buckets(batch_size=None):
+    """Recompute every daily, weekly and monthly rollup bucket"""
+    with transaction.atomic():
+        LeaderboardBucket.objects.all().delete()
+        count = 0
+        for period, trunc in BUCKET_PERIODS.items():
+            rows = (
+                Activity.objects
+                .annotate(period_start=trunc('date', output_field=DateField()))
+                .values('user_id', 'period_start')
+                .annotate(total_points=Sum('calories'), total_activities=Count('id'))
+                .order_by()
+            )
+            buckets = [
+                LeaderboardBucket(
+                    user_id=row['user_id'],
+                    period=period,
+                    period_start=row['period_start'],
+                    total_points=row['total_points'] or 0,
+                    total_activities=row['total_activities'],
+                )
+                for row in rows
+            ]
+            LeaderboardBucket.objects.bulk_create(buckets, batch_size=batch_size)
+            count += len(buckets)
+    return count
+
+
+def window_queryset(period, at):
+    """Rollup buckets of ``period`` containing the date ``at``"""
+    return LeaderboardBucket.objects.filter(
+        period=period, period_start=period_starts(at)[period]
+    )
+
+
+def rank_window_page(queryset, rows):
+    """
+    Attach competition ranks to a page of buckets sorted by points.
+
+    Two indexed counts locate the page's first points value in the whole
+    window; ranks for the rest of the page follow from the page itself.
+    """
+    if not rows:
+        return rows
+    top_points = rows[0].total_points
+    above = queryset.filter(total_points__gt=top_points).count()
+    tied = queryset.filter(total_points=top_points).count()
+
+    rank = above + 1
+    seen_below_top = 0
+    previous_points = top_points
+    for row in rows:
+        if row.total_points != previous_points:
+            # Everyone above the top value, tied with it, and earlier in
+            # this page below it outranks this row
+            rank = above + tied + seen_below_top + 1
+            previous_points = row.total_points
+        if row.total_points != top_points:
+            seen_below_top += 1
+        row.rank = rank
+    return rows
+
+
+def apply_dense_ranks(queryset, rows):
+    """
+    Replace the ranks of serialized ``rows`` (sorted from most to fewest
+    points) by dense ranks ("1223") within ``queryset``.
+
+    Only competition ranks are stored, since those are what the incremental
+    updates maintain. A row's dense rank is one more than the number of
+    distinct point values above it, so one count of the distinct values
+    above the first row ranks the whole page.
+    """
+    if not rows:
+        return rows
+    previous_points = rows[0]['total_points']
+    rank = queryset.filter(total_points__gt=previous_points).values(
+        'total_points'
+    ).distinct().count() + 1
+    for row in rows:
+        if row['total_points'] != previous_points:
+            rank += 1
+            previous_points = row['total_points']
+        row['rank'] = rank
+    return rows
+
+
+def recompute_ranks(model=Leaderboard, batch_size=1000):
+    """
+    Re-rank every row of ``model`` by points and store the competition
+    ranks that changed.
+
+    Rows are streamed as ``(id, total_points, rank)`` tuples in points order,
+    so memory holds one batch of changes rather than the whole table, and
+    only rows whose rank differs are written, ``batch_size`` at a time,
+    through the repository (prepared UPDATEs, or a Mongo bulk write).
+    Dense ranks are computed when read (apply_dense_ranks). Returns
+    ``(rows, changed)``.
+    """
+    repository = get_repository()
+    rows = model.objects.order_by('-total_points', 'id').values_list(
+        'id', 'total_points', 'rank'
+    ).iterator(chunk_size=batch_size)
+
+    changes = []
+    seen = changed = 0
+    for (row_id, _, stored_rank), rank in ranked(rows, lambda row: row[1]):
+        seen += 1
+        if rank != stored_rank:
+            changes.append((row_id, rank))
+            if len(changes) >= batch_size:
+                repository.set_ranks(model, changes)
+                changed += len(changes)
+                changes = []
+    if changes:
+        repository.set_ranks(model, changes)
+        changed += len(changes)
+
+    if changed:
+        invalidate('leaderboard' if model is Leaderboard else 'team-leaderboard')
+    return seen, changed
+
+
+def top_entries(limit):
+    """The first ``limit`` leaderboard rows, read along the (rank, id) index"""
+    return list(Leaderboard.objects.order_by('rank', 'id')[:limit])
+
+
+def entries_around(user_id, radius):
+    """
+    ``user_id``'s leaderboard row with up to ``radius`` rows either side of it
+    in (rank, id) order, or None if the user has no row.
+
+    Each side is a bounded range scan on the (rank, id) index starting at the
+    user's position, so the cost depends on ``radius``, not on the number of
+    users.
+    """
+    entry = Leaderboard.objects.filter(user_id=user_id).first()
+    if entry is None:
+        return None
+    above = Leaderboard.objects.filter(rank__lte=entry.rank).filter(
+        Q(rank__lt=entry.rank) | Q(id__lt=entry.id)
+    ).order_by('-rank', '-id')[:radius]
+    below = Leaderboard.objects.filter(rank__gte=entry.rank).filter(
+        Q(rank__gt=entry.rank) | Q(id__gt=entry.id)
+    ).order_by('rank', 'id')[:radius]
+    return list(reversed(above)) + [entry] + list(below)
@@ -0,0 +1,163 @@
+import json
+import random
+import time
+import tracemalloc
+from datetime import datetime, time as day_time
+from io import StringIO
+from pathlib import Path
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+from django.test.utils import setup_databases, teardown_databases
+from django.utils import timezone
+
+from octofit_tracker import benchmarks
+from octofit_tracker.models import Activity, User
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the REST API on a seeded test database and compare the '
+        'results with a stored baseline'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--size',
+            choices=sorted(benchmarks.DATASETS),
+            default='1k',
+            help='Number of activities to seed (default: %(default)s)',
+        )
+        parser.add_argument(
+            '--scenario',
+            action='append',
+            choices=sorted(benchmarks.SCENARIOS),
+            help='Scenario to run; repeat for several (default: all)',
+        )
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=200,
+            help='Requests per read scenario (default: %(default)s)',
+        )
+        parser.add_argument(
+            '--baseline',
+            default=None,
+            help='Baseline JSON file (default: benchmarks/baseline-<size>.json)',
+        )
+        parser.add_argument(
+            '--save-baseline',
+            action='store_true',
+            help='Write the results as the new baseline instead of comparing; refused if any request failed',
+        )
+        parser.add_argument(
+            '--tolerance',
+            type=float,
+            default=0.25,
+            help='Allowed relative growth of p95/p99 latency and memory (default: %(default)s)',
+        )
+        parser.add_argument(
+            '--trace-memory',
+            action='store_true',
+            help='Record peak Python memory per scenario with tracemalloc (slows requests)',
+        )
+        parser.add_argument(
+            '--keepdb',
+            action='store_true',
+            help='Keep the seeded test database for the next run',
+        )
+
+    def handle(self, *args, **options):
+        size = options['size']
+        baseline_path = Path(
+            options['baseline'] or settings.BASE_DIR / 'benchmarks' / f'baseline-{size}.json'
+        )
+
+        # The benchmark runs against its own test database (test_<NAME>), so
+        # it never touches real data and works offline against a local server
+        old_config = setup_databases(verbosity=0, interactive=False, keepdb=options['keepdb'])
+        try:
+            with override_settings(ALLOWED_HOSTS=['testserver'], DEBUG=False):
+                self.seed(size)
+                results = self.run_scenarios(options)
+        finally:
+            teardown_databases(old_config, verbosity=0, keepdb=options['keepdb'])
+
+        if options['save_baseline']:
+            failed = sorted(name for name, result in results.items() if result['errors'])
+            if failed:
+                raise CommandError(
+                    f'Not saving a baseline with failed requests in: {", ".join(failed)}'
+                )
+            baseline_path.parent.mkdir(parents=True, exist_ok=True)
+            baseline_path.write_text(json.dumps(results, indent=2, sort_keys=True) + '\n')
+            self.stdout.write(self.style.SUCCESS(f'Baseline written to {baseline_path}'))
+            return
+
+        if not baseline_path.exists():
+            self.stdout.write(f'No baseline at {baseline_path}; run with --save-baseline to create one')
+            return
+        regressions = benchmarks.compare(
+            results, json.loads(baseline_path.read_text()), options['tolerance']
+        )
+        for regression in regressions:
+            self.stdout.write(self.style.ERROR(regression))
+        if regressions:
+            raise CommandError(f'{len(regressions)} benchmark regressions against {baseline_path}')
+        self.stdout.write(self.style.SUCCESS(f'No regressions against {baseline_path}'))
+
+    def seed(self, size):
+        users, per_user = benchmarks.DATASETS[size]
+        if User.objects.count() == users and Activity.objects.count() == users * per_user:
+            self.stdout.write(f'Reusing seeded {size} dataset')
+            return
+        self.stdout.write(f'Seeding {size} dataset ({users} users x {per_user} activities)...')
+        call_command(
+            'populate_db',
+            users=users,
+            activities_per_user=per_user,
+            seed=benchmarks.SEED,
+            end_date=benchmarks.END_DATE,
+            stdout=StringIO(),
+        )
+
+    def run_scenarios(self, options):
+        end_date = timezone.make_aware(datetime.combine(
+            datetime.strptime(benchmarks.END_DATE, '%Y-%m-%d').date(), day_time(23, 59)
+        ))
+        user_ids = [str(user_id) for user_id in User.objects.order_by('id').values_list('id', flat=True)]
+        results = {}
+        for name in options['scenario'] or list(benchmarks.SCENARIOS):
+            caches[settings.OCTOFIT_API_CACHE_ALIAS].clear()
+            context = {
+                'rng': random.Random(benchmarks.SEED),
+                'requests': options['requests'],
+                'user_ids': user_ids,
+                'end_date': end_date,
+            }
+            if options['trace_memory']:
+                tracemalloc.start()
+            started = time.perf_counter()
+            try:
+                samples = benchmarks.SCENARIOS[name](context)
+                elapsed = time.perf_counter() - started
+                traced_peak = tracemalloc.get_traced_memory()[1] if options['trace_memory'] else None
+            finally:
+                if options['trace_memory']:
+                    tracemalloc.stop()
+            result = results[name] = benchmarks.summarize(samples, elapsed, traced_peak)
+            self.report(name, result)
+        return results
+
+    def report(self, name, result):
+        memory = f'  peak {result["traced_peak_mb"]:7.2f} MB' if result['traced_peak_mb'] is not None else ''
+        self.stdout.write(
+            f'{name:26} {result["requests"]:5} req  {result["throughput"]:8.1f} req/s  '
+            f'p50 {result["p50_ms"]:7.2f}  p95 {result["p95_ms"]:7.2f}  p99 {result["p99_ms"]:7.2f} ms  '
+            f'{result["queries_per_request"]:5.1f} queries/req  '
+            f'{result["round_trips_per_request"]:5.1f} mongo/req  '
+            f'errors {result["errors"]}{memory}'
+        )
@@ -0,0 +1,132 @@
+import asyncio
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient, Client, override_settings
+from django.urls import reverse
+
+ENDPOINTS = {
+    'leaderboard': ('leaderboard-list', 'async-leaderboard-list'),
+    'activities': ('activity-list', 'async-activity-list'),
+    'workouts': ('workout-list', 'async-workout-list'),
+}
+
+
+class ThreadSampler:
+    """Records the peak number of live threads while a benchmark runs"""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak = threading.active_count()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, threading.active_count())
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+
+class Command(BaseCommand):
+    help = 'Compare the sync (WSGI) and async (ASGI) read endpoints under concurrent polling'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--endpoint',
+            choices=sorted(ENDPOINTS),
+            default='leaderboard',
+            help='Endpoint to poll (default: %(default)s)',
+        )
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=500,
+            help='Total requests per path (default: %(default)s)',
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=50,
+            help='Requests in flight at once (default: %(default)s)',
+        )
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=25,
+            help='Rows per response (default: %(default)s)',
+        )
+
+    def handle(self, *args, **options):
+        sync_name, async_name = ENDPOINTS[options['endpoint']]
+        params = {'page_size': options['limit']}
+        total, concurrency = options['requests'], options['concurrency']
+
+        self.stdout.write(
+            f'Polling {options["endpoint"]}: {total} requests, concurrency {concurrency}'
+        )
+        # The in-process test clients send Host: testserver; DEBUG would
+        # record every query, and the response cache would hide the sync
+        # path's database work
+        with override_settings(
+            ALLOWED_HOSTS=['testserver'], DEBUG=False, OCTOFIT_API_CACHE_ENABLED=False
+        ):
+            self.report('WSGI (threads)', *self.run_sync(reverse(sync_name), params, total, concurrency))
+            self.report('ASGI (async)', *self.run_async(reverse(async_name), params, total, concurrency))
+
+    def run_sync(self, url, params, total, concurrency):
+        client = Client()
+        client.get(url, params)  # warm up
+
+        def timed(_):
+            start = time.perf_counter()
+            response = client.get(url, params)
+            return time.perf_counter() - start, response.status_code
+
+        with ThreadSampler() as sampler:
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                results = list(pool.map(timed, range(total)))
+            elapsed = time.perf_counter() - start
+        return results, elapsed, sampler.peak
+
+    def run_async(self, url, params, total, concurrency):
+        client = AsyncClient()
+
+        async def main():
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def timed():
+                async with semaphore:
+                    start = time.perf_counter()
+                    response = await client.get(url, params)
+                    return time.perf_counter() - start, response.status_code
+
+            await client.get(url, params)  # warm up
+            start = time.perf_counter()
+            results = await asyncio.gather(*(timed() for _ in range(total)))
+            return results, time.perf_counter() - start
+
+        with ThreadSampler() as sampler:
+            results, elapsed = asyncio.run(main())
+        return results, elapsed, sampler.peak
+
+    def report(self, label, results, elapsed, peak_threads):
+        latencies = sorted(duration * 1000 for duration, _ in results)
+        errors = sum(1 for _, status_code in results if status_code != 200)
+        quantiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+        self.stdout.write(
+            f'{label:16} {len(results) / elapsed:8.1f} req/s  '
+            f'p50 {quantiles[49]:7.2f} ms  p95 {quantiles[94]:7.2f} ms  '
+            f'peak threads {peak_threads:4}  errors {errors}'
+        )
@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from octofit_tracker import writebehind
+
+
+class Command(BaseCommand):
+    help = 'Store every activity waiting in the write-behind queue'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=settings.OCTOFIT_WRITE_BEHIND_BATCH_SIZE,
+            help='Activities stored per insert and leaderboard update',
+        )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be >= 1')
+        queue = writebehind.get_queue()
+        stored = writebehind.drain(queue, options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Drained {stored} queued activities, {queue.pending()} still queued (claimed elsewhere or waiting to retry), '
+            f'{queue.dead_lettered()} in the dead-letter table'
+        ))
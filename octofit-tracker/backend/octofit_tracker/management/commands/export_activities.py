@@ -0,0 +1,102 @@
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.exceptions import ValidationError
+
+from octofit_tracker import export
+from octofit_tracker.filters import parse_date_param
+from octofit_tracker.models import Activity
+
+
+class Command(BaseCommand):
+    help = 'Stream activities to NDJSON or CSV, optionally gzipped, with resumable watermarks'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--format',
+            choices=sorted(export.EXPORT_FORMATS),
+            default='ndjson',
+            help='Output format (default: %(default)s)',
+        )
+        parser.add_argument(
+            '--gzip',
+            action='store_true',
+            help='Gzip the output',
+        )
+        parser.add_argument(
+            '--output',
+            default='-',
+            help='File to write, or - for stdout (default)',
+        )
+        parser.add_argument(
+            '--after-date',
+            default=None,
+            help='Resume after this activity date (ISO 8601), as printed by a previous run',
+        )
+        parser.add_argument(
+            '--after-id',
+            type=int,
+            default=None,
+            help='Resume after this activity id within --after-date',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=settings.OCTOFIT_EXPORT_CHUNK_SIZE,
+            help='Rows fetched per database round trip (default: %(default)s)',
+        )
+
+    def handle(self, *args, **options):
+        after_date = options['after_date']
+        if after_date:
+            try:
+                after_date = parse_date_param('after_date', after_date)
+            except ValidationError:
+                raise CommandError(f'Invalid --after-date {after_date!r}')
+
+        queryset = export.after_watermark(
+            Activity.objects.all(), after_date, options['after_id']
+        )
+
+        watermark = {}
+        count = 0
+
+        def tracked(items):
+            nonlocal count
+            for item in items:
+                watermark['date'], watermark['id'] = item['date'], item['id']
+                count += 1
+                yield item
+
+        chunks = export.batch_text(export.encode_lines(
+            tracked(export.iter_activities(queryset, options['chunk_size'])),
+            options['format'],
+        ))
+
+        if options['gzip']:
+            self.write_output(options['output'], export.gzip_chunks(chunks), binary=True)
+        else:
+            self.write_output(options['output'], chunks, binary=False)
+
+        self.stderr.write(f'Exported {count} activities')
+        if watermark:
+            self.stderr.write(
+                f'Resume with: --after-date {watermark["date"]} --after-id {watermark["id"]}'
+            )
+
+    def write_output(self, path, chunks, binary):
+        """Write chunks to ``path``, or to stdout when it is ``-``"""
+        if path == '-':
+            if binary:
+                for data in chunks:
+                    sys.stdout.buffer.write(data)
+                sys.stdout.buffer.flush()
+            else:
+                for chunk in chunks:
+                    self.stdout.write(chunk, ending='')
+            return
+
+        with open(path, 'wb') if binary else open(path, 'w', newline='') as out:
+            for chunk in chunks:
+                out.write(chunk)
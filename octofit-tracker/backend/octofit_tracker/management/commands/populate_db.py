@@ -1,14 +1,148 @@
-from django.core.management.base import BaseCommand
+from datetime import datetime, time, timedelta
+import random
+
+from django.core.management.base import BaseCommand, CommandError
 from django.utils import timezone
+from octofit_tracker.leaderboard import rebuild_leaderboard
 from octofit_tracker.models import User, Team, Activity, Leaderboard, Workout
-from datetime import timedelta
-import random
+
+
+TEAMS = [
+    {
+        'name': 'Team Marvel',
+        'description': 'Earth\'s Mightiest Heroes fighting for fitness!'
+    },
+    {
+        'name': 'Team DC',
+        'description': 'Justice League members dedicated to peak performance!'
+    },
+]
+
+# Heroes are used first, alternating between the two teams; any further
+# users are synthetic athletes.
+HEROES = [
+    {'name': 'Iron Man', 'email': 'ironman@avengers.com'},
+    {'name': 'Superman', 'email': 'superman@justiceleague.com'},
+    {'name': 'Captain America', 'email': 'cap@avengers.com'},
+    {'name': 'Batman', 'email': 'batman@justiceleague.com'},
+    {'name': 'Thor', 'email': 'thor@asgard.com'},
+    {'name': 'Wonder Woman', 'email': 'diana@justiceleague.com'},
+    {'name': 'Black Widow', 'email': 'natasha@avengers.com'},
+    {'name': 'The Flash', 'email': 'flash@justiceleague.com'},
+    {'name': 'Hulk', 'email': 'hulk@avengers.com'},
+    {'name': 'Aquaman', 'email': 'aquaman@justiceleague.com'},
+    {'name': 'Spider-Man', 'email': 'spidey@avengers.com'},
+    {'name': 'Green Lantern', 'email': 'hal@justiceleague.com'},
+]
+
+ACTIVITY_TYPES = ['Running', 'Cycling', 'Swimming', 'Weightlifting', 'Yoga', 'Combat Training']
+DISTANCE_TYPES = {'Running', 'Cycling', 'Swimming'}
+HISTORY_DAYS = 30
+
+WORKOUTS = [
+    {
+        'name': 'Super Soldier Cardio',
+        'description': 'High-intensity cardio workout inspired by Captain America\'s training',
+        'difficulty_level': 'Advanced',
+        'duration': 45,
+        'category': 'Cardio'
+    },
+    {
+        'name': 'Asgardian Strength Training',
+        'description': 'Build god-like strength with Thor\'s workout routine',
+        'difficulty_level': 'Advanced',
+        'duration': 60,
+        'category': 'Strength'
+    },
+    {
+        'name': 'Web-Slinger Agility',
+        'description': 'Improve flexibility and agility like Spider-Man',
+        'difficulty_level': 'Intermediate',
+        'duration': 30,
+        'category': 'Agility'
+    },
+    {
+        'name': 'Batcave Core Training',
+        'description': 'Bruce Wayne\'s core strengthening routine',
+        'difficulty_level': 'Intermediate',
+        'duration': 40,
+        'category': 'Core'
+    },
+    {
+        'name': 'Flash Speed Training',
+        'description': 'Sprint intervals to boost your speed',
+        'difficulty_level': 'Advanced',
+        'duration': 35,
+        'category': 'Speed'
+    },
+    {
+        'name': 'Wonder Woman Combat Basics',
+        'description': 'Learn basic combat moves and defensive techniques',
+        'difficulty_level': 'Beginner',
+        'duration': 50,
+        'category': 'Combat'
+    },
+    {
+        'name': 'Aquaman Swimming Mastery',
+        'description': 'Advanced swimming techniques for endurance',
+        'difficulty_level': 'Advanced',
+        'duration': 55,
+        'category': 'Swimming'
+    },
+    {
+        'name': 'Stark Industries Recovery Yoga',
+        'description': 'Gentle yoga for recovery and flexibility',
+        'difficulty_level': 'Beginner',
+        'duration': 25,
+        'category': 'Yoga'
+    },
+]
 
 
 class Command(BaseCommand):
     help = 'Populate the octofit_db database with test data'
 
-    def handle(self, *args, **kwargs):
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users',
+            type=int,
+            default=len(HEROES),
+            help='Number of users to create (default: the %(default)s heroes)',
+        )
+        parser.add_argument(
+            '--activities-per-user',
+            type=int,
+            default=None,
+            help='Activities per user (default: a random 5-10 for each user)',
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=None,
+            help='Random seed; the same seed and --end-date reproduce the same data',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Rows per bulk insert (default: %(default)s)',
+        )
+        parser.add_argument(
+            '--end-date',
+            default=None,
+            help='Latest activity date as YYYY-MM-DD (default: today)',
+        )
+
+    def handle(self, *args, **options):
+        num_users = options['users']
+        per_user = options['activities_per_user']
+        batch_size = options['batch_size']
+        if num_users < 0 or batch_size < 1 or (per_user is not None and per_user < 0):
+            raise CommandError('--users and --activities-per-user must be >= 0 and --batch-size >= 1')
+
+        rng = random.Random(options['seed'])
+        end_date = self.get_end_date(options['end_date'])
+
         self.stdout.write(self.style.SUCCESS('Starting database population...'))
         
         # Clear existing data
@@ -21,159 +155,51 @@ class Command(BaseCommand):
         
         # Create teams
         self.stdout.write('Creating teams...')
-        team_marvel = Team.objects.create(
-            name='Team Marvel',
-            description='Earth\'s Mightiest Heroes fighting for fitness!'
-        )
-        team_dc = Team.objects.create(
-            name='Team DC',
-            description='Justice League members dedicated to peak performance!'
-        )
+        Team.objects.bulk_create([Team(**team) for team in TEAMS])
+        team_ids_by_name = dict(Team.objects.values_list('name', 'id'))
+        team_ids = [str(team_ids_by_name[team['name']]) for team in TEAMS]
         
-        # Create users (superheroes)
-        self.stdout.write('Creating users...')
-        marvel_heroes = [
-            {'name': 'Iron Man', 'email': 'ironman@avengers.com'},
-            {'name': 'Captain America', 'email': 'cap@avengers.com'},
-            {'name': 'Thor', 'email': 'thor@asgard.com'},
-            {'name': 'Black Widow', 'email': 'natasha@avengers.com'},
-            {'name': 'Hulk', 'email': 'hulk@avengers.com'},
-            {'name': 'Spider-Man', 'email': 'spidey@avengers.com'},
-        ]
-        
-        dc_heroes = [
-            {'name': 'Superman', 'email': 'superman@justiceleague.com'},
-            {'name': 'Batman', 'email': 'batman@justiceleague.com'},
-            {'name': 'Wonder Woman', 'email': 'diana@justiceleague.com'},
-            {'name': 'The Flash', 'email': 'flash@justiceleague.com'},
-            {'name': 'Aquaman', 'email': 'aquaman@justiceleague.com'},
-            {'name': 'Green Lantern', 'email': 'hal@justiceleague.com'},
-        ]
-        
-        marvel_users = []
-        for hero in marvel_heroes:
-            user = User.objects.create(
-                name=hero['name'],
-                email=hero['email'],
-                team_id=str(team_marvel.id)
+        # Create users and their activities one batch of users at a time, so
+        # memory use stays flat however many rows are generated
+        self.stdout.write(f'Creating {num_users} users and their activities...')
+        users_done = 0
+        activities_done = 0
+        users_per_batch = max(1, batch_size // max(per_user or 8, 1))
+        for start in range(0, num_users, users_per_batch):
+            stop = min(start + users_per_batch, num_users)
+            users = [self.build_user(index, team_ids) for index in range(start, stop)]
+            User.objects.bulk_create(users, batch_size=batch_size)
+            user_ids = dict(
+                User.objects.filter(
+                    email__in=[user.email for user in users]
+                ).values_list('email', 'id')
             )
-            marvel_users.append(user)
-        
-        dc_users = []
-        for hero in dc_heroes:
-            user = User.objects.create(
-                name=hero['name'],
-                email=hero['email'],
-                team_id=str(team_dc.id)
-            )
-            dc_users.append(user)
-        
-        all_users = marvel_users + dc_users
-        
-        # Create activities
-        self.stdout.write('Creating activities...')
-        activity_types = ['Running', 'Cycling', 'Swimming', 'Weightlifting', 'Yoga', 'Combat Training']
-        
-        for user in all_users:
-            # Each user gets 5-10 activities
-            num_activities = random.randint(5, 10)
-            for i in range(num_activities):
-                activity_type = random.choice(activity_types)
-                duration = random.randint(20, 120)  # 20-120 minutes
-                distance = round(random.uniform(2, 20), 2) if activity_type in ['Running', 'Cycling', 'Swimming'] else None
-                calories = duration * random.randint(5, 15)  # Rough calculation
-                
-                Activity.objects.create(
-                    user_id=str(user.id),
-                    activity_type=activity_type,
-                    duration=duration,
-                    distance=distance,
-                    calories=calories,
-                    date=timezone.now() - timedelta(days=random.randint(0, 30))
+
+            activities = []
+            for user in users:
+                count = per_user if per_user is not None else rng.randint(5, 10)
+                activities.extend(
+                    self.build_activity(rng, str(user_ids[user.email]), end_date)
+                    for _ in range(count)
                 )
+            # Drop the rare random repeat that the unique idempotency key would reject
+            activities = list({activity.idempotency_key: activity for activity in activities}.values())
+            Activity.objects.bulk_create(activities, batch_size=batch_size)
+
+            users_done = stop
+            activities_done += len(activities)
+            self.stdout.write(
+                f'  {users_done}/{num_users} users, {activities_done} activities'
+            )
+            self.stdout.flush()
         
         # Create leaderboard entries
         self.stdout.write('Creating leaderboard entries...')
-        for user in all_users:
-            user_activities = Activity.objects.filter(user_id=str(user.id))
-            total_points = sum(activity.calories for activity in user_activities)
-            total_activities = user_activities.count()
-            
-            Leaderboard.objects.create(
-                user_id=str(user.id),
-                total_points=total_points,
-                total_activities=total_activities
-            )
-        
-        # Update ranks
-        leaderboard_entries = Leaderboard.objects.all().order_by('-total_points')
-        for rank, entry in enumerate(leaderboard_entries, start=1):
-            entry.rank = rank
-            entry.save()
+        rebuild_leaderboard(batch_size=batch_size)
         
         # Create workouts
         self.stdout.write('Creating workouts...')
-        workouts_data = [
-            {
-                'name': 'Super Soldier Cardio',
-                'description': 'High-intensity cardio workout inspired by Captain America\'s training',
-                'difficulty_level': 'Advanced',
-                'duration': 45,
-                'category': 'Cardio'
-            },
-            {
-                'name': 'Asgardian Strength Training',
-                'description': 'Build god-like strength with Thor\'s workout routine',
-                'difficulty_level': 'Advanced',
-                'duration': 60,
-                'category': 'Strength'
-            },
-            {
-                'name': 'Web-Slinger Agility',
-                'description': 'Improve flexibility and agility like Spider-Man',
-                'difficulty_level': 'Intermediate',
-                'duration': 30,
-                'category': 'Agility'
-            },
-            {
-                'name': 'Batcave Core Training',
-                'description': 'Bruce Wayne\'s core strengthening routine',
-                'difficulty_level': 'Intermediate',
-                'duration': 40,
-                'category': 'Core'
-            },
-            {
-                'name': 'Flash Speed Training',
-                'description': 'Sprint intervals to boost your speed',
-                'difficulty_level': 'Advanced',
-                'duration': 35,
-                'category': 'Speed'
-            },
-            {
-                'name': 'Wonder Woman Combat Basics',
-                'description': 'Learn basic combat moves and defensive techniques',
-                'difficulty_level': 'Beginner',
-                'duration': 50,
-                'category': 'Combat'
-            },
-            {
-                'name': 'Aquaman Swimming Mastery',
-                'description': 'Advanced swimming techniques for endurance',
-                'difficulty_level': 'Advanced',
-                'duration': 55,
-                'category': 'Swimming'
-            },
-            {
-                'name': 'Stark Industries Recovery Yoga',
-                'description': 'Gentle yoga for recovery and flexibility',
-                'difficulty_level': 'Beginner',
-                'duration': 25,
-                'category': 'Yoga'
-            },
-        ]
-        
-        for workout_data in workouts_data:
-            Workout.objects.create(**workout_data)
+        Workout.objects.bulk_create([Workout(**workout) for workout in WORKOUTS])
         
         # Print summary
         self.stdout.write(self.style.SUCCESS('\n=== Database Population Complete ==='))
@@ -183,3 +209,42 @@ class Command(BaseCommand):
         self.stdout.write(f'Leaderboard entries: {Leaderboard.objects.count()}')
         self.stdout.write(f'Workouts created: {Workout.objects.count()}')
         self.stdout.write(self.style.SUCCESS('\nDatabase successfully populated with superhero test data!'))
+
+    def get_end_date(self, value):
+        """Midnight after --end-date (or today), as an aware datetime"""
+        if value is None:
+            day = timezone.localdate()
+        else:
+            try:
+                day = datetime.strptime(value, '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError(f'Invalid --end-date {value!r}, expected YYYY-MM-DD')
+        return timezone.make_aware(datetime.combine(day, time.min)) + timedelta(days=1)
+
+    def build_user(self, index, team_ids):
+        """Hero for the first users, numbered synthetic athlete afterwards"""
+        if index < len(HEROES):
+            hero = HEROES[index]
+            name, email = hero['name'], hero['email']
+        else:
+            name = f'Athlete {index + 1}'
+            email = f'athlete{index + 1}@octofit.test'
+        return User(name=name, email=email, team_id=team_ids[index % len(team_ids)])
+
+    def build_activity(self, rng, user_id, end_date):
+        """Random activity for a user within the last HISTORY_DAYS days"""
+        activity_type = rng.choice(ACTIVITY_TYPES)
+        duration = rng.randint(20, 120)  # 20-120 minutes
+        distance = round(rng.uniform(2, 20), 2) if activity_type in DISTANCE_TYPES else None
+        calories = duration * rng.randint(5, 15)  # Rough calculation
+        activity = Activity(
+            user_id=user_id,
+            activity_type=activity_type,
+            duration=duration,
+            distance=distance,
+            calories=calories,
+            date=end_date - timedelta(seconds=rng.randint(1, HISTORY_DAYS * 86400))
+        )
+        # bulk_create() skips save(), which would fill in the key
+        activity.set_derived_key()
+        return activity
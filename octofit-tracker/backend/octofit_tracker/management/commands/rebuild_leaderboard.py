@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from octofit_tracker.leaderboard import (
+    find_mismatches,
+    find_team_mismatches,
+    rebuild_leaderboard
+)
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the user and team leaderboards from the activities table, or check them with --check'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Only compare the stored leaderboard with recomputed totals',
+        )
+
+    def handle(self, *args, **options):
+        if options['check']:
+            mismatches = find_mismatches()
+            for user_id, actual, expected in mismatches:
+                self.stdout.write(
+                    f'user {user_id}: stored {actual}, expected {expected} '
+                    '(points, activities, rank)'
+                )
+            team_mismatches = find_team_mismatches()
+            for team_id, actual, expected in team_mismatches:
+                self.stdout.write(
+                    f'team {team_id}: stored {actual}, expected {expected} '
+                    '(points, activities, members, rank)'
+                )
+            mismatches += team_mismatches
+            if mismatches:
+                raise CommandError(f'{len(mismatches)} leaderboard entries do not match')
+            self.stdout.write(self.style.SUCCESS('Leaderboard matches activity totals'))
+            return
+
+        self.stdout.write('Rebuilding leaderboard from activities...')
+        count = rebuild_leaderboard()
+        self.stdout.write(self.style.SUCCESS(f'Leaderboard rebuilt: {count} entries'))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from octofit_tracker.leaderboard import recompute_ranks
+from octofit_tracker.models import Leaderboard, TeamLeaderboard
+
+
+class Command(BaseCommand):
+    help = (
+        'Recompute user and team leaderboard ranks (competition ranking, 1224) from stored '
+        'points, writing only changed ranks. Changed ranks are written with one prepared '
+        'UPDATE per row on SQL databases and with unordered bulk writes on MongoDB '
+        '(OCTOFIT_MONGO_REPOSITORY); djongo without the repository falls back to '
+        'bulk_update(), which is slow for large re-rankings.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=10000,
+            help='Rows read per round trip and ranks written per transaction',
+        )
+
+    def handle(self, *args, **options):
+        for label, model in [('users', Leaderboard), ('teams', TeamLeaderboard)]:
+            rows, changed = recompute_ranks(model, batch_size=options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(
+                f'Ranked {rows} {label}: {changed} ranks changed'
+            ))
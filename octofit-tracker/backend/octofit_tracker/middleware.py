@@ -0,0 +1,115 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from .profiling import current_profile, end_profile, report, start_profile
+from .routers import bind_replica_reads, unbind_replica_reads
+
+LAST_WRITE_COOKIE = 'octofit_last_write'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def wrote_recently(request, max_staleness):
+    """
+    Whether this client's last write may be missing from a replica that
+    lags up to ``max_staleness`` seconds (or OCTOFIT_READ_YOUR_WRITES_SECONDS,
+    if longer)
+    """
+    try:
+        last_write = float(request.COOKIES[LAST_WRITE_COOKIE])
+    except (KeyError, ValueError):
+        return False
+    window = max(max_staleness, settings.OCTOFIT_READ_YOUR_WRITES_SECONDS)
+    return time.time() - last_write < window
+
+
+class ReadReplicaMiddleware:
+    """
+    Lets safe requests to views with ``replica_max_staleness`` read from the
+    replica, and pins a client to the primary for a while after it writes.
+
+    Writes are remembered in a cookie holding the time of the last
+    successful write, so the pinning follows the client across workers. A
+    view is read from the primary until that write is older than the view's
+    own bound, since a replica within the bound may still be missing it.
+    Works in both sync and async stacks, so async views run without a
+    thread hop.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        request.replica_reads, token = bind_replica_reads()
+        try:
+            response = self.get_response(request)
+        finally:
+            unbind_replica_reads(token)
+        return self.remember_write(request, response)
+
+    async def __acall__(self, request):
+        request.replica_reads, token = bind_replica_reads()
+        try:
+            response = await self.get_response(request)
+        finally:
+            unbind_replica_reads(token)
+        return self.remember_write(request, response)
+
+    def remember_write(self, request, response):
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            response.set_cookie(
+                LAST_WRITE_COOKIE,
+                str(time.time()),
+                samesite='Lax',
+            )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if request.method not in SAFE_METHODS:
+            return None
+        # DRF views keep the view class on the function as ``cls``
+        view = getattr(view_func, 'cls', view_func)
+        max_staleness = getattr(view, 'replica_max_staleness', None)
+        if max_staleness is not None and not wrote_recently(request, max_staleness):
+            request.replica_reads.max_staleness = max_staleness
+        return None
+
+
+class ProfilingMiddleware:
+    """
+    Profiles each request and reports it through profiling.report().
+
+    Installed first in MIDDLEWARE when OCTOFIT_PROFILING is on, so the
+    timings cover every other middleware too. Queries run while a streaming
+    response is consumed happen after it returns and are not counted.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        profile, token = start_profile()
+        try:
+            with profile.capture_queries():
+                response = self.get_response(request)
+        finally:
+            end_profile(token)
+        report(request, response, profile)
+        return response
+
+    def process_template_response(self, request, response):
+        profile = current_profile()
+        if profile is not None:
+            started = time.perf_counter()
+            response.add_post_render_callback(
+                lambda response: profile.add('render', time.perf_counter() - started)
+            )
+        return response
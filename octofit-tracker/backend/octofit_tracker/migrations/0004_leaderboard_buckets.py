@@ -0,0 +1,35 @@
+# Generated by Django 4.1.7 on 2026-10-17 19:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('octofit_tracker', '0003_team_leaderboard'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LeaderboardBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.CharField(max_length=100)),
+                ('period', models.CharField(choices=[('day', 'Day'), ('week', 'Week'), ('month', 'Month')], max_length=10)),
+                ('period_start', models.DateField()),
+                ('total_points', models.IntegerField(default=0)),
+                ('total_activities', models.IntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'leaderboard_buckets',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='leaderboardbucket',
+            index=models.Index(fields=['period', 'period_start', '-total_points'], name='leaderboard_bucket_rank_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='leaderboardbucket',
+            constraint=models.UniqueConstraint(fields=('user_id', 'period', 'period_start'), name='leaderboard_bucket_unique'),
+        ),
+    ]
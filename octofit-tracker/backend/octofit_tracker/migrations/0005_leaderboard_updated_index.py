@@ -0,0 +1,17 @@
+# Generated by Django 4.1.7 on 2026-10-17 19:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('octofit_tracker', '0004_leaderboard_buckets'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='leaderboard',
+            index=models.Index(fields=['updated_at'], name='leaderboard_updated_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.1.7 on 2026-10-17 20:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('octofit_tracker', '0005_leaderboard_updated_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='leaderboard',
+            index=models.Index(fields=['rank', 'id'], name='leaderboard_rank_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='leaderboard',
+            index=models.Index(fields=['-total_points'], name='leaderboard_points_idx'),
+        ),
+    ]
@@ -0,0 +1,57 @@
+import hashlib
+from datetime import timezone
+
+from django.db import migrations, models
+
+
+def _digest(*parts):
+    return hashlib.sha256('\x1f'.join(str(part) for part in parts).encode()).hexdigest()
+
+
+def fill_idempotency_keys(apps, schema_editor):
+    """
+    Give existing activities their derived key (as in octofit_tracker.idempotency).
+
+    Earlier retries that were stored twice keep the key on the oldest copy;
+    the later copies get a key of their own so the unique index can be built.
+    """
+    Activity = apps.get_model('octofit_tracker', 'Activity')
+    seen = set()
+    batch = []
+    for activity in Activity.objects.order_by('id').iterator(chunk_size=1000):
+        date = activity.date
+        if date.tzinfo is None:
+            date = date.replace(tzinfo=timezone.utc)
+        moment = date.astimezone(timezone.utc).replace(microsecond=0).isoformat()
+        key = _digest('activity', activity.user_id, activity.activity_type, moment, activity.duration)
+        if key in seen:
+            key = _digest('duplicate', activity.id)
+        seen.add(key)
+        activity.idempotency_key = key
+        batch.append(activity)
+        if len(batch) >= 1000:
+            Activity.objects.bulk_update(batch, ['idempotency_key'])
+            batch = []
+    if batch:
+        Activity.objects.bulk_update(batch, ['idempotency_key'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('octofit_tracker', '0006_leaderboard_rank_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='activity',
+            name='idempotency_key',
+            field=models.CharField(editable=False, max_length=64, null=True),
+        ),
+        migrations.RunPython(fill_idempotency_keys, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='activity',
+            name='idempotency_key',
+            field=models.CharField(editable=False, max_length=64, unique=True),
+        ),
+    ]
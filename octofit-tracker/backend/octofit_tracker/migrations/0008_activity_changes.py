@@ -0,0 +1,24 @@
+# Generated by Django 4.1.7 on 2026-10-17 20:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('octofit_tracker', '0007_activity_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActivityChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('activity_id', models.BigIntegerField()),
+                ('changed_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+            options={
+                'db_table': 'activity_changes',
+            },
+        ),
+    ]
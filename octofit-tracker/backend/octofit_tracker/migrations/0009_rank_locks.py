@@ -0,0 +1,31 @@
+# Generated by Django 4.1.7 on 2026-10-17 21:01
+
+from django.db import migrations, models
+
+
+def create_rank_locks(apps, schema_editor):
+    """The sentinel rows locked by octofit_tracker.leaderboard before shifting ranks"""
+    RankLock = apps.get_model('octofit_tracker', 'RankLock')
+    for table in ('leaderboard', 'team_leaderboard'):
+        RankLock.objects.get_or_create(table=table)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('octofit_tracker', '0008_activity_changes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RankLock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('table', models.CharField(max_length=100, unique=True)),
+            ],
+            options={
+                'db_table': 'rank_locks',
+            },
+        ),
+        migrations.RunPython(create_rank_locks, migrations.RunPython.noop),
+    ]
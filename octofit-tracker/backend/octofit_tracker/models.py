@@ -1,5 +1,7 @@
 from django.db import models
 
+from .idempotency import KEY_LENGTH, derived_key
+
 
 class User(models.Model):
     email = models.EmailField(unique=True)
@@ -33,14 +35,41 @@ class Activity(models.Model):
     distance = models.FloatField(null=True, blank=True)  # in km
     calories = models.IntegerField()
     date = models.DateTimeField()
+    # Unique per upload, see octofit_tracker.idempotency
+    idempotency_key = models.CharField(max_length=KEY_LENGTH, unique=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
         db_table = 'activities'
         verbose_name_plural = 'Activities'
+        indexes = [
+            models.Index(fields=['user_id', 'date'], name='activity_user_date_idx'),
+            models.Index(fields=['activity_type', 'date'], name='activity_type_date_idx'),
+            models.Index(fields=['date', 'id'], name='activity_date_id_idx'),
+        ]
         
     def __str__(self):
         return f"{self.activity_type} - {self.duration} min"
+    
+    def save(self, *args, **kwargs):
+        if not self.idempotency_key:
+            self.set_derived_key()
+        super().save(*args, **kwargs)
+    
+    def set_derived_key(self):
+        self.idempotency_key = derived_key(self.user_id, self.activity_type, self.date, self.duration)
+
+
+class ActivityChange(models.Model):
+    """An edited or deleted activity, for the analytics caches of every process (see analytics.py)"""
+    activity_id = models.BigIntegerField()
+    changed_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    
+    class Meta:
+        db_table = 'activity_changes'
+        
+    def __str__(self):
+        return f"Activity {self.activity_id} changed at {self.changed_at}"
 
 
 class Leaderboard(models.Model):
@@ -53,11 +82,91 @@ class Leaderboard(models.Model):
     class Meta:
         db_table = 'leaderboard'
         ordering = ['-total_points']
+        indexes = [
+            models.Index(fields=['updated_at'], name='leaderboard_updated_idx'),
+            models.Index(fields=['rank', 'id'], name='leaderboard_rank_idx'),
+            models.Index(fields=['-total_points'], name='leaderboard_points_idx'),
+        ]
         
     def __str__(self):
         return f"Rank {self.rank} - {self.total_points} points"
 
 
+class LeaderboardBucket(models.Model):
+    """Per-user points rolled up by day, ISO week or month"""
+    PERIOD_CHOICES = [
+        ('day', 'Day'),
+        ('week', 'Week'),
+        ('month', 'Month'),
+    ]
+    
+    user_id = models.CharField(max_length=100)
+    period = models.CharField(max_length=10, choices=PERIOD_CHOICES)
+    period_start = models.DateField()
+    total_points = models.IntegerField(default=0)
+    total_activities = models.IntegerField(default=0)
+    
+    class Meta:
+        db_table = 'leaderboard_buckets'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user_id', 'period', 'period_start'],
+                name='leaderboard_bucket_unique'
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=['period', 'period_start', '-total_points'],
+                name='leaderboard_bucket_rank_idx'
+            ),
+        ]
+        
+    def __str__(self):
+        return f"{self.period} of {self.period_start} - {self.total_points} points"
+
+
+class TeamLeaderboard(models.Model):
+    """Materialized team standings, kept current by octofit_tracker.leaderboard"""
+    team_id = models.CharField(max_length=100, unique=True)
+    total_points = models.IntegerField(default=0)
+    total_activities = models.IntegerField(default=0)
+    member_count = models.IntegerField(default=0)
+    average_points = models.FloatField(default=0)
+    rank = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'team_leaderboard'
+        ordering = ['rank']
+        indexes = [
+            models.Index(fields=['rank', 'id'], name='team_leaderboard_rank_idx'),
+            models.Index(fields=['total_points'], name='team_leaderboard_points_idx'),
+        ]
+        
+    def __str__(self):
+        return f"Team rank {self.rank} - {self.total_points} points"
+    
+    def save(self, *args, **kwargs):
+        self.update_average_points()
+        super().save(*args, **kwargs)
+    
+    def update_average_points(self):
+        self.average_points = (
+            self.total_points / self.member_count if self.member_count else 0
+        )
+
+
+class RankLock(models.Model):
+    """One row per ranked table, locked while its ranks are shifted (see leaderboard.py)"""
+    table = models.CharField(max_length=100, unique=True)
+    
+    class Meta:
+        db_table = 'rank_locks'
+        
+    def __str__(self):
+        return f"Rank lock for {self.table}"
+
+
 class Workout(models.Model):
     name = models.CharField(max_length=100)
     description = models.TextField()
@@ -0,0 +1,149 @@
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination
+
+
+class OctofitCursorPagination(CursorPagination):
+    """
+    Keyset pagination shared by all API list endpoints.
+
+    Every ordering ends in ``id``, and the cursor holds the values of all its
+    fields for the last row returned. The next page is the rows after that
+    position, ``(a > x) OR (a = x AND id > i)``, so fetching any page is one
+    indexed range query with no OFFSET, however many rows tie on the leading
+    field.
+
+    Rows whose ordering values do not change while a client pages are
+    returned exactly once. A row whose values change between two requests
+    (a leaderboard rank, after new activities) may be skipped or returned
+    twice; the page itself is always consistent.
+
+    Clients may ask for a smaller or larger page with ``?page_size=``, capped
+    at ``max_page_size``.
+    """
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    ordering = ('id',)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        # CursorPagination.paginate_queryset, with the position filtered on
+        # the whole ordering instead of its first field plus an offset
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+
+        self.cursor = self.decode_cursor(request)
+        if self.cursor is None:
+            offset, reverse, current_position = 0, False, None
+        else:
+            offset, reverse, current_position = self.cursor
+
+        ordering = [_flip(field) for field in self.ordering] if reverse else list(self.ordering)
+        queryset = queryset.order_by(*ordering)
+        if current_position is not None:
+            try:
+                queryset = queryset.filter(self._after(ordering, current_position))
+            except (ValueError, ValidationError):
+                raise NotFound(self.invalid_cursor_message)
+
+        results = list(queryset[offset:offset + self.page_size + 1])
+        self.page = results[:self.page_size]
+        if len(results) > len(self.page):
+            has_following_position = True
+            following_position = self._get_position_from_instance(results[-1], self.ordering)
+        else:
+            has_following_position = False
+            following_position = None
+
+        if reverse:
+            self.page.reverse()
+            self.has_next = current_position is not None or offset > 0
+            self.has_previous = has_following_position
+            if self.has_next:
+                self.next_position = current_position
+            if self.has_previous:
+                self.previous_position = following_position
+        else:
+            self.has_next = has_following_position
+            self.has_previous = current_position is not None or offset > 0
+            if self.has_next:
+                self.next_position = following_position
+            if self.has_previous:
+                self.previous_position = current_position
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+
+        return self.page
+
+    def _after(self, ordering, position):
+        """Rows strictly after ``position`` in ``ordering``"""
+        try:
+            values = json.loads(position)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != len(ordering):
+            raise NotFound(self.invalid_cursor_message)
+
+        condition = Q()
+        equal = {}
+        for field, value in zip(ordering, values):
+            name = field.lstrip('-')
+            lookup = '__lt' if field.startswith('-') else '__gt'
+            condition |= Q(**equal, **{name + lookup: value})
+            equal[name] = value
+        return condition
+
+    def _get_position_from_instance(self, instance, ordering):
+        values = []
+        for field in ordering:
+            name = field.lstrip('-')
+            value = instance[name] if isinstance(instance, dict) else getattr(instance, name)
+            values.append(str(value))
+        return json.dumps(values)
+
+
+def _flip(field):
+    return field[1:] if field.startswith('-') else '-' + field
+
+
+class UserCursorPagination(OctofitCursorPagination):
+    """Users ordered by id"""
+
+
+class TeamCursorPagination(OctofitCursorPagination):
+    """Teams ordered by id"""
+
+
+class ActivityCursorPagination(OctofitCursorPagination):
+    """Activities ordered by date with id as the tie-breaker"""
+    page_size = 100
+    max_page_size = 1000
+    ordering = ('date', 'id')
+
+
+class LeaderboardCursorPagination(OctofitCursorPagination):
+    """Leaderboard ordered by rank with id as the tie-breaker"""
+    page_size = 25
+    max_page_size = 200
+    ordering = ('rank', 'id')
+
+
+class LeaderboardWindowCursorPagination(LeaderboardCursorPagination):
+    """Windowed leaderboard buckets ordered by points with id as the tie-breaker"""
+    ordering = ('-total_points', 'id')
+
+
+class TeamLeaderboardCursorPagination(LeaderboardCursorPagination):
+    """Team standings ordered by rank with id as the tie-breaker"""
+
+
+class WorkoutCursorPagination(OctofitCursorPagination):
+    """Workouts ordered by id"""
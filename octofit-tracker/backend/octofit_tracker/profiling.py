@@ -0,0 +1,269 @@
+"""
+Per-request profiling: where the time goes and how many round trips it took.
+
+ProfilingMiddleware (opt in with OCTOFIT_PROFILING=1) starts a
+RequestProfile for each request. It records:
+
+* ``db``: time and count of ORM statements. Under djongo this includes
+  translating the SQL back into Mongo operations.
+* ``mongo``: time and count of Mongo commands on the wire, from a pymongo
+  command listener. It covers djongo and the pymongo repository;
+  ``db - mongo`` approximates djongo's translation overhead.
+* ``serialize``: time spent turning rows into response data, where views
+  mark it with ``timed('serialize')``.
+* ``render``: time spent encoding the response body.
+
+The results go out in three ways: a ``Server-Timing`` header, one JSON log
+line per request on the ``octofit_tracker.profiling`` logger, and
+per-view counters rendered in the Prometheus text format at ``/metrics``.
+Counters are per process. Statements repeated OCTOFIT_PROFILING_REPEAT_THRESHOLD
+or more times in one request are reported as a likely N+1 pattern.
+"""
+import contextvars
+import json
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+_current = contextvars.ContextVar('octofit_profile', default=None)
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class RequestProfile:
+    """Timings and counters for one request"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.lock = threading.Lock()
+        self.seconds = defaultdict(float)
+        self.counts = Counter()
+        self.statements = Counter()
+
+    def add(self, section, seconds, count=1):
+        with self.lock:
+            self.seconds[section] += seconds
+            self.counts[section] += count
+
+    def record_query(self, sql, seconds):
+        with self.lock:
+            self.seconds['db'] += seconds
+            self.counts['db'] += 1
+            self.statements[sql] += 1
+
+    def repeated_statements(self):
+        """Statements run at least OCTOFIT_PROFILING_REPEAT_THRESHOLD times"""
+        threshold = settings.OCTOFIT_PROFILING_REPEAT_THRESHOLD
+        return [(sql, count) for sql, count in self.statements.most_common() if count >= threshold]
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def _query_wrapper(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.record_query(sql, time.perf_counter() - started)
+
+    def capture_queries(self):
+        """Context manager timing every statement on every database alias"""
+        stack = ExitStack()
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(self._query_wrapper))
+        return stack
+
+    def server_timing(self, total):
+        parts = []
+        for section in ('db', 'mongo', 'serialize', 'render'):
+            if section in self.counts:
+                entry = f'{section};dur={self.seconds[section] * 1000:.1f}'
+                if section in ('db', 'mongo'):
+                    entry += f';desc="{self.counts[section]}"'
+                parts.append(entry)
+        parts.append(f'total;dur={total * 1000:.1f}')
+        return ', '.join(parts)
+
+
+def current_profile():
+    return _current.get()
+
+
+def start_profile():
+    profile = RequestProfile()
+    return profile, _current.set(profile)
+
+
+def end_profile(token):
+    _current.reset(token)
+
+
+@contextmanager
+def timed(section):
+    """Add the time spent in the block to ``section`` of the current profile"""
+    profile = _current.get()
+    if profile is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add(section, time.perf_counter() - started)
+
+
+class Metrics:
+    """Process-wide per-view counters in the Prometheus text format"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = Counter()
+        self.durations = defaultdict(lambda: [0] * (len(DURATION_BUCKETS) + 1))
+        self.duration_sums = defaultdict(float)
+        self.seconds = defaultdict(float)
+        self.counts = Counter()
+        self.response_bytes = Counter()
+        self.repeated = Counter()
+
+    def observe(self, view, method, status, profile, total, size, repeated):
+        with self.lock:
+            self.requests[(view, method, str(status))] += 1
+            buckets = self.durations[view]
+            for index, bound in enumerate(DURATION_BUCKETS):
+                if total <= bound:
+                    buckets[index] += 1
+            buckets[-1] += 1
+            self.duration_sums[view] += total
+            for section, seconds in profile.seconds.items():
+                self.seconds[(view, section)] += seconds
+                self.counts[(view, section)] += profile.counts[section]
+            if size is not None:
+                self.response_bytes[view] += size
+            if repeated:
+                self.repeated[view] += 1
+
+    def reset(self):
+        self.__init__()
+
+    def render(self):
+        lines = []
+
+        def family(name, kind, help_text):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+
+        def labels(**values):
+            return ','.join(f'{key}="{value}"' for key, value in values.items())
+
+        with self.lock:
+            family('octofit_requests_total', 'counter', 'Requests by view, method and status.')
+            for (view, method, status), count in sorted(self.requests.items()):
+                lines.append(f'octofit_requests_total{{{labels(view=view, method=method, status=status)}}} {count}')
+
+            family('octofit_request_duration_seconds', 'histogram', 'Request duration by view.')
+            for view, buckets in sorted(self.durations.items()):
+                for bound, count in zip(DURATION_BUCKETS + ('+Inf',), buckets):
+                    lines.append(
+                        f'octofit_request_duration_seconds_bucket{{{labels(view=view, le=bound)}}} {count}'
+                    )
+                lines.append(f'octofit_request_duration_seconds_sum{{{labels(view=view)}}} {self.duration_sums[view]:.6f}')
+                lines.append(f'octofit_request_duration_seconds_count{{{labels(view=view)}}} {buckets[-1]}')
+
+            family('octofit_section_seconds_total', 'counter', 'Time per view in db, mongo, serialize and render.')
+            for (view, section), seconds in sorted(self.seconds.items()):
+                lines.append(f'octofit_section_seconds_total{{{labels(view=view, section=section)}}} {seconds:.6f}')
+
+            family('octofit_section_calls_total', 'counter', 'Database statements and Mongo round trips per view.')
+            for (view, section), count in sorted(self.counts.items()):
+                if section in ('db', 'mongo'):
+                    lines.append(f'octofit_section_calls_total{{{labels(view=view, section=section)}}} {count}')
+
+            family('octofit_response_bytes_total', 'counter', 'Response body bytes per view.')
+            for view, size in sorted(self.response_bytes.items()):
+                lines.append(f'octofit_response_bytes_total{{{labels(view=view)}}} {size}')
+
+            family('octofit_repeated_queries_total', 'counter', 'Requests with a likely N+1 query pattern per view.')
+            for view, count in sorted(self.repeated.items()):
+                lines.append(f'octofit_repeated_queries_total{{{labels(view=view)}}} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+def report(request, response, profile):
+    """Emit the Server-Timing header, the log line and the metrics"""
+    total = profile.elapsed()
+    match = getattr(request, 'resolver_match', None)
+    view = match.view_name if match else 'unmatched'
+    size = None if response.streaming else len(response.content)
+    repeated = profile.repeated_statements()
+
+    response['Server-Timing'] = profile.server_timing(total)
+    metrics.observe(view, request.method, response.status_code, profile, total, size, repeated)
+
+    entry = {
+        'view': view,
+        'method': request.method,
+        'path': request.path,
+        'status': response.status_code,
+        'total_ms': round(total * 1000, 2),
+        'bytes': size,
+    }
+    for section in ('db', 'mongo', 'serialize', 'render'):
+        if section in profile.counts:
+            entry[f'{section}_ms'] = round(profile.seconds[section] * 1000, 2)
+    entry['queries'] = profile.counts['db']
+    entry['mongo_round_trips'] = profile.counts['mongo']
+    if repeated:
+        entry['repeated_queries'] = [{'sql': sql, 'count': count} for sql, count in repeated]
+        logger.warning(json.dumps(entry))
+    else:
+        logger.info(json.dumps(entry))
+
+
+def _new_command_listener():
+    from pymongo import monitoring
+
+    class CommandTimer(monitoring.CommandListener):
+        """Adds each Mongo command's wire time to the current profile"""
+
+        def started(self, event):
+            pass
+
+        def succeeded(self, event):
+            self._record(event)
+
+        def failed(self, event):
+            self._record(event)
+
+        def _record(self, event):
+            profile = _current.get()
+            if profile is not None:
+                profile.add('mongo', event.duration_micros / 1e6)
+
+    return CommandTimer()
+
+
+_command_listener = None
+
+
+def register_command_listener():
+    """Time Mongo commands for every client created from now on"""
+    global _command_listener
+    if (
+        _command_listener is None
+        and settings.OCTOFIT_PROFILING
+        and settings.DATABASES['default']['ENGINE'] == 'djongo'
+    ):
+        from pymongo import monitoring
+
+        _command_listener = _new_command_listener()
+        monitoring.register(_command_listener)
@@ -0,0 +1,246 @@
+"""
+Data access for the hot paths: leaderboard top-N, activity reads, bulk
+activity inserts and bulk rank updates.
+
+Under djongo every ORM query is rendered to SQL and parsed back into a Mongo
+operation, and filters it cannot translate are applied in Python after
+fetching. MongoRepository talks to the same collections through pymongo
+instead, with projections and one pooled client per process. OrmRepository
+is the equivalent over the Django ORM and is used whenever the default
+database is not djongo (for example the SQLite test settings) or
+OCTOFIT_MONGO_REPOSITORY is off. The models remain the source of truth for
+the schema, migrations and the admin.
+
+Both return rows shaped like ``QuerySet.values()``, so they plug into the
+RowSerializer fast path.
+"""
+import threading
+
+from django.conf import settings
+from django.db import IntegrityError, connections, router, transaction
+from django.utils import timezone
+
+from .filters import apply_activity_filters
+from .models import Activity, Leaderboard
+from .routers import use_replica
+
+LEADERBOARD_ORDERING = ('rank', 'id')
+ACTIVITY_ORDERING = ('date', 'id')
+# MongoDB's error code for a unique index violation
+DUPLICATE_KEY = 11000
+
+_lock = threading.Lock()
+_repository = None
+_client = None
+
+
+def mongo_client():
+    """The process-wide pymongo client, configured like djongo's"""
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                from pymongo import MongoClient
+
+                options = dict(settings.DATABASES['default'].get('CLIENT', {}))
+                options.setdefault('tz_aware', True)
+                options.setdefault('tzinfo', timezone.utc)
+                _client = MongoClient(**options)
+    return _client
+
+
+class OrmRepository:
+    """Hot-path queries through the Django ORM"""
+    # Run from async views on the thread that owns the Django connection
+    thread_sensitive = True
+
+    def leaderboard_top(self, limit, fields):
+        """The first ``limit`` leaderboard rows by rank"""
+        queryset = Leaderboard.objects.order_by(*LEADERBOARD_ORDERING)
+        return list(queryset.values(*fields)[:limit])
+
+    def activities(self, filters, limit, fields):
+        """Activities matching parsed ``activity_filter_values``, oldest first"""
+        queryset = apply_activity_filters(Activity.objects.all(), filters)
+        return list(queryset.order_by(*ACTIVITY_ORDERING).values(*fields)[:limit])
+
+    def insert_activities(self, rows, batch_size):
+        """
+        Insert validated activity dicts; returns the saved Activity objects.
+        
+        Rows whose idempotency key has been taken since the caller checked
+        are skipped and left out of the result.
+        """
+        created = []
+        for start in range(0, len(rows), batch_size):
+            chunk = [Activity(**attrs) for attrs in rows[start:start + batch_size]]
+            try:
+                with transaction.atomic():
+                    Activity.objects.bulk_create(chunk)
+            except IntegrityError:
+                taken = set(
+                    Activity.objects.filter(
+                        idempotency_key__in=[activity.idempotency_key for activity in chunk]
+                    ).values_list('idempotency_key', flat=True)
+                )
+                chunk = [activity for activity in chunk if activity.idempotency_key not in taken]
+                Activity.objects.bulk_create(chunk)
+            created.extend(chunk)
+        return created
+
+    def set_ranks(self, model, changes):
+        """
+        Store ``(id, rank)`` pairs on ``model`` rows.
+
+        SQL databases run one prepared UPDATE per pair (``executemany``):
+        bulk_update() builds a CASE over the whole batch that the database
+        evaluates for every row, which made large re-rankings take minutes.
+        djongo cannot run raw SQL, so it keeps bulk_update().
+        """
+        now = timezone.now()
+        connection = connections[router.db_for_write(model)]
+        if connection.vendor == 'djongo':
+            model.objects.bulk_update(
+                [model(id=row_id, rank=rank, updated_at=now) for row_id, rank in changes],
+                ['rank', 'updated_at'],
+            )
+            return
+        opts = model._meta
+        quote = connection.ops.quote_name
+        updated_at = opts.get_field('updated_at')
+        statement = 'UPDATE {} SET {} = %s, {} = %s WHERE {} = %s'.format(
+            quote(opts.db_table),
+            quote(opts.get_field('rank').column),
+            quote(updated_at.column),
+            quote(opts.pk.column),
+        )
+        stamp = updated_at.get_db_prep_value(now, connection)
+        with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+            cursor.executemany(statement, [(rank, stamp, row_id) for row_id, rank in changes])
+
+
+class MongoRepository:
+    """Hot-path queries straight against djongo's collections"""
+    # pymongo is thread safe and pools its own sockets
+    thread_sensitive = False
+
+    def __init__(self, client, database_name):
+        self.db = client[database_name]
+
+    def _reader(self, table):
+        """``table`` for reading, from a secondary when routing allows it"""
+        collection = self.db[table]
+        if use_replica():
+            from pymongo.read_preferences import SecondaryPreferred
+
+            collection = collection.with_options(read_preference=SecondaryPreferred())
+        return collection
+
+    @staticmethod
+    def _projection(fields):
+        projection = {field: 1 for field in fields}
+        projection['_id'] = 0
+        return projection
+
+    @staticmethod
+    def _sort(ordering):
+        from pymongo import ASCENDING, DESCENDING
+
+        return [
+            (field.lstrip('-'), DESCENDING if field.startswith('-') else ASCENDING)
+            for field in ordering
+        ]
+
+    def leaderboard_top(self, limit, fields):
+        cursor = self._reader(Leaderboard._meta.db_table).find(
+            {}, self._projection(fields)
+        ).sort(self._sort(LEADERBOARD_ORDERING)).limit(limit)
+        return list(cursor)
+
+    def activities(self, filters, limit, fields):
+        query = {}
+        if filters['user_id']:
+            query['user_id'] = filters['user_id']
+        types = filters['activity_types']
+        if types:
+            query['activity_type'] = types[0] if len(types) == 1 else {'$in': types}
+        date_range = {}
+        if filters['date_from']:
+            date_range['$gte'] = filters['date_from']
+        if filters['date_to']:
+            date_range['$lte'] = filters['date_to']
+        if date_range:
+            query['date'] = date_range
+
+        cursor = self._reader(Activity._meta.db_table).find(
+            query, self._projection(fields)
+        ).sort(self._sort(ACTIVITY_ORDERING)).limit(limit)
+        return list(cursor)
+
+    def _reserve_ids(self, table, count):
+        """Claim ``count`` consecutive ids from djongo's auto-increment counter"""
+        from pymongo import ReturnDocument
+
+        schema = self.db['__schema__'].find_one_and_update(
+            {'name': table, 'auto': {'$exists': True}},
+            {'$inc': {'auto.seq': count}},
+            return_document=ReturnDocument.AFTER,
+        )
+        last = schema['auto']['seq']
+        return range(last - count + 1, last + 1)
+
+    def insert_activities(self, rows, batch_size):
+        from pymongo.errors import BulkWriteError
+
+        if not rows:
+            return []
+        table = Activity._meta.db_table
+        created_at = timezone.now()
+        activities = [
+            Activity(id=activity_id, created_at=created_at, **attrs)
+            for activity_id, attrs in zip(self._reserve_ids(table, len(rows)), rows)
+        ]
+        fields = [field.attname for field in Activity._meta.concrete_fields]
+        collection = self.db[table]
+        skipped = set()
+        for start in range(0, len(activities), batch_size):
+            try:
+                collection.insert_many(
+                    [
+                        {field: getattr(activity, field) for field in fields}
+                        for activity in activities[start:start + batch_size]
+                    ],
+                    ordered=False,
+                )
+            except BulkWriteError as exc:
+                # Unordered inserts carry on past duplicate idempotency keys;
+                # anything else is a real failure
+                errors = exc.details['writeErrors']
+                if any(error['code'] != DUPLICATE_KEY for error in errors):
+                    raise
+                skipped.update(start + error['index'] for error in errors)
+        return [activity for index, activity in enumerate(activities) if index not in skipped]
+
+    def set_ranks(self, model, changes):
+        from pymongo import UpdateOne
+
+        now = timezone.now()
+        self.db[model._meta.db_table].bulk_write(
+            [
+                UpdateOne({'id': row_id}, {'$set': {'rank': rank, 'updated_at': now}})
+                for row_id, rank in changes
+            ],
+            ordered=False,
+        )
+
+
+def get_repository():
+    """The repository for this process, chosen from the database settings"""
+    global _repository
+    if _repository is None:
+        database = settings.DATABASES['default']
+        if database['ENGINE'] == 'djongo' and settings.OCTOFIT_MONGO_REPOSITORY:
+            _repository = MongoRepository(mongo_client(), database['NAME'])
+        else:
+            _repository = OrmRepository()
+    return _repository
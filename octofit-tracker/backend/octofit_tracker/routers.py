@@ -0,0 +1,121 @@
+"""
+Read replica routing.
+
+Views opt in by declaring ``replica_max_staleness``: the number of seconds
+of replication lag their responses can tolerate. ReadReplicaMiddleware marks
+safe (GET/HEAD/OPTIONS) requests to such views, unless the client wrote
+something within that bound (or OCTOFIT_READ_YOUR_WRITES_SECONDS), and
+ReadReplicaRouter then sends their reads to the OCTOFIT_READ_REPLICA alias
+while the measured lag is within the bound. Everything else, including every
+write and every read made while handling a write, uses the primary.
+
+The mark is a ReplicaReads object bound to the request's context by the
+middleware's ``__call__``. process_view only sets its ``max_staleness``:
+under ASGI it runs in a copy of that context on another thread, so the
+context variable itself must be set and reset around the whole request.
+"""
+import contextvars
+import threading
+import time
+
+from django.conf import settings
+
+_replica_reads = contextvars.ContextVar('octofit_replica_reads', default=None)
+
+_lag_lock = threading.Lock()
+_lag = {'seconds': None, 'checked': None}
+
+
+class ReplicaReads:
+    """
+    A request's replica bound: reads may lag at most ``max_staleness``
+    seconds (None: primary only). ``used`` records whether any read was
+    actually sent to the replica, so its result must not be cached.
+    """
+
+    def __init__(self):
+        self.max_staleness = None
+        self.used = False
+
+
+def bind_replica_reads():
+    """Bind a fresh ReplicaReads to the current context; returns ``(reads, token)``"""
+    reads = ReplicaReads()
+    return reads, _replica_reads.set(reads)
+
+
+def unbind_replica_reads(token):
+    _replica_reads.reset(token)
+
+
+def measure_replica_lag():
+    """
+    Seconds the slowest secondary is behind the primary.
+
+    Read from ``replSetGetStatus`` on MongoDB. A standalone server has no
+    lag; an error reading the status counts as unbounded lag, so reads stay
+    on the primary until the next check.
+    """
+    if settings.DATABASES['default']['ENGINE'] != 'djongo':
+        return 0.0
+
+    from pymongo.errors import OperationFailure, PyMongoError
+
+    from .repository import mongo_client
+
+    try:
+        status = mongo_client().admin.command('replSetGetStatus')
+    except OperationFailure as exc:
+        # NoReplicationEnabled: the "replica" is the same standalone server
+        return 0.0 if exc.code == 76 else float('inf')
+    except PyMongoError:
+        return float('inf')
+
+    primary = [m['optimeDate'] for m in status['members'] if m['stateStr'] == 'PRIMARY']
+    secondaries = [m['optimeDate'] for m in status['members'] if m['stateStr'] == 'SECONDARY']
+    if not primary or not secondaries:
+        return float('inf')
+    return max(0.0, (primary[0] - min(secondaries)).total_seconds())
+
+
+def replica_lag():
+    """Replication lag, measured at most every OCTOFIT_REPLICA_LAG_CHECK_INTERVAL seconds"""
+    now = time.monotonic()
+    checked = _lag['checked']
+    if checked is None or now - checked >= settings.OCTOFIT_REPLICA_LAG_CHECK_INTERVAL:
+        with _lag_lock:
+            if _lag['checked'] is None or now - _lag['checked'] >= settings.OCTOFIT_REPLICA_LAG_CHECK_INTERVAL:
+                _lag['seconds'] = measure_replica_lag()
+                _lag['checked'] = now
+    return _lag['seconds']
+
+
+def use_replica():
+    """Whether reads in the current context may go to the replica"""
+    reads = _replica_reads.get()
+    max_staleness = reads.max_staleness if reads is not None else None
+    if max_staleness is None or not settings.OCTOFIT_READ_REPLICA:
+        return False
+    return replica_lag() <= max_staleness
+
+
+class ReadReplicaRouter:
+    """Routes marked reads to the replica alias and everything else to default"""
+
+    def db_for_read(self, model, **hints):
+        if use_replica():
+            _replica_reads.get().used = True
+            return settings.OCTOFIT_READ_REPLICA
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica holds the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if settings.OCTOFIT_READ_REPLICA and db == settings.OCTOFIT_READ_REPLICA:
+            return False
+        return None
@@ -1,8 +1,48 @@
+from django.conf import settings
 from rest_framework import serializers
-from .models import User, Team, Activity, Leaderboard, Workout
+from .idempotency import activity_key
+from .models import User, Team, Activity, Leaderboard, LeaderboardBucket, TeamLeaderboard, Workout
+from .repository import get_repository
 
 
-class UserSerializer(serializers.ModelSerializer):
+def username_for(email, name):
+    """Username is the part of the email before @, else the underscored name"""
+    if email:
+        return email.split('@')[0]
+    return name.lower().replace(' ', '_')
+
+
+def split_name(name):
+    """Split a full name into ``(first_name, last_name)``"""
+    if name:
+        parts = name.split(' ', 1)
+        return parts[0], parts[1] if len(parts) > 1 else ''
+    return '', ''
+
+
+class ExpandableSerializerMixin:
+    """
+    Adds ``user`` and/or ``team`` summaries to each row when the view has
+    loaded them into ``context['expansions']`` (see ``expand.load_expansions``).
+    """
+    
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        expansions = self.context.get('expansions')
+        if not expansions:
+            return data
+        
+        expand = expansions['expand']
+        user = expansions.get('users', {}).get(getattr(instance, 'user_id', None))
+        if 'user' in expand:
+            data['user'] = user
+        if 'team' in expand:
+            team_id = getattr(instance, 'team_id', None) or (user or {}).get('team_id')
+            data['team'] = expansions.get('teams', {}).get(team_id)
+        return data
+
+
+class UserSerializer(ExpandableSerializerMixin, serializers.ModelSerializer):
     """Serializer for User model with ObjectId to string conversion"""
     id = serializers.CharField(read_only=True)
     username = serializers.SerializerMethodField()
@@ -18,27 +58,32 @@ class UserSerializer(serializers.ModelSerializer):
     
     def get_username(self, obj):
         """Generate username from email (part before @)"""
-        if obj.email:
-            return obj.email.split('@')[0]
-        return obj.name.lower().replace(' ', '_')
+        return username_for(obj.email, obj.name)
     
     def get_first_name(self, obj):
         """Extract first name from name field"""
-        if obj.name:
-            parts = obj.name.split(' ', 1)
-            return parts[0] if parts else ''
-        return ''
+        return split_name(obj.name)[0]
     
     def get_last_name(self, obj):
         """Extract last name from name field"""
-        if obj.name:
-            parts = obj.name.split(' ', 1)
-            return parts[1] if len(parts) > 1 else ''
-        return ''
+        return split_name(obj.name)[1]
     
     def get_is_active(self, obj):
         """All users are active by default"""
         return True
+    
+    derive_row_sources = ('name', 'email')
+    
+    @staticmethod
+    def derive_row(row):
+        """Method-field values for a ``.values()`` row, splitting the name once"""
+        first_name, last_name = split_name(row['name'])
+        return {
+            'username': username_for(row['email'], row['name']),
+            'first_name': first_name,
+            'last_name': last_name,
+            'is_active': True,
+        }
 
 
 class TeamSerializer(serializers.ModelSerializer):
@@ -51,17 +96,94 @@ class TeamSerializer(serializers.ModelSerializer):
         read_only_fields = ['created_at']
 
 
-class ActivitySerializer(serializers.ModelSerializer):
+class ActivityListSerializer(serializers.ListSerializer):
+    """List serializer for bulk activity ingestion with per-item errors"""
+    
+    def validate_items(self):
+        """
+        Validate every item independently.
+        
+        Returns ``(valid, errors)`` where ``valid`` is a list of
+        ``(index, validated_data)`` and ``errors`` a list of
+        ``{'index': ..., 'errors': ...}`` for the rejected items.
+        """
+        valid, errors = [], []
+        for index, item in enumerate(self.initial_data):
+            try:
+                valid.append((index, self.child.run_validation(item)))
+            except serializers.ValidationError as exc:
+                errors.append({'index': index, 'errors': exc.detail})
+        return valid, errors
+    
+    def ingest(self, validated_data):
+        """
+        Insert the activities that are not stored yet, in chunks of batch_size
+        through the repository.
+        
+        Returns ``(created, duplicates)``: the new Activity objects, and a list
+        of ``(position, activity)`` for the items of ``validated_data`` whose
+        idempotency key was already taken, by a stored activity or an earlier
+        item, with the activity that holds it.
+        """
+        keys = [attrs['idempotency_key'] for attrs in validated_data]
+        stored = {
+            activity.idempotency_key: activity
+            for activity in Activity.objects.filter(idempotency_key__in=set(keys))
+        }
+        first_positions = {}
+        for position, key in enumerate(keys):
+            if key not in stored:
+                first_positions.setdefault(key, position)
+        
+        batch_size = self.context.get('batch_size') or settings.OCTOFIT_BULK_BATCH_SIZE
+        created = get_repository().insert_activities(
+            [validated_data[position] for position in first_positions.values()], batch_size
+        )
+        created_keys = {activity.idempotency_key for activity in created}
+        raced = [key for key in first_positions if key not in created_keys]
+        if raced:
+            # Another request stored these between the lookup and the insert
+            stored.update(
+                (activity.idempotency_key, activity)
+                for activity in Activity.objects.filter(idempotency_key__in=raced)
+            )
+        
+        holders = {**stored, **{activity.idempotency_key: activity for activity in created}}
+        duplicates = [
+            (position, holders[key])
+            for position, key in enumerate(keys)
+            if key not in created_keys or first_positions[key] != position
+        ]
+        return created, duplicates
+    
+    def create(self, validated_data):
+        return self.ingest(validated_data)[0]
+
+
+class ActivitySerializer(ExpandableSerializerMixin, serializers.ModelSerializer):
     """Serializer for Activity model with ObjectId to string conversion"""
     id = serializers.CharField(read_only=True)
+    idempotency_key = serializers.CharField(write_only=True, required=False, max_length=255)
     
     class Meta:
         model = Activity
-        fields = ['id', 'user_id', 'activity_type', 'duration', 'distance', 'calories', 'date', 'created_at']
+        fields = ['id', 'user_id', 'activity_type', 'duration', 'distance', 'calories', 'date', 'idempotency_key', 'created_at']
         read_only_fields = ['created_at']
+        list_serializer_class = ActivityListSerializer
+    
+    def validate(self, attrs):
+        """
+        Replace the client's idempotency key (or the ``Idempotency-Key``
+        header, passed in the context) by the stored key. Keys are set once,
+        on creation; updates ignore them.
+        """
+        key = attrs.pop('idempotency_key', None) or self.context.get('idempotency_key')
+        if self.instance is None:
+            attrs['idempotency_key'] = activity_key(attrs, key)
+        return attrs
 
 
-class LeaderboardSerializer(serializers.ModelSerializer):
+class LeaderboardSerializer(ExpandableSerializerMixin, serializers.ModelSerializer):
     """Serializer for Leaderboard model with ObjectId to string conversion"""
     id = serializers.CharField(read_only=True)
     
@@ -71,6 +193,28 @@ class LeaderboardSerializer(serializers.ModelSerializer):
         read_only_fields = ['updated_at']
 
 
+class LeaderboardWindowSerializer(ExpandableSerializerMixin, serializers.ModelSerializer):
+    """Serializer for a user's points within one day, week or month"""
+    id = serializers.CharField(read_only=True)
+    window = serializers.CharField(source='period', read_only=True)
+    rank = serializers.IntegerField(read_only=True)
+    
+    class Meta:
+        model = LeaderboardBucket
+        fields = ['id', 'user_id', 'total_points', 'total_activities', 'rank', 'window', 'period_start']
+        read_only_fields = fields
+
+
+class TeamLeaderboardSerializer(serializers.ModelSerializer):
+    """Serializer for TeamLeaderboard model with ObjectId to string conversion"""
+    id = serializers.CharField(read_only=True)
+    
+    class Meta:
+        model = TeamLeaderboard
+        fields = ['id', 'team_id', 'total_points', 'total_activities', 'member_count', 'average_points', 'rank', 'updated_at']
+        read_only_fields = fields
+
+
 class WorkoutSerializer(serializers.ModelSerializer):
     """Serializer for Workout model with ObjectId to string conversion"""
     id = serializers.CharField(read_only=True)
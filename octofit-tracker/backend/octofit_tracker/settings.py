@@ -55,6 +55,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'octofit_tracker.middleware.ReadReplicaMiddleware',
 ]
 
 ROOT_URLCONF = 'octofit_tracker.urls'
@@ -81,17 +82,67 @@ WSGI_APPLICATION = 'octofit_tracker.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.1/ref/settings/#databases
 
+# MongoDB client options, used by djongo and by the pymongo repository.
+# Pool and timeout sizes are tunable per deployment; read preference,
+# compression (zstd, snappy and zlib need their optional packages) and write
+# concern are only passed to pymongo when set, so its defaults apply otherwise.
+# Pool usage is reported at /api/health/.
+MONGO_CLIENT = {
+    'host': os.environ.get('OCTOFIT_MONGO_HOST', 'localhost'),
+    'port': int(os.environ.get('OCTOFIT_MONGO_PORT', 27017)),
+    'maxPoolSize': int(os.environ.get('OCTOFIT_MONGO_MAX_POOL_SIZE', 50)),
+    'minPoolSize': int(os.environ.get('OCTOFIT_MONGO_MIN_POOL_SIZE', 5)),
+    'maxIdleTimeMS': int(os.environ.get('OCTOFIT_MONGO_MAX_IDLE_TIME_MS', 300000)),
+    'serverSelectionTimeoutMS': int(os.environ.get('OCTOFIT_MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000)),
+    'waitQueueTimeoutMS': int(os.environ.get('OCTOFIT_MONGO_WAIT_QUEUE_TIMEOUT_MS', 2000)),
+}
+if os.environ.get('OCTOFIT_MONGO_READ_PREFERENCE'):
+    MONGO_CLIENT['readPreference'] = os.environ['OCTOFIT_MONGO_READ_PREFERENCE']
+if os.environ.get('OCTOFIT_MONGO_COMPRESSORS'):
+    MONGO_CLIENT['compressors'] = os.environ['OCTOFIT_MONGO_COMPRESSORS']
+if os.environ.get('OCTOFIT_MONGO_W'):
+    # A node count ("1", "2") or a tag such as "majority"
+    w = os.environ['OCTOFIT_MONGO_W']
+    MONGO_CLIENT['w'] = int(w) if w.isdigit() else w
+if os.environ.get('OCTOFIT_MONGO_JOURNAL'):
+    MONGO_CLIENT['journal'] = os.environ['OCTOFIT_MONGO_JOURNAL'] == '1'
+
 DATABASES = {
     'default': {
         'ENGINE': 'djongo',
         'NAME': 'octofit_db',
-        'CLIENT': {
-            'host': 'localhost',
-            'port': 27017,
-        }
+        'CLIENT': MONGO_CLIENT,
     }
 }
 
+# Read replica routing (see routers.py). With OCTOFIT_READ_REPLICA=1, reads
+# from endpoints that declare replica_max_staleness go to a 'replica' alias
+# on the same replica set with a secondary read preference, as long as the
+# measured replication lag (checked every OCTOFIT_REPLICA_LAG_CHECK_INTERVAL
+# seconds) is within the endpoint's bound. Writes stay on the primary, and so
+# do a client's reads until its last write is older than the endpoint's bound
+# (and at least OCTOFIT_READ_YOUR_WRITES_SECONDS old).
+if os.environ.get('OCTOFIT_READ_REPLICA') == '1':
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'CLIENT': {
+            **MONGO_CLIENT,
+            'readPreference': os.environ.get('OCTOFIT_REPLICA_READ_PREFERENCE', 'secondaryPreferred'),
+        },
+        'TEST': {'MIRROR': 'default'},
+    }
+    OCTOFIT_READ_REPLICA = 'replica'
+else:
+    OCTOFIT_READ_REPLICA = None
+DATABASE_ROUTERS = ['octofit_tracker.routers.ReadReplicaRouter']
+OCTOFIT_READ_YOUR_WRITES_SECONDS = float(os.environ.get('OCTOFIT_READ_YOUR_WRITES_SECONDS', 10))
+OCTOFIT_REPLICA_LAG_CHECK_INTERVAL = float(os.environ.get('OCTOFIT_REPLICA_LAG_CHECK_INTERVAL', 5))
+
+# Serve the hot paths (leaderboard top-N, activity reads, bulk inserts)
+# through pymongo instead of djongo's SQL translation; see repository.py.
+# Only applies when the default database is djongo.
+OCTOFIT_MONGO_REPOSITORY = os.environ.get('OCTOFIT_MONGO_REPOSITORY', '1') == '1'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
@@ -134,6 +185,95 @@ STATIC_URL = 'static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Django REST framework
+# Every list endpoint uses keyset (cursor) pagination; views pick their own
+# ordering and page size in octofit_tracker/pagination.py.
+
+REST_FRAMEWORK = {
+    'DEFAULT_PAGINATION_CLASS': 'octofit_tracker.pagination.OctofitCursorPagination',
+    'PAGE_SIZE': 50,
+}
+
+# Response cache for read-heavy endpoints (leaderboard, teams, workouts).
+# In-process LRU by default; set OCTOFIT_CACHE_URL (e.g. redis://localhost:6379/1)
+# to share one Redis-compatible cache, and its invalidations, across workers
+# (needs the optional redis package).
+OCTOFIT_CACHE_URL = os.environ.get('OCTOFIT_CACHE_URL')
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'api': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': OCTOFIT_CACHE_URL,
+    } if OCTOFIT_CACHE_URL else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'octofit-api',
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
+}
+
+OCTOFIT_API_CACHE_ALIAS = 'api'
+OCTOFIT_API_CACHE_ENABLED = os.environ.get('OCTOFIT_API_CACHE_ENABLED', '1') == '1'
+OCTOFIT_API_CACHE_TIMEOUT = int(os.environ.get('OCTOFIT_API_CACHE_TIMEOUT', 300))
+
+# Bulk activity ingestion (POST /api/activities/bulk/)
+OCTOFIT_BULK_MAX_ITEMS = int(os.environ.get('OCTOFIT_BULK_MAX_ITEMS', 10000))
+OCTOFIT_BULK_BATCH_SIZE = int(os.environ.get('OCTOFIT_BULK_BATCH_SIZE', 1000))
+
+# Write-behind ingestion (see writebehind.py): when on, activity POSTs are
+# queued in a local SQLite file and answered with 202, and a thread in each
+# process stores them in batches every interval (0: no thread, drain with
+# manage.py drain_activity_queue). Past MAX_PENDING queued activities, new
+# ones are refused with 503. A claimed batch not stored within LEASE seconds
+# is handed to the next flush. Entries that fail to store are retried after
+# RETRY_DELAY seconds times their failures, and dead-lettered after
+# MAX_ATTEMPTS failures.
+OCTOFIT_WRITE_BEHIND = os.environ.get('OCTOFIT_WRITE_BEHIND') == '1'
+OCTOFIT_WRITE_BEHIND_QUEUE = os.environ.get(
+    'OCTOFIT_WRITE_BEHIND_QUEUE', str(BASE_DIR / 'activity_queue.sqlite3')
+)
+OCTOFIT_WRITE_BEHIND_BATCH_SIZE = int(os.environ.get('OCTOFIT_WRITE_BEHIND_BATCH_SIZE', 500))
+OCTOFIT_WRITE_BEHIND_FLUSH_INTERVAL = float(os.environ.get('OCTOFIT_WRITE_BEHIND_FLUSH_INTERVAL', 1.0))
+OCTOFIT_WRITE_BEHIND_MAX_PENDING = int(os.environ.get('OCTOFIT_WRITE_BEHIND_MAX_PENDING', 50000))
+OCTOFIT_WRITE_BEHIND_LEASE = float(os.environ.get('OCTOFIT_WRITE_BEHIND_LEASE', 60.0))
+OCTOFIT_WRITE_BEHIND_RETRY_AFTER = int(os.environ.get('OCTOFIT_WRITE_BEHIND_RETRY_AFTER', 5))
+OCTOFIT_WRITE_BEHIND_RETRY_DELAY = float(os.environ.get('OCTOFIT_WRITE_BEHIND_RETRY_DELAY', 30.0))
+OCTOFIT_WRITE_BEHIND_MAX_ATTEMPTS = int(os.environ.get('OCTOFIT_WRITE_BEHIND_MAX_ATTEMPTS', 5))
+
+# Activity statistics from an in-process columnar cache (see analytics.py)
+# instead of aggregate queries; new, edited and deleted activities show up
+# within the interval
+OCTOFIT_ANALYTICS_CACHE = os.environ.get('OCTOFIT_ANALYTICS_CACHE') == '1'
+OCTOFIT_ANALYTICS_REFRESH_INTERVAL = float(os.environ.get('OCTOFIT_ANALYTICS_REFRESH_INTERVAL', 1.0))
+
+# Leaderboard event stream (ASGI only, see asgi.py): seconds between
+# change checks, which is also the longest a burst of writes is coalesced,
+# and seconds between keep-alive comments on idle connections
+OCTOFIT_STREAM_INTERVAL = float(os.environ.get('OCTOFIT_STREAM_INTERVAL', 1.0))
+OCTOFIT_STREAM_HEARTBEAT = float(os.environ.get('OCTOFIT_STREAM_HEARTBEAT', 15.0))
+
+# Request profiling (see profiling.py): Server-Timing headers, a JSON log
+# line per request on the octofit_tracker.profiling logger and per-view
+# Prometheus metrics at /metrics. Statements repeated this many times in one
+# request are logged as a likely N+1 pattern.
+OCTOFIT_PROFILING = os.environ.get('OCTOFIT_PROFILING') == '1'
+OCTOFIT_PROFILING_REPEAT_THRESHOLD = int(os.environ.get('OCTOFIT_PROFILING_REPEAT_THRESHOLD', 5))
+if OCTOFIT_PROFILING:
+    MIDDLEWARE.insert(0, 'octofit_tracker.middleware.ProfilingMiddleware')
+    LOGGING = {
+        'version': 1,
+        'disable_existing_loggers': False,
+        'handlers': {'console': {'class': 'logging.StreamHandler'}},
+        'loggers': {
+            'octofit_tracker.profiling': {'handlers': ['console'], 'level': 'INFO'},
+        },
+    }
+
+# Activity export: rows fetched per database round trip while streaming
+OCTOFIT_EXPORT_CHUNK_SIZE = int(os.environ.get('OCTOFIT_EXPORT_CHUNK_SIZE', 2000))
+
 # CORS settings
 CORS_ALLOW_ALL_ORIGINS = True
 CORS_ALLOW_CREDENTIALS = True
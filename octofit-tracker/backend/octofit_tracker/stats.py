@@ -0,0 +1,76 @@
+from django.db.models import Avg, Count, DateField, Sum
+from rest_framework.exceptions import ValidationError
+
+from .leaderboard import BUCKET_PERIODS
+
+STAT_FIELDS = ('duration', 'distance', 'calories')
+
+
+def parse_group_by(value):
+    """
+    ``?group_by=`` as a list of grouping keys.
+
+    Accepts ``activity_type`` and at most one time bucket (``day``, ``week``
+    or ``month``), comma separated. Defaults to ``activity_type``.
+    """
+    keys = [key for key in (value or 'activity_type').split(',') if key]
+    allowed = ('activity_type',) + tuple(BUCKET_PERIODS)
+    unknown = [key for key in keys if key not in allowed]
+    if unknown:
+        raise ValidationError({'group_by': f'Choose from: {", ".join(allowed)}.'})
+    if len([key for key in keys if key in BUCKET_PERIODS]) > 1:
+        raise ValidationError({'group_by': 'Group by at most one time bucket.'})
+    return list(dict.fromkeys(keys))
+
+
+def _aggregates():
+    aggregates = {'count': Count('id')}
+    for field in STAT_FIELDS:
+        aggregates[f'{field}_sum'] = Sum(field)
+        aggregates[f'{field}_avg'] = Avg(field)
+    return aggregates
+
+
+def stat_summary(row):
+    """Response shape for a row of ``count`` and ``<field>_sum``/``<field>_avg`` values"""
+    data = {'count': row['count']}
+    for field in STAT_FIELDS:
+        total = row[f'{field}_sum']
+        average = row[f'{field}_avg']
+        data[field] = {
+            'sum': total or 0,
+            'avg': round(average, 2) if average is not None else None,
+        }
+    return data
+
+
+def activity_stats(queryset, group_by):
+    """
+    Counts, sums and averages of duration, distance and calories.
+
+    Everything is computed by the database: one aggregate query for the
+    overall totals and one GROUP BY query for the groups, so no activity rows
+    are loaded. Averages of ``distance`` skip activities without one.
+    """
+    columns = []
+    for key in group_by:
+        if key in BUCKET_PERIODS:
+            queryset = queryset.annotate(
+                period_start=BUCKET_PERIODS[key]('date', output_field=DateField())
+            )
+            columns.append('period_start')
+        else:
+            columns.append(key)
+
+    groups = []
+    rows = queryset.values(*columns).annotate(**_aggregates()).order_by(*columns)
+    for row in rows:
+        group = {column: row[column] for column in columns}
+        group.update(stat_summary(row))
+        groups.append(group)
+
+    return {
+        'group_by': group_by,
+        'totals': stat_summary(queryset.aggregate(**_aggregates())),
+        'groups': groups,
+    }
@@ -1,8 +1,19 @@
-from django.test import TestCase
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, connection
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
+from asgiref.sync import sync_to_async
 from rest_framework import status
-from rest_framework.test import APITestCase, APIClient
-from .models import User, Team, Activity, Leaderboard, Workout
+from rest_framework.pagination import Cursor
+from rest_framework.request import Request
+from rest_framework.test import APITestCase, APIClient, APIRequestFactory
+from .models import User, Team, Activity, Leaderboard, RankLock, TeamLeaderboard, Workout
 from .serializers import (
     UserSerializer,
     TeamSerializer,
@@ -10,7 +21,40 @@ from .serializers import (
     LeaderboardSerializer,
     WorkoutSerializer
 )
-from datetime import datetime
+from .events import STREAM_PATH, leaderboard_stream
+from .filters import activity_filter_values
+from .leaderboard import (
+    find_mismatches,
+    find_team_mismatches,
+    rebuild_leaderboard,
+    recompute_ranks,
+    record_activities_created,
+    record_activity_created
+)
+from . import analytics, benchmarks, profiling, writebehind, wsgi
+from .middleware import LAST_WRITE_COOKIE, ProfilingMiddleware, ReadReplicaMiddleware
+from .pagination import ActivityCursorPagination
+from .repository import OrmRepository, get_repository
+from .routers import ReadReplicaRouter
+from .urls import router, urlpatterns
+from .views import (
+    UserViewSet,
+    TeamViewSet,
+    ActivityViewSet,
+    LeaderboardViewSet,
+    WorkoutViewSet
+)
+from datetime import datetime, timedelta
+from io import StringIO
+from unittest import mock
+import asyncio
+import csv
+import gzip
+import importlib
+import json
+import os
+import tempfile
+import time
 
 
 class UserModelTests(TestCase):
@@ -235,6 +279,1713 @@ class WorkoutAPITests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
 
+class LeaderboardEngineTests(APITestCase):
+    """Test cases for incremental leaderboard updates"""
+    
+    def setUp(self):
+        self.client = APIClient()
+    
+    def post_activity(self, user_id, calories):
+        return self.client.post(
+            reverse('activity-list'),
+            {
+                'user_id': user_id,
+                'activity_type': 'Running',
+                'duration': calories // 10,
+                'calories': calories,
+                'date': datetime.now().isoformat()
+            },
+            format='json'
+        )
+    
+    def ranking(self):
+        return {
+            entry.user_id: (entry.total_points, entry.total_activities, entry.rank)
+            for entry in Leaderboard.objects.all()
+        }
+    
+    def test_create_updates_totals_and_ranks(self):
+        """Test that creating activities keeps totals and ranks current"""
+        self.post_activity('alice', 100)
+        self.post_activity('bob', 300)
+        self.post_activity('alice', 250)
+        self.assertEqual(self.ranking(), {
+            'alice': (350, 2, 1),
+            'bob': (300, 1, 2),
+        })
+        self.assertEqual(find_mismatches(), [])
+    
+    def test_ties_share_rank(self):
+        """Test that users with equal points share a rank"""
+        self.post_activity('alice', 200)
+        self.post_activity('bob', 200)
+        self.post_activity('carol', 100)
+        self.assertEqual(
+            {user_id: rank for user_id, (_, _, rank) in self.ranking().items()},
+            {'alice': 1, 'bob': 1, 'carol': 3}
+        )
+    
+    def test_update_and_delete_apply_deltas(self):
+        """Test that editing and deleting activities reverse their points"""
+        first = self.post_activity('alice', 100).data['id']
+        self.post_activity('bob', 150)
+        self.client.patch(
+            reverse('activity-detail', args=[first]),
+            {'calories': 400},
+            format='json'
+        )
+        self.assertEqual(self.ranking()['alice'], (400, 1, 1))
+        self.client.patch(
+            reverse('activity-detail', args=[first]),
+            {'user_id': 'bob'},
+            format='json'
+        )
+        self.assertEqual(self.ranking()['bob'], (550, 2, 1))
+        self.client.delete(reverse('activity-detail', args=[first]))
+        self.assertEqual(self.ranking()['bob'], (150, 1, 1))
+        self.assertEqual(find_mismatches(), [])
+    
+    def test_batches_moving_many_users_keep_ranks(self):
+        """Test that one batch moving users past each other ranks every row correctly"""
+        for user_id, calories in [('alice', 100), ('bob', 200), ('carol', 300), ('dave', 400)]:
+            self.post_activity(user_id, calories)
+        now = timezone.now()
+        batch = [
+            Activity.objects.create(
+                user_id=user_id, activity_type='Running', duration=index + 1, calories=calories, date=now
+            )
+            for index, (user_id, calories) in enumerate(
+                [('alice', 350), ('bob', 50), ('erin', 250), ('erin', 50), ('carol', 0)]
+            )
+        ]
+        with self.assertNumQueries(13):
+            record_activities_created(batch)
+        self.assertEqual(self.ranking(), {
+            'alice': (450, 2, 1),
+            'dave': (400, 1, 2),
+            'carol': (300, 2, 3),
+            'erin': (300, 2, 3),
+            'bob': (250, 2, 5),
+        })
+        self.assertEqual(find_mismatches(), [])
+    
+    def test_rank_lock_is_taken_before_shifting(self):
+        """Test that rank maintenance locks the table's sentinel row before touching ranks"""
+        self.post_activity('alice', 100)
+        RankLock.objects.all().delete()
+        activity = Activity.objects.create(
+            user_id='bob', activity_type='Running', duration=20, calories=200, date=timezone.now()
+        )
+        with CaptureQueriesContext(connection) as queries:
+            record_activities_created([activity])
+        statements = [query['sql'] for query in queries.captured_queries if 'SAVEPOINT' not in query['sql']]
+        self.assertIn('"rank_locks"', statements[0])
+        self.assertTrue(RankLock.objects.filter(table='leaderboard').exists())
+        self.assertEqual(self.ranking()['bob'], (200, 1, 1))
+    
+    def test_rebuild_matches_incremental_totals(self):
+        """Test that a full rebuild agrees with incremental updates"""
+        self.post_activity('alice', 100)
+        self.post_activity('bob', 300)
+        self.post_activity('carol', 300)
+        incremental = self.ranking()
+        rebuild_leaderboard()
+        self.assertEqual(self.ranking(), incremental)
+
+
+class WindowedLeaderboardTests(APITestCase):
+    """Test cases for day/week/month leaderboards from rollup buckets"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        # Monday 2026-10-12 to Sunday 2026-10-18 is one ISO week
+        for user_id, calories, day in [
+            ('alice', 100, 12),
+            ('alice', 100, 18),
+            ('bob', 300, 14),
+            ('carol', 200, 13),
+            ('dave', 200, 15),
+            ('bob', 500, 19),
+        ]:
+            self.client.post(
+                reverse('activity-list'),
+                {
+                    'user_id': user_id,
+                    'activity_type': 'Running',
+                    'duration': 30,
+                    'calories': calories,
+                    'date': f'2026-10-{day:02d}T12:00:00Z'
+                },
+                format='json'
+            )
+    
+    def ranking(self, **params):
+        response = self.client.get(reverse('leaderboard-list'), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [
+            (row['user_id'], row['total_points'], row['rank'])
+            for row in response.data['results']
+        ]
+    
+    def test_week_window(self):
+        """Test ranking within the ISO week containing ?at="""
+        self.assertEqual(self.ranking(window='week', at='2026-10-14'), [
+            ('bob', 300, 1),
+            ('alice', 200, 2),
+            ('carol', 200, 2),
+            ('dave', 200, 2),
+        ])
+    
+    def test_ranks_continue_across_pages(self):
+        """Test that ranks stay correct on later pages"""
+        response = self.client.get(
+            reverse('leaderboard-list'),
+            {'window': 'week', 'at': '2026-10-14', 'page_size': 2}
+        )
+        second = self.client.get(response.data['next'])
+        self.assertEqual(
+            [(row['user_id'], row['rank']) for row in second.data['results']],
+            [('carol', 2), ('dave', 2)]
+        )
+    
+    def test_day_and_month_windows(self):
+        """Test day and month buckets"""
+        self.assertEqual(self.ranking(window='day', at='2026-10-19'), [('bob', 500, 1)])
+        self.assertEqual(
+            self.ranking(window='month', at='2026-10-01')[0], ('bob', 800, 1)
+        )
+    
+    def test_delete_updates_buckets(self):
+        """Test that deleting an activity removes it from its bucket"""
+        activity = Activity.objects.get(user_id='bob', calories=300)
+        self.client.delete(reverse('activity-detail', args=[activity.id]))
+        self.assertEqual(self.ranking(window='week', at='2026-10-14')[-1], ('bob', 0, 4))
+    
+    def test_rebuild_matches_incremental_buckets(self):
+        """Test that rebuilding buckets reproduces incremental results"""
+        before = self.ranking(window='week', at='2026-10-14')
+        rebuild_leaderboard()
+        self.assertEqual(self.ranking(window='week', at='2026-10-14'), before)
+    
+    def test_invalid_window_is_rejected(self):
+        """Test that an unknown window returns 400"""
+        response = self.client.get(reverse('leaderboard-list'), {'window': 'year'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(OCTOFIT_API_CACHE_ENABLED=False)
+class LeaderboardSliceTests(APITestCase):
+    """Test cases for top-N and around-user leaderboard queries"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        # user-3 and user-4 tie for third place
+        for index, (points, rank) in enumerate(
+            [(900, 1), (800, 2), (700, 3), (700, 3), (600, 5), (500, 6), (400, 7)]
+        ):
+            Leaderboard.objects.create(user_id=f'user-{index + 1}', total_points=points, rank=rank)
+    
+    def fetch(self, params, queries):
+        with self.assertNumQueries(queries):
+            response = self.client.get(reverse('leaderboard-list'), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [row['user_id'] for row in response.data['results']]
+    
+    def test_top_n(self):
+        """Test that ?top=N returns the first N rows in one query"""
+        self.assertEqual(self.fetch({'top': 3}, 1), ['user-1', 'user-2', 'user-3'])
+    
+    def test_around_user(self):
+        """Test the slice of the ranking either side of a user"""
+        self.assertEqual(
+            self.fetch({'around': 'user-4', 'radius': 2}, 3),
+            ['user-2', 'user-3', 'user-4', 'user-5', 'user-6']
+        )
+        self.assertEqual(
+            self.fetch({'around': 'user-3', 'radius': 1}, 3),
+            ['user-2', 'user-3', 'user-4']
+        )
+    
+    def test_around_user_at_the_edges(self):
+        """Test that slices are cut short at the top and bottom"""
+        self.assertEqual(self.fetch({'around': 'user-1', 'radius': 2}, 3), ['user-1', 'user-2', 'user-3'])
+        self.assertEqual(self.fetch({'around': 'user-7', 'radius': 1}, 3), ['user-6', 'user-7'])
+    
+    def test_invalid_slices(self):
+        """Test validation of top, radius and unknown users"""
+        url = reverse('leaderboard-list')
+        self.assertEqual(self.client.get(url, {'top': 0}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            self.client.get(url, {'around': 'user-1', 'radius': 'x'}).status_code,
+            status.HTTP_400_BAD_REQUEST
+        )
+        self.assertEqual(
+            self.client.get(url, {'top': 3, 'window': 'day'}).status_code,
+            status.HTTP_400_BAD_REQUEST
+        )
+        self.assertEqual(self.client.get(url, {'around': 'nobody'}).status_code, status.HTTP_404_NOT_FOUND)
+
+
+class ResponseCacheTests(APITestCase):
+    """Test cases for cached leaderboard/team/workout responses"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        caches[settings.OCTOFIT_API_CACHE_ALIAS].clear()
+        Workout.objects.create(
+            name='Cached Run',
+            description='Run',
+            difficulty_level='Beginner',
+            duration=20,
+            category='Cardio'
+        )
+    
+    def test_second_read_is_served_from_cache(self):
+        """Test that a repeated read hits the cache without queries"""
+        first = self.client.get(reverse('workout-list'))
+        self.assertEqual(first['X-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            second = self.client.get(reverse('workout-list'))
+        self.assertEqual(second['X-Cache'], 'HIT')
+        self.assertEqual(second.data, first.data)
+    
+    def test_if_none_match_returns_304(self):
+        """Test that a matching ETag short-circuits with 304"""
+        etag = self.client.get(reverse('workout-list'))['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('workout-list'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+    
+    def test_replica_reads_are_not_cached(self):
+        """Test that responses read from the replica are not stored under the generation"""
+        # Point the replica at the test database so the reads succeed
+        with override_settings(OCTOFIT_READ_REPLICA='default'):
+            first = self.client.get(reverse('workout-list'))
+            second = self.client.get(reverse('workout-list'))
+        self.assertEqual(second.status_code, status.HTTP_200_OK)
+        self.assertNotIn('ETag', first)
+        self.assertNotIn('X-Cache', second)
+        self.assertEqual(self.client.get(reverse('workout-list'))['X-Cache'], 'MISS')
+    
+    def test_write_invalidates_cached_pages(self):
+        """Test that writes through the API change the ETag and the data"""
+        first = self.client.get(reverse('workout-list'))
+        self.client.post(
+            reverse('workout-list'),
+            {
+                'name': 'Second',
+                'description': 'Swim',
+                'difficulty_level': 'Beginner',
+                'duration': 20,
+                'category': 'Swimming'
+            },
+            format='json'
+        )
+        second = self.client.get(reverse('workout-list'), HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(second.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(second.data['results']), 2)
+    
+    def test_activity_write_invalidates_leaderboard(self):
+        """Test that recording an activity refreshes the cached leaderboard"""
+        self.client.get(reverse('leaderboard-list'))
+        self.client.post(
+            reverse('activity-list'),
+            {
+                'user_id': 'alice',
+                'activity_type': 'Running',
+                'duration': 30,
+                'calories': 100,
+                'date': timezone.now().isoformat()
+            },
+            format='json'
+        )
+        response = self.client.get(reverse('leaderboard-list'))
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(len(response.data['results']), 1)
+
+
+class TeamLeaderboardTests(APITestCase):
+    """Test cases for the materialized team leaderboard"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.red = Team.objects.create(name='Red')
+        self.blue = Team.objects.create(name='Blue')
+        self.alice = self.create_user('alice', self.red)
+        self.bob = self.create_user('bob', self.red)
+        self.carol = self.create_user('carol', self.blue)
+    
+    def create_user(self, name, team):
+        response = self.client.post(
+            reverse('user-list'),
+            {'email': f'{name}@example.com', 'name': name, 'team_id': str(team.id)},
+            format='json'
+        )
+        return response.data['id']
+    
+    def post_activity(self, user_id, calories):
+        self.client.post(
+            reverse('activity-list'),
+            {
+                'user_id': user_id,
+                'activity_type': 'Running',
+                'duration': calories // 10,
+                'calories': calories,
+                'date': timezone.now().isoformat()
+            },
+            format='json'
+        )
+    
+    def standings(self):
+        response = self.client.get(reverse('team-leaderboard-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [
+            (row['team_id'], row['total_points'], row['member_count'], row['average_points'], row['rank'])
+            for row in response.data['results']
+        ]
+    
+    def test_activities_update_team_totals(self):
+        """Test that activity writes roll up into team standings"""
+        self.post_activity(self.alice, 100)
+        self.post_activity(self.bob, 50)
+        self.post_activity(self.carol, 200)
+        self.assertEqual(self.standings(), [
+            (str(self.blue.id), 200, 1, 200.0, 1),
+            (str(self.red.id), 150, 2, 75.0, 2),
+        ])
+        self.assertEqual(find_team_mismatches(), [])
+    
+    def test_membership_change_moves_points(self):
+        """Test that switching teams moves a member and their points"""
+        self.post_activity(self.alice, 100)
+        self.post_activity(self.carol, 60)
+        self.client.patch(
+            reverse('user-detail', args=[self.alice]),
+            {'team_id': str(self.blue.id)},
+            format='json'
+        )
+        self.assertEqual(self.standings(), [
+            (str(self.blue.id), 160, 2, 80.0, 1),
+            (str(self.red.id), 0, 1, 0.0, 2),
+        ])
+        self.assertEqual(find_team_mismatches(), [])
+    
+    def test_deleted_team_stays_deleted(self):
+        """Test that members' later activities do not recreate a deleted team"""
+        self.post_activity(self.alice, 100)
+        self.post_activity(self.carol, 60)
+        self.client.delete(reverse('team-detail', args=[self.red.id]))
+        self.post_activity(self.bob, 50)
+        self.assertEqual(self.standings(), [(str(self.blue.id), 60, 1, 60.0, 1)])
+        self.assertIsNone(User.objects.get(id=self.alice).team_id)
+        self.assertEqual(find_team_mismatches(), [])
+    
+    def test_url_does_not_clash_with_leaderboard_detail(self):
+        """Test that /leaderboard/teams/ is routed to team standings"""
+        self.assertEqual(reverse('team-leaderboard-list'), '/api/leaderboard/teams/')
+
+
+class ActivityBulkAPITests(APITestCase):
+    """Test cases for bulk activity ingestion"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.url = reverse('activity-bulk')
+    
+    def activity(self, user_id, calories):
+        return {
+            'user_id': user_id,
+            'activity_type': 'Running',
+            'duration': calories // 10,
+            'calories': calories,
+            'date': timezone.now().isoformat()
+        }
+    
+    def test_bulk_json(self):
+        """Test creating a JSON batch and updating the leaderboard once"""
+        response = self.client.post(
+            self.url,
+            [self.activity('alice', 100), self.activity('alice', 50), self.activity('bob', 120)],
+            format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['created'], 3)
+        self.assertEqual(Activity.objects.count(), 3)
+        entry = Leaderboard.objects.get(user_id='alice')
+        self.assertEqual((entry.total_points, entry.total_activities, entry.rank), (150, 2, 1))
+        self.assertEqual(find_mismatches(), [])
+    
+    def test_bulk_ndjson_reports_item_errors(self):
+        """Test that invalid NDJSON items are reported by index"""
+        body = '\n'.join([
+            json.dumps(self.activity('alice', 100)),
+            json.dumps({'user_id': 'bob'}),
+            '',
+        ])
+        response = self.client.post(self.url, body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual(response.data['created'], 1)
+        self.assertEqual(response.data['errors'][0]['index'], 1)
+        self.assertIn('calories', response.data['errors'][0]['errors'])
+    
+    def test_bulk_rejects_non_list(self):
+        """Test that a single object body is rejected"""
+        response = self.client.post(self.url, self.activity('alice', 100), format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ActivityIdempotencyTests(APITestCase):
+    """Test cases for deduplicating retried activity uploads"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.data = {
+            'user_id': 'alice',
+            'activity_type': 'Running',
+            'duration': 30,
+            'calories': 300,
+            'date': '2026-10-12T08:00:00.250Z'
+        }
+    
+    def test_retry_returns_existing_activity(self):
+        """Test that a repeated upload is stored and counted once"""
+        first = self.client.post(reverse('activity-list'), self.data, format='json')
+        retry = self.client.post(
+            reverse('activity-list'),
+            {**self.data, 'date': '2026-10-12T08:00:00.900Z', 'calories': 310},
+            format='json'
+        )
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.status_code, status.HTTP_200_OK)
+        self.assertEqual(retry.data['id'], first.data['id'])
+        self.assertEqual(retry.data['calories'], 300)
+        self.assertNotIn('idempotency_key', retry.data)
+        self.assertEqual(Activity.objects.count(), 1)
+        self.assertEqual(Leaderboard.objects.get(user_id='alice').total_points, 300)
+    
+    def test_client_key_is_scoped_to_user(self):
+        """Test that client keys, in the body or header, dedupe per user"""
+        url = reverse('activity-list')
+        first = self.client.post(url, {**self.data, 'idempotency_key': 'upload-1'}, format='json')
+        retry = self.client.post(
+            url, {**self.data, 'duration': 31}, format='json', HTTP_IDEMPOTENCY_KEY='upload-1'
+        )
+        other_user = self.client.post(
+            url, {**self.data, 'user_id': 'bob', 'idempotency_key': 'upload-1'}, format='json'
+        )
+        self.assertEqual(retry.status_code, status.HTTP_200_OK)
+        self.assertEqual(retry.data['id'], first.data['id'])
+        self.assertEqual(other_user.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Activity.objects.count(), 2)
+    
+    def test_bulk_reports_existing_activities(self):
+        """Test that bulk items repeating stored or earlier items are not inserted"""
+        stored = self.client.post(reverse('activity-list'), self.data, format='json').data
+        response = self.client.post(
+            reverse('activity-bulk'),
+            [
+                {'user_id': 'bob'},
+                {**self.data, 'duration': 45},
+                self.data,
+                {**self.data, 'duration': 45, 'calories': 1},
+            ],
+            format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual(
+            (response.data['created'], response.data['duplicates'], response.data['failed']),
+            (1, 2, 1)
+        )
+        created = Activity.objects.get(duration=45)
+        self.assertEqual(
+            [(item['index'], item['activity']['id']) for item in response.data['existing']],
+            [(2, stored['id']), (3, str(created.id))]
+        )
+        self.assertEqual(Activity.objects.count(), 2)
+        self.assertEqual(find_mismatches(), [])
+        
+        retry = self.client.post(reverse('activity-bulk'), [self.data], format='json')
+        self.assertEqual(retry.status_code, status.HTTP_200_OK)
+        self.assertEqual((retry.data['created'], retry.data['duplicates']), (0, 1))
+    
+    def test_repository_skips_keys_taken_concurrently(self):
+        """Test that an insert losing the race for a key leaves it out"""
+        taken = Activity.objects.create(
+            user_id='alice', activity_type='Running', duration=30, calories=300,
+            date=timezone.now()
+        )
+        rows = [
+            {'user_id': 'alice', 'activity_type': 'Yoga', 'duration': 20, 'calories': 80,
+             'date': timezone.now(), 'idempotency_key': key}
+            for key in (taken.idempotency_key, 'f' * 64)
+        ]
+        created = OrmRepository().insert_activities(rows, batch_size=10)
+        self.assertEqual([activity.idempotency_key for activity in created], ['f' * 64])
+        self.assertEqual(Activity.objects.count(), 2)
+
+
+class WriteBehindTests(APITestCase):
+    """Test cases for write-behind activity ingestion"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(
+            OCTOFIT_WRITE_BEHIND=True,
+            OCTOFIT_WRITE_BEHIND_QUEUE=os.path.join(directory.name, 'queue.sqlite3'),
+            OCTOFIT_WRITE_BEHIND_FLUSH_INTERVAL=0,
+            OCTOFIT_WRITE_BEHIND_MAX_PENDING=3
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+    
+    def activity(self, user_id, duration):
+        return {
+            'user_id': user_id,
+            'activity_type': 'Running',
+            'duration': duration,
+            'calories': duration * 10,
+            'date': '2026-10-12T08:00:00Z'
+        }
+    
+    def test_post_is_queued_then_flushed(self):
+        """Test that POSTs answer 202 and are stored, once, by the flush"""
+        for _ in range(2):
+            response = self.client.post(reverse('activity-list'), self.activity('alice', 30), format='json')
+            self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+            self.assertEqual(response.data['user_id'], 'alice')
+        self.assertEqual(Activity.objects.count(), 0)
+        self.assertEqual(writebehind.get_queue().pending(), 2)
+        
+        self.assertEqual(writebehind.flush(), 2)
+        self.assertEqual(Activity.objects.count(), 1)
+        self.assertEqual(writebehind.get_queue().pending(), 0)
+        entry = Leaderboard.objects.get(user_id='alice')
+        self.assertEqual((entry.total_points, entry.total_activities), (300, 1))
+    
+    def test_full_queue_refuses_with_retry_after(self):
+        """Test back-pressure once MAX_PENDING activities are waiting"""
+        response = self.client.post(
+            reverse('activity-bulk'),
+            [self.activity('alice', 30), self.activity('bob', 40), {'user_id': 'carol'}],
+            format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual((response.data['queued'], response.data['failed']), (2, 1))
+        
+        self.client.post(reverse('activity-list'), self.activity('carol', 50), format='json')
+        response = self.client.post(reverse('activity-list'), self.activity('dave', 60), format='json')
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response['Retry-After'], str(settings.OCTOFIT_WRITE_BEHIND_RETRY_AFTER))
+        self.assertEqual(writebehind.get_queue().pending(), 3)
+    
+    def test_drain_command_stores_everything(self):
+        """Test that drain_activity_queue empties the queue in batches"""
+        self.client.post(
+            reverse('activity-bulk'),
+            [self.activity('alice', 30), self.activity('alice', 40), self.activity('bob', 50)],
+            format='json'
+        )
+        out = StringIO()
+        call_command('drain_activity_queue', batch_size=2, stdout=out)
+        self.assertIn('Drained 3 queued activities', out.getvalue())
+        self.assertEqual(Activity.objects.count(), 3)
+        self.assertEqual(find_mismatches(), [])
+    
+    def test_failed_flush_is_retried_after_the_delay(self):
+        """Test that entries stay queued, out of the way, when storing them fails"""
+        self.client.post(reverse('activity-list'), self.activity('alice', 30), format='json')
+        with mock.patch.object(
+            OrmRepository, 'insert_activities', side_effect=DatabaseError('primary unavailable')
+        ):
+            with self.assertLogs('octofit_tracker.writebehind', 'ERROR'):
+                self.assertEqual(writebehind.flush(), 1)
+        self.assertEqual(writebehind.get_queue().pending(), 1)
+        self.assertEqual(writebehind.flush(), 0)
+        
+        with mock.patch.object(writebehind, 'time') as clock:
+            clock.time.return_value = time.time() + settings.OCTOFIT_WRITE_BEHIND_RETRY_DELAY
+            self.assertEqual(writebehind.flush(), 1)
+        self.assertEqual(Activity.objects.count(), 1)
+        self.assertEqual(writebehind.get_queue().pending(), 0)
+    
+    def test_poison_entry_is_dead_lettered_without_blocking_the_queue(self):
+        """Test that an entry that always fails is dead-lettered after MAX_ATTEMPTS"""
+        self.client.post(
+            reverse('activity-bulk'),
+            [self.activity('poison', 30), self.activity('alice', 40)],
+            format='json'
+        )
+        insert_activities = OrmRepository.insert_activities
+        
+        def insert_or_fail(repository, rows, batch_size):
+            if any(row['user_id'] == 'poison' for row in rows):
+                raise DatabaseError('value out of range')
+            return insert_activities(repository, rows, batch_size)
+        
+        with override_settings(OCTOFIT_WRITE_BEHIND_RETRY_DELAY=0, OCTOFIT_WRITE_BEHIND_MAX_ATTEMPTS=3):
+            with mock.patch.object(OrmRepository, 'insert_activities', insert_or_fail):
+                with self.assertLogs('octofit_tracker.writebehind', 'ERROR'):
+                    writebehind.drain()
+        self.assertEqual(list(Activity.objects.values_list('user_id', flat=True)), ['alice'])
+        self.assertEqual(writebehind.get_queue().pending(), 0)
+        self.assertEqual(writebehind.get_queue().dead_lettered(), 1)
+    
+    def test_activities_of_deleted_users_are_dead_lettered(self):
+        """Test that the flush does not store activities of users deleted while queued"""
+        user = User.objects.create(email='gone@example.com', name='Gone')
+        self.client.post(
+            reverse('activity-bulk'),
+            [self.activity(str(user.id), 30), self.activity('alice', 40)],
+            format='json'
+        )
+        self.client.delete(reverse('user-detail', args=[user.id]))
+        with self.assertLogs('octofit_tracker.writebehind', 'WARNING'):
+            self.assertEqual(writebehind.flush(), 2)
+        self.assertEqual(list(Activity.objects.values_list('user_id', flat=True)), ['alice'])
+        self.assertFalse(Leaderboard.objects.filter(user_id=str(user.id)).exists())
+        self.assertEqual(writebehind.get_queue().dead_lettered(), 1)
+        self.assertEqual(writebehind.get_queue().pending(), 0)
+    
+    def test_worker_starts_with_the_server_not_commands(self):
+        """Test that the flush thread is started by wsgi.py, not by AppConfig.ready()"""
+        with mock.patch.object(writebehind, 'start_worker') as start_worker:
+            apps.get_app_config('octofit_tracker').ready()
+            start_worker.assert_not_called()
+            importlib.reload(wsgi)
+        start_worker.assert_called_once_with()
+
+
+class ActivityFilterTests(APITestCase):
+    """Test cases for server-side activity filtering"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        now = timezone.now()
+        for user_id, activity_type, days_ago in [
+            ('alice', 'Running', 1),
+            ('alice', 'Cycling', 10),
+            ('bob', 'Running', 2),
+            ('bob', 'Yoga', 40),
+        ]:
+            Activity.objects.create(
+                user_id=user_id,
+                activity_type=activity_type,
+                duration=30,
+                calories=100,
+                date=now - timedelta(days=days_ago)
+            )
+    
+    def fetch(self, **params):
+        response = self.client.get(reverse('activity-list'), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [
+            (item['user_id'], item['activity_type'])
+            for item in response.data['results']
+        ]
+    
+    def test_filter_by_user_and_type(self):
+        """Test filtering by user_id and activity_type"""
+        self.assertEqual(
+            sorted(self.fetch(user_id='alice')),
+            [('alice', 'Cycling'), ('alice', 'Running')]
+        )
+        self.assertEqual(
+            sorted(self.fetch(activity_type='Running,Yoga', user_id='bob')),
+            [('bob', 'Running'), ('bob', 'Yoga')]
+        )
+    
+    def test_filter_by_date_range(self):
+        """Test that date_from and date_to bound the results"""
+        today = timezone.now().date()
+        self.assertEqual(
+            sorted(self.fetch(date_from=(today - timedelta(days=5)).isoformat())),
+            [('alice', 'Running'), ('bob', 'Running')]
+        )
+        self.assertEqual(
+            self.fetch(date_to=(today - timedelta(days=30)).isoformat()),
+            [('bob', 'Yoga')]
+        )
+    
+    def test_bare_date_to_includes_the_whole_day(self):
+        """Test that date_to=YYYY-MM-DD includes activities later that day"""
+        Activity.objects.create(
+            user_id='carol',
+            activity_type='Rowing',
+            duration=30,
+            calories=100,
+            date=timezone.make_aware(datetime(2026, 10, 12, 18, 30))
+        )
+        self.assertEqual(self.fetch(user_id='carol', date_to='2026-10-12'), [('carol', 'Rowing')])
+        self.assertEqual(self.fetch(user_id='carol', date_to='2026-10-11'), [])
+    
+    def test_invalid_date_is_rejected(self):
+        """Test that an unparseable date returns 400"""
+        response = self.client.get(reverse('activity-list'), {'date_from': 'yesterday'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ActivityStatsAPITests(APITestCase):
+    """Test cases for the activity statistics endpoints"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create(email='stats@example.com', name='Stats User')
+        user_id = str(self.user.id)
+        monday = timezone.make_aware(datetime(2026, 10, 12, 8, 0))
+        rows = [
+            (user_id, 'Running', 30, 5.0, 300, monday),
+            (user_id, 'Running', 60, 10.0, 600, monday + timedelta(days=7)),
+            (user_id, 'Yoga', 45, None, 150, monday + timedelta(days=1)),
+            ('someone-else', 'Running', 20, 3.0, 200, monday),
+        ]
+        for owner, activity_type, duration, distance, calories, date in rows:
+            Activity.objects.create(
+                user_id=owner,
+                activity_type=activity_type,
+                duration=duration,
+                distance=distance,
+                calories=calories,
+                date=date
+            )
+    
+    def test_user_stats_by_activity_type(self):
+        """Test per-user sums, counts and averages by activity type"""
+        url = reverse('user-stats', args=[self.user.id])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['totals']['count'], 3)
+        self.assertEqual(response.data['totals']['calories']['sum'], 1050)
+        running, yoga = response.data['groups']
+        self.assertEqual(running['activity_type'], 'Running')
+        self.assertEqual(running['count'], 2)
+        self.assertEqual(running['distance'], {'sum': 15.0, 'avg': 7.5})
+        self.assertEqual(running['duration']['avg'], 45)
+        self.assertEqual(yoga['distance'], {'sum': 0, 'avg': None})
+    
+    def test_user_stats_by_week_within_date_range(self):
+        """Test time buckets combined with the date filters"""
+        url = reverse('user-stats', args=[self.user.id])
+        response = self.client.get(url, {
+            'group_by': 'activity_type,week',
+            'date_to': '2026-10-18'
+        })
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(group['activity_type'], str(group['period_start']), group['count'])
+             for group in response.data['groups']],
+            [('Running', '2026-10-12', 1), ('Yoga', '2026-10-12', 1)]
+        )
+    
+    def test_activity_stats_across_users(self):
+        """Test stats over all activities honour the list filters"""
+        url = reverse('activity-stats')
+        response = self.client.get(url, {'activity_type': 'Running'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['totals']['count'], 3)
+        self.assertEqual(response.data['totals']['duration']['sum'], 110)
+    
+    def test_stats_reject_unknown_grouping(self):
+        """Test that unsupported group_by values are a 400"""
+        response = self.client.get(reverse('activity-stats'), {'group_by': 'day,month'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(reverse('activity-stats'), {'group_by': 'user'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_unknown_user_is_404(self):
+        """Test stats for a missing user"""
+        response = self.client.get(reverse('user-stats', args=[999999]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+@override_settings(OCTOFIT_ANALYTICS_CACHE=True)
+class ActivityStatsCacheTests(ActivityStatsAPITests):
+    """Test cases for answering the statistics endpoints from the column cache"""
+    
+    def setUp(self):
+        super().setUp()
+        # Each test starts from its own data, so from an empty cache
+        patcher = mock.patch.object(analytics, '_cache', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+    
+    def test_matches_database_aggregates(self):
+        """Test that the cache returns exactly what the aggregate queries do"""
+        cases = [
+            ('activity-stats', None, {}),
+            ('activity-stats', None, {'group_by': 'activity_type,day'}),
+            ('activity-stats', None, {'group_by': 'month', 'date_from': '2026-10-13'}),
+            ('activity-stats', None, {'group_by': 'week,activity_type', 'activity_type': 'Running,Yoga'}),
+            ('activity-stats', None, {'user_id': 'nobody'}),
+            ('activity-stats', None, {'group_by': 'day', 'date_from': '2026-10-12T09:00:00'}),
+            ('user-stats', [self.user.id], {'group_by': 'activity_type,week', 'date_to': '2026-10-18'}),
+        ]
+        for route, args, params in cases:
+            with self.subTest(route=route, params=params):
+                url = reverse(route, args=args)
+                cached = self.client.get(url, params)
+                with self.settings(OCTOFIT_ANALYTICS_CACHE=False):
+                    expected = self.client.get(url, params)
+                self.assertEqual(cached.status_code, status.HTTP_200_OK)
+                self.assertEqual(cached.json(), expected.json())
+    
+    def test_refresh_adds_new_and_reloads_edited_activities(self):
+        """Test incremental loading by created_at and reloading after edits"""
+        url = reverse('activity-stats')
+        self.assertEqual(self.client.get(url).data['totals']['count'], 4)
+        
+        activity = Activity.objects.create(
+            user_id='late', activity_type='Swimming', duration=40, calories=400,
+            date=timezone.now()
+        )
+        with self.settings(OCTOFIT_ANALYTICS_REFRESH_INTERVAL=0):
+            self.assertEqual(self.client.get(url).data['totals']['count'], 5)
+            self.assertEqual(analytics.get_columns().size, 5)
+            
+            activity.calories = 500
+            activity.save()
+            totals = self.client.get(url, {'activity_type': 'Swimming'}).data['totals']
+            self.assertEqual(totals['calories']['sum'], 500)
+            self.assertEqual(analytics.get_columns().size, 5)
+    
+    def test_other_processes_apply_edits_and_deletes_by_id(self):
+        """Test that a cache that did not see the edit updates only the changed rows"""
+        url = reverse('activity-stats')
+        other = analytics.ActivityColumns()
+        other.refresh()
+        self.assertEqual(other.size, 4)
+        
+        first, second = Activity.objects.order_by('id')[:2]
+        self.client.patch(reverse('activity-detail', args=[first.id]), {'calories': 1234}, format='json')
+        self.client.delete(reverse('activity-detail', args=[second.id]))
+        with mock.patch.object(analytics, '_cache', other), mock.patch.object(other, 'reset') as reset:
+            other.refresh(force=True)
+            cached = self.client.get(url, {'group_by': 'activity_type,day'})
+        reset.assert_not_called()
+        self.assertEqual(other.size, 3)
+        with self.settings(OCTOFIT_ANALYTICS_CACHE=False):
+            expected = self.client.get(url, {'group_by': 'activity_type,day'})
+        self.assertEqual(cached.json(), expected.json())
+    
+    def test_columns_are_compact(self):
+        """Test that the cache keeps well under 100 bytes per activity"""
+        self.client.get(reverse('activity-stats'))
+        columns = analytics.get_columns()
+        self.assertEqual(columns.size, 4)
+        row_bytes = sum(columns.column(name).nbytes for name in analytics.COLUMNS)
+        self.assertLess(row_bytes / columns.size, 100)
+        self.assertEqual(sorted(columns.types), ['Running', 'Yoga'])
+
+
+class ExpandAPITests(APITestCase):
+    """Test cases for ?expand= on list endpoints"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.team = Team.objects.create(name='Expand Team')
+        self.users = [
+            User.objects.create(
+                email=f'expand{i}@example.com',
+                name=f'Expand User{i}',
+                team_id=str(self.team.id)
+            )
+            for i in range(4)
+        ]
+        for rank, user in enumerate(self.users, start=1):
+            Leaderboard.objects.create(user_id=str(user.id), total_points=100 - rank, rank=rank)
+            Activity.objects.create(
+                user_id=str(user.id),
+                activity_type='Running',
+                duration=30,
+                calories=100,
+                date=timezone.now()
+            )
+    
+    def test_leaderboard_expand_user_and_team(self):
+        """Test that expanded rows carry user and team summaries"""
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('leaderboard-list'), {'expand': 'user,team'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        first = response.data['results'][0]
+        self.assertEqual(first['user']['name'], 'Expand User0')
+        self.assertEqual(first['team']['name'], 'Expand Team')
+    
+    def test_expand_queries_do_not_grow_with_page(self):
+        """Test that expansion uses one lookup per relation, not per row"""
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('activity-list'), {'expand': 'user'})
+        self.assertEqual(len(response.data['results']), 4)
+        with self.assertNumQueries(2):
+            self.client.get(reverse('user-list'), {'expand': 'team'})
+    
+    def test_unknown_expand_is_rejected(self):
+        """Test that an unsupported expansion returns 400"""
+        response = self.client.get(reverse('user-list'), {'expand': 'user'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_no_expand_leaves_rows_unchanged(self):
+        """Test that rows are unchanged without ?expand="""
+        response = self.client.get(reverse('activity-list'))
+        self.assertNotIn('user', response.data['results'][0])
+
+
+@override_settings(OCTOFIT_API_CACHE_ENABLED=False)
+class FastListSerializerTests(APITestCase):
+    """Test cases for the .values() fast path on list endpoints"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        team = Team.objects.create(name='Fast Team', description='')
+        User.objects.create(email='ada@example.com', name='Ada Lovelace King', team_id=str(team.id))
+        User.objects.create(email='', name='Solo', team_id=None)
+        Activity.objects.create(
+            user_id='1', activity_type='Yoga', duration=30, distance=None,
+            calories=90, date=timezone.now()
+        )
+        Activity.objects.create(
+            user_id='1', activity_type='Running', duration=30, distance=5.5,
+            calories=300, date=timezone.now()
+        )
+        Leaderboard.objects.create(user_id='1', total_points=390, total_activities=2, rank=1)
+        Workout.objects.create(
+            name='Fast', description='Go', difficulty_level='Beginner',
+            duration=10, category='Cardio'
+        )
+    
+    def test_fast_path_is_byte_identical(self):
+        """Test that fast and regular serializers render the same bytes"""
+        for name, viewset in [
+            ('user-list', UserViewSet),
+            ('team-list', TeamViewSet),
+            ('activity-list', ActivityViewSet),
+            ('leaderboard-list', LeaderboardViewSet),
+            ('workout-list', WorkoutViewSet),
+        ]:
+            fast = self.client.get(reverse(name))
+            with mock.patch.object(viewset, 'fast_list', False):
+                regular = self.client.get(reverse(name))
+            self.assertEqual(fast.status_code, status.HTTP_200_OK)
+            self.assertEqual(fast.content, regular.content, name)
+
+
+class ActivityExportTests(APITestCase):
+    """Test cases for streaming activity export"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        base = timezone.now().replace(microsecond=0) - timedelta(days=10)
+        self.activities = [
+            Activity.objects.create(
+                user_id=f'user{i % 2}',
+                activity_type='Running',
+                duration=30 + i,
+                distance=None if i % 2 else 5.0,
+                calories=100 + i,
+                date=base + timedelta(days=i // 2)
+            )
+            for i in range(5)
+        ]
+    
+    def export(self, **params):
+        response = self.client.get(reverse('activity-export'), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content)
+    
+    def test_ndjson_matches_api_rows(self):
+        """Test that NDJSON rows match the API representation"""
+        lines = self.export().decode().splitlines()
+        self.assertEqual(len(lines), 5)
+        self.assertEqual(
+            json.loads(lines[0]),
+            json.loads(json.dumps(ActivitySerializer(self.activities[0]).data))
+        )
+    
+    def test_csv_and_gzip(self):
+        """Test CSV output and gzip compression"""
+        body = gzip.decompress(self.export(output='csv', compress='gzip')).decode()
+        rows = list(csv.DictReader(StringIO(body)))
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(rows[0]['calories'], '100')
+    
+    def test_csv_header(self):
+        """Test that the CSV columns are the readable activity fields"""
+        header = self.export(output='csv').decode().splitlines()[0]
+        self.assertEqual(header, 'id,user_id,activity_type,duration,distance,calories,date,created_at')
+    
+    def test_resume_from_watermark(self):
+        """Test that after_date/after_id resume after the last exported row"""
+        first = [json.loads(line) for line in self.export().decode().splitlines()]
+        last = first[2]
+        rest = [
+            json.loads(line)
+            for line in self.export(after_date=last['date'], after_id=last['id']).decode().splitlines()
+        ]
+        self.assertEqual([row['id'] for row in rest], [row['id'] for row in first[3:]])
+    
+    def test_export_command(self):
+        """Test the export_activities management command"""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'activities.ndjson.gz')
+            stderr = StringIO()
+            call_command('export_activities', output=path, gzip=True, stderr=stderr)
+            with gzip.open(path, 'rt') as exported:
+                self.assertEqual(len(exported.read().splitlines()), 5)
+        self.assertIn('Resume with: --after-date', stderr.getvalue())
+
+
+class AsyncReadEndpointTests(APITestCase):
+    """Test cases for the async read endpoints"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        for i in range(4):
+            Activity.objects.create(
+                user_id=f'user{i % 2}',
+                activity_type='Running',
+                duration=30,
+                calories=100 * i,
+                date=timezone.now() - timedelta(days=i)
+            )
+        rebuild_leaderboard()
+    
+    def test_async_matches_first_sync_page(self):
+        """Test that async endpoints return the sync endpoints' first page"""
+        for sync_name, async_name, params in [
+            ('leaderboard-list', 'async-leaderboard-list', {}),
+            ('activity-list', 'async-activity-list', {'user_id': 'user1', 'page_size': 1}),
+            ('workout-list', 'async-workout-list', {}),
+        ]:
+            sync_response = self.client.get(reverse(sync_name), params)
+            async_response = self.client.get(reverse(async_name), params)
+            self.assertEqual(async_response.status_code, status.HTTP_200_OK)
+            self.assertEqual(
+                async_response.json()['results'],
+                sync_response.json()['results'],
+                async_name
+            )
+    
+    def test_async_rejects_bad_filters_and_writes(self):
+        """Test 400 on invalid filters and 405 on non-GET"""
+        response = self.client.get(reverse('async-activity-list'), {'date_from': 'soon'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(reverse('async-workout-list'), {})
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+
+class RepositoryTests(TestCase):
+    """Test cases for the hot-path repository"""
+    
+    def setUp(self):
+        self.repository = get_repository()
+        now = timezone.now()
+        for user_id, points, rank in [('alice', 300, 1), ('bob', 200, 2), ('carol', 100, 3)]:
+            Leaderboard.objects.create(user_id=user_id, total_points=points, rank=rank)
+            Activity.objects.create(
+                user_id=user_id,
+                activity_type='Running',
+                duration=30,
+                calories=points,
+                date=now - timedelta(days=rank)
+            )
+    
+    def test_orm_repository_without_djongo(self):
+        """Test that non-Mongo databases use the ORM repository"""
+        self.assertIsInstance(self.repository, OrmRepository)
+    
+    def test_leaderboard_top_projects_fields(self):
+        """Test top-N rows in rank order with only the requested fields"""
+        rows = self.repository.leaderboard_top(2, ['user_id', 'rank'])
+        self.assertEqual(rows, [
+            {'user_id': 'alice', 'rank': 1},
+            {'user_id': 'bob', 'rank': 2},
+        ])
+    
+    def test_activities_for_user(self):
+        """Test activity reads with parsed filters"""
+        filters = activity_filter_values({'user_id': 'bob'})
+        rows = self.repository.activities(filters, 10, ['user_id', 'calories'])
+        self.assertEqual(rows, [{'user_id': 'bob', 'calories': 200}])
+
+
+class LeaderboardStreamTests(TransactionTestCase):
+    """Test cases for the leaderboard Server-Sent Events stream"""
+    
+    def record_burst(self):
+        for user_id, calories in [('alice', 100), ('bob', 300), ('alice', 250)]:
+            activity = Activity.objects.create(
+                user_id=user_id,
+                activity_type='Running',
+                duration=calories // 10,
+                calories=calories,
+                date=timezone.now()
+            )
+            record_activity_created(activity)
+    
+    async def stream(self, during):
+        sent = []
+        disconnected = asyncio.Event()
+        
+        async def receive():
+            await disconnected.wait()
+            return {'type': 'http.disconnect'}
+        
+        async def send(message):
+            sent.append(message)
+        
+        scope = {'type': 'http', 'method': 'GET', 'path': STREAM_PATH}
+        task = asyncio.ensure_future(leaderboard_stream(scope, receive, send))
+        await asyncio.sleep(0.02)
+        await during()
+        await asyncio.sleep(0.3)
+        disconnected.set()
+        await task
+        return [message['body'] for message in sent if message['type'] == 'http.response.body']
+    
+    @override_settings(OCTOFIT_STREAM_INTERVAL=0.1)
+    def test_burst_is_coalesced_into_one_diff(self):
+        """Test that a burst of writes produces a single diff event"""
+        bodies = asyncio.run(self.stream(sync_to_async(self.record_burst)))
+        events = [body for body in bodies if body.startswith(b'event: leaderboard')]
+        self.assertEqual(len(events), 1)
+        changes = json.loads(events[0].split(b'data: ', 1)[1])['changes']
+        self.assertEqual(
+            {change['user_id']: (change['total_points'], change['rank']) for change in changes},
+            {'alice': (350, 1), 'bob': (300, 2)}
+        )
+    
+    @override_settings(OCTOFIT_STREAM_INTERVAL=0.1)
+    def test_no_event_without_changes(self):
+        """Test that idle ticks send nothing"""
+        async def idle():
+            pass
+        bodies = asyncio.run(self.stream(idle))
+        self.assertEqual(bodies, [b'retry: 3000\n\n'])
+
+
+class PaginationTests(APITestCase):
+    """Test cases for cursor pagination on list endpoints"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        for i in range(7):
+            Activity.objects.create(
+                user_id=f'user{i}',
+                activity_type='Running',
+                duration=30,
+                calories=100,
+                date=timezone.now() - timedelta(days=i % 3)
+            )
+    
+    def test_cursor_pages_cover_all_rows_once(self):
+        """Test that following next links visits each activity once"""
+        seen = []
+        url = reverse('activity-list') + '?page_size=3'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(response.data['results']), 3)
+            seen.extend(item['id'] for item in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(len(seen), 7)
+        self.assertEqual(len(set(seen)), 7)
+    
+    def test_ties_are_paged_by_id_without_offset(self):
+        """Test that rows sharing a date are paged with a keyset filter on (date, id)"""
+        Activity.objects.update(date=timezone.now())
+        seen = []
+        url = reverse('activity-list') + '?page_size=2'
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertFalse(any('OFFSET' in query['sql'] for query in queries.captured_queries))
+            seen.extend(item['id'] for item in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(seen, [str(pk) for pk in Activity.objects.order_by('id').values_list('id', flat=True)])
+        
+        response = self.client.get(response.data['previous'])
+        self.assertEqual([item['id'] for item in response.data['results']], seen[-3:-1])
+    
+    def test_malformed_cursor_is_404(self):
+        """Test that a cursor with bad position values is rejected, not a server error"""
+        paginator = ActivityCursorPagination()
+        paginator.base_url = 'http://testserver/api/activities/'
+        url = paginator.encode_cursor(Cursor(offset=0, reverse=False, position='["yesterday", "x"]'))
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+    
+    def test_page_size_is_capped(self):
+        """Test that page_size cannot exceed the endpoint maximum"""
+        request = APIRequestFactory().get('/api/activities/', {'page_size': 10 ** 6})
+        paginator = ActivityCursorPagination()
+        self.assertEqual(
+            paginator.get_page_size(Request(request)),
+            ActivityCursorPagination.max_page_size
+        )
+
+
+class RecomputeRanksTests(TestCase):
+    """Test cases for rank recomputation"""
+    
+    def setUp(self):
+        # Bob and Dave have stale ranks
+        for user_id, points, rank in [
+            ('alice', 500, 1), ('bob', 300, 4), ('carol', 300, 2), ('dave', 100, 2)
+        ]:
+            Leaderboard.objects.create(user_id=user_id, total_points=points, rank=rank)
+        self.leader_updated_at = Leaderboard.objects.get(user_id='alice').updated_at
+    
+    def ranks(self):
+        return dict(Leaderboard.objects.values_list('user_id', 'rank'))
+    
+    def test_competition_ranking_writes_only_changes(self):
+        """Test competition ranks and that unchanged rows are not rewritten"""
+        self.assertEqual(recompute_ranks(batch_size=1), (4, 2))
+        self.assertEqual(self.ranks(), {'alice': 1, 'bob': 2, 'carol': 2, 'dave': 4})
+        self.assertEqual(Leaderboard.objects.get(user_id='alice').updated_at, self.leader_updated_at)
+        self.assertGreater(Leaderboard.objects.get(user_id='bob').updated_at, self.leader_updated_at)
+        self.assertEqual(recompute_ranks(), (4, 0))
+    
+    def test_dense_ranks_are_computed_when_read(self):
+        """Test that ?ranking=dense does not skip ranks after ties, without storing them"""
+        recompute_ranks()
+        url = reverse('leaderboard-list')
+        response = self.client.get(url, {'ranking': 'dense'})
+        self.assertEqual(
+            [(row['user_id'], row['rank']) for row in response.json()['results']],
+            [('alice', 1), ('bob', 2), ('carol', 2), ('dave', 3)]
+        )
+        response = self.client.get(url, {'ranking': 'dense', 'around': 'dave', 'radius': 1})
+        self.assertEqual(
+            [(row['user_id'], row['rank']) for row in response.json()['results']],
+            [('carol', 2), ('dave', 3)]
+        )
+        self.assertEqual(self.ranks(), {'alice': 1, 'bob': 2, 'carol': 2, 'dave': 4})
+        self.assertEqual(self.client.get(url, {'ranking': 'olympic'}).status_code, 400)
+    
+    def test_command_ranks_users_and_teams(self):
+        """Test the recompute_ranks management command"""
+        TeamLeaderboard.objects.create(team_id='1', total_points=10, rank=2)
+        out = StringIO()
+        call_command('recompute_ranks', stdout=out)
+        self.assertIn('Ranked 4 users: 2 ranks changed', out.getvalue())
+        self.assertIn('Ranked 1 teams: 1 ranks changed', out.getvalue())
+        self.assertEqual(TeamLeaderboard.objects.get(team_id='1').rank, 1)
+
+
+class BenchmarkSummaryTests(TestCase):
+    """Test cases for benchmark summaries and baseline comparison"""
+    
+    def test_summary_percentiles_and_round_trips(self):
+        """Test latency percentiles and per-request counts"""
+        samples = [(index / 1000, 2, 0, 200) for index in range(1, 101)]
+        samples[-1] = (0.1, 4, 0, 500)
+        summary = benchmarks.summarize(samples, elapsed=2.0)
+        self.assertEqual(summary['requests'], 100)
+        self.assertEqual(summary['errors'], 1)
+        self.assertEqual(summary['throughput'], 50.0)
+        self.assertEqual(summary['p50_ms'], 50.5)
+        self.assertEqual(summary['p99_ms'], 99.01)
+        self.assertEqual(summary['queries_per_request'], 2.02)
+    
+    def test_compare_flags_regressions(self):
+        """Test that slower latency beyond tolerance and extra queries fail"""
+        baseline = {'list': {'p95_ms': 10.0, 'p99_ms': 20.0, 'queries_per_request': 1.0, 'errors': 0}}
+        within = {'list': {'p95_ms': 12.0, 'p99_ms': 20.0, 'queries_per_request': 1.0, 'errors': 0}}
+        self.assertEqual(benchmarks.compare(within, baseline, tolerance=0.25), [])
+        worse = {'list': {'p95_ms': 13.0, 'p99_ms': 20.0, 'queries_per_request': 2.0, 'errors': 0}}
+        self.assertEqual(
+            benchmarks.compare(worse, baseline, tolerance=0.25),
+            ['list p95_ms: 13.0 > 10.0 (+25%)', 'list queries_per_request: 2.0 > 1.0']
+        )
+    
+    def test_baseline_with_errors_is_not_saved(self):
+        """Test that --save-baseline refuses results with failed requests"""
+        command = 'octofit_tracker.management.commands.benchmark_api'
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'baseline.json')
+        with mock.patch.multiple(command, setup_databases=mock.DEFAULT, teardown_databases=mock.DEFAULT):
+            with mock.patch.multiple(
+                f'{command}.Command',
+                seed=mock.DEFAULT,
+                run_scenarios=mock.Mock(return_value={'list': {'errors': 2}})
+            ):
+                with self.assertRaisesMessage(CommandError, 'failed requests in: list'):
+                    call_command('benchmark_api', save_baseline=True, baseline=path, stdout=StringIO())
+        self.assertFalse(os.path.exists(path))
+
+
+# Database round trips each endpoint may make per request, by route name and
+# method, whatever the amount of data or the page size. Every named route in
+# urls.py needs an entry; QueryBudgetTests runs each endpoint at several
+# dataset sizes and fails when a request goes over its budget or when its
+# query count changes with the size of the data.
+QUERY_BUDGETS = {
+    'api-root': {'GET': 0},
+    'health': {'GET': 1},
+    'metrics': {'GET': 0},
+    'user-list': {'GET': 2, 'POST': 9},
+    'user-detail': {'GET': 2},
+    'user-stats': {'GET': 3},
+    'team-list': {'GET': 1},
+    'team-detail': {'GET': 1},
+    'activity-list': {'GET': 3, 'POST': 22},
+    'activity-detail': {'GET': 3, 'PATCH': 19, 'DELETE': 19},
+    'activity-stats': {'GET': 2},
+    'activity-export': {'GET': 1},
+    'activity-bulk': {'POST': 24},
+    'leaderboard-list': {'GET': 3},
+    'leaderboard-detail': {'GET': 3},
+    'team-leaderboard-list': {'GET': 1},
+    'team-leaderboard-detail': {'GET': 1},
+    'workout-list': {'GET': 1},
+    'workout-detail': {'GET': 1},
+    'async-leaderboard-list': {'GET': 1},
+    'async-activity-list': {'GET': 1},
+    'async-workout-list': {'GET': 1},
+}
+
+
+def activity_data(user_id, duration=45):
+    return {
+        'user_id': user_id,
+        'activity_type': 'Running',
+        'duration': duration,
+        'distance': 5.0,
+        'calories': duration * 10,
+        'date': '2026-10-13T08:00:00Z'
+    }
+
+
+# (route, method, url args, request data); callables are given the BudgetSeed.
+# GET requests with data ask for a page as large as the dataset, and the bulk
+# POST sends one item per seeded user.
+BUDGET_CASES = [
+    ('api-root', 'GET', None, None),
+    ('health', 'GET', None, None),
+    ('metrics', 'GET', None, None),
+    ('user-list', 'GET', None, {}),
+    ('user-list', 'GET', None, {'expand': 'team'}),
+    ('user-list', 'POST', None, lambda seed: {
+        'email': f'new{seed.size}@example.com', 'name': 'New User', 'team_id': seed.team_id
+    }),
+    ('user-detail', 'GET', lambda seed: [seed.user_id], {'expand': 'team'}),
+    ('user-stats', 'GET', lambda seed: [seed.user_id], {'group_by': 'activity_type,week'}),
+    ('team-list', 'GET', None, {}),
+    ('team-detail', 'GET', lambda seed: [seed.team_id], None),
+    ('activity-list', 'GET', None, {}),
+    ('activity-list', 'GET', None, {'expand': 'user,team'}),
+    ('activity-list', 'GET', None, lambda seed: {'user_id': seed.user_id, 'date_from': '2026-01-01'}),
+    ('activity-list', 'POST', None, lambda seed: activity_data(seed.user_id)),
+    ('activity-detail', 'GET', lambda seed: [seed.activity_id], {'expand': 'user,team'}),
+    ('activity-detail', 'PATCH', lambda seed: [seed.activity_id], {'calories': 500}),
+    ('activity-detail', 'DELETE', lambda seed: [seed.activity_id], None),
+    ('activity-stats', 'GET', None, {'group_by': 'activity_type,day'}),
+    ('activity-export', 'GET', None, {'output': 'csv'}),
+    ('activity-bulk', 'POST', None, lambda seed: [
+        activity_data(user_id) for user_id in seed.user_ids
+    ]),
+    ('leaderboard-list', 'GET', None, {}),
+    ('leaderboard-list', 'GET', None, {'expand': 'user,team'}),
+    ('leaderboard-list', 'GET', None, {'window': 'week', 'at': '2026-10-12'}),
+    ('leaderboard-list', 'GET', None, lambda seed: {'top': seed.size}),
+    ('leaderboard-list', 'GET', None, lambda seed: {'around': seed.user_id, 'radius': seed.size}),
+    ('leaderboard-detail', 'GET', lambda seed: [seed.leaderboard_id], {'expand': 'user,team'}),
+    ('team-leaderboard-list', 'GET', None, {}),
+    ('team-leaderboard-detail', 'GET', lambda seed: [seed.team_leaderboard_id], None),
+    ('workout-list', 'GET', None, {}),
+    ('workout-detail', 'GET', lambda seed: [seed.workout_id], None),
+    ('async-leaderboard-list', 'GET', None, {}),
+    ('async-activity-list', 'GET', None, lambda seed: {'user_id': seed.user_id}),
+    ('async-workout-list', 'GET', None, {}),
+]
+
+
+class BudgetSeed:
+    """A dataset of ``size`` users, each with activities, and ``size`` workouts"""
+    
+    def __init__(self, size):
+        self.size = size
+        teams = [Team.objects.create(name=f'Budget Team {size}-{index}') for index in range(2)]
+        users = [
+            User.objects.create(
+                email=f'budget{size}-{index}@example.com',
+                name=f'Budget User {index}',
+                team_id=str(teams[index % 2].id)
+            )
+            for index in range(size)
+        ]
+        for user in users:
+            for day in (5, 12):
+                Activity.objects.create(
+                    user_id=str(user.id),
+                    activity_type='Running',
+                    duration=30,
+                    distance=5.0,
+                    calories=100 + user.id,
+                    date=timezone.make_aware(datetime(2026, 10, day, 8, 0))
+                )
+        for index in range(size):
+            Workout.objects.create(
+                name=f'Budget Workout {size}-{index}',
+                description='Budget',
+                difficulty_level='Beginner',
+                duration=30,
+                category='Cardio'
+            )
+        rebuild_leaderboard()
+        self.team_id = teams[0].id
+        self.user_ids = [str(user.id) for user in users]
+        self.user_id = self.user_ids[size // 2]
+        self.activity_id = Activity.objects.filter(user_id=self.user_id).first().id
+        self.leaderboard_id = Leaderboard.objects.get(user_id=self.user_id).id
+        self.team_leaderboard_id = TeamLeaderboard.objects.first().id
+        self.workout_id = Workout.objects.first().id
+
+
+@override_settings(OCTOFIT_API_CACHE_ENABLED=False)
+class QueryBudgetTests(APITestCase):
+    """Test that each endpoint stays within its query budget at any data size"""
+    
+    SIZES = (3, 10, 30)
+    
+    def count_queries(self, seed, route, method, args, data):
+        args = args(seed) if callable(args) else args
+        data = data(seed) if callable(data) else data
+        url = reverse(route, args=args)
+        with CaptureQueriesContext(connection) as queries:
+            if method == 'GET':
+                if data is not None:
+                    data = {'page_size': seed.size, **data}
+                response = self.client.get(url, data)
+            else:
+                response = getattr(self.client, method.lower())(url, data, format='json')
+            if response.streaming:
+                b''.join(response.streaming_content)
+        # /metrics answers 404 unless profiling is on, without touching the database
+        if route != 'metrics':
+            self.assertLess(response.status_code, 300, (route, data))
+        return len(queries)
+    
+    def test_every_route_has_a_budget(self):
+        """Test that endpoints cannot be added without a query budget"""
+        names = {
+            pattern.name
+            for pattern in list(router.urls) + list(urlpatterns)
+            if getattr(pattern, 'name', None)
+        }
+        self.assertEqual(names, set(QUERY_BUDGETS))
+        self.assertEqual(
+            {(route, method) for route, method, _, _ in BUDGET_CASES},
+            {(route, method) for route, methods in QUERY_BUDGETS.items() for method in methods}
+        )
+    
+    def test_budgets_hold_at_every_size(self):
+        """Test query counts against the budgets, and that they do not grow with the data"""
+        counts = [[] for _ in BUDGET_CASES]
+        for size in self.SIZES:
+            seed = BudgetSeed(size)
+            for index, case in enumerate(BUDGET_CASES):
+                counts[index].append(self.count_queries(seed, *case))
+        for (route, method, _, data), case_counts in zip(BUDGET_CASES, counts):
+            with self.subTest(route=route, method=method, data=data):
+                budget = QUERY_BUDGETS[route][method]
+                self.assertLessEqual(max(case_counts), budget)
+                self.assertEqual(len(set(case_counts)), 1, f'query count grows with the data: {case_counts}')
+
+
+class PopulateDbCommandTests(TestCase):
+    """Test cases for the populate_db data generator"""
+    
+    def populate(self, **options):
+        call_command(
+            'populate_db', seed=42, end_date='2026-10-01', batch_size=7,
+            stdout=StringIO(), **options
+        )
+        return list(
+            Activity.objects.order_by('id').values_list(
+                'activity_type', 'duration', 'distance', 'calories', 'date'
+            )
+        )
+    
+    def test_generates_requested_volume(self):
+        """Test that --users and --activities-per-user control row counts"""
+        self.populate(users=20, activities_per_user=3)
+        self.assertEqual(User.objects.count(), 20)
+        self.assertEqual(Activity.objects.count(), 60)
+        self.assertEqual(Leaderboard.objects.count(), 20)
+        self.assertEqual(find_mismatches(), [])
+    
+    def test_same_seed_is_reproducible(self):
+        """Test that the same seed generates the same activities"""
+        first = self.populate(users=5, activities_per_user=4)
+        second = self.populate(users=5, activities_per_user=4)
+        self.assertEqual(first, second)
+
+
+@override_settings(OCTOFIT_READ_REPLICA='replica')
+class ReadReplicaRoutingTests(TestCase):
+    """Test cases for read replica routing"""
+    
+    def setUp(self):
+        self.factory = RequestFactory()
+        
+        def view(request):
+            return HttpResponse(ReadReplicaRouter().db_for_read(Leaderboard))
+        view.replica_max_staleness = 30
+        self.view = view
+    
+    def route(self, request, view=None):
+        view = view or self.view
+        middleware = ReadReplicaMiddleware(
+            lambda request: middleware.process_view(request, view, (), {}) or view(request)
+        )
+        return middleware(request)
+    
+    def test_safe_reads_use_the_replica(self):
+        """Test that GETs to opted-in views read from the replica"""
+        response = self.route(self.factory.get('/api/leaderboard/'))
+        self.assertEqual(response.content, b'replica')
+        self.assertEqual(ReadReplicaRouter().db_for_read(Leaderboard), 'default')
+    
+    def test_views_without_a_bound_use_the_primary(self):
+        """Test that views must opt in to replica reads"""
+        def view(request):
+            return HttpResponse(ReadReplicaRouter().db_for_read(Leaderboard))
+        response = self.route(self.factory.get('/api/health/'), view)
+        self.assertEqual(response.content, b'default')
+    
+    def test_writes_pin_the_client_to_the_primary(self):
+        """Test read-your-writes after a successful write"""
+        response = self.route(self.factory.post('/api/leaderboard/'))
+        self.assertEqual(response.content, b'default')
+        request = self.factory.get('/api/leaderboard/')
+        request.COOKIES[LAST_WRITE_COOKIE] = response.cookies[LAST_WRITE_COOKIE].value
+        self.assertEqual(self.route(request).content, b'default')
+    
+    def test_pin_lasts_for_the_views_bound(self):
+        """Test that a write pins reads until it is older than the view's staleness bound"""
+        for age, expected in ((20, b'default'), (40, b'replica')):
+            request = self.factory.get('/api/leaderboard/')
+            request.COOKIES[LAST_WRITE_COOKIE] = str(time.time() - age)
+            self.assertEqual(self.route(request).content, expected)
+    
+    def test_lag_beyond_bound_uses_the_primary(self):
+        """Test that replication lag above the view's bound falls back"""
+        with mock.patch('octofit_tracker.routers.replica_lag', return_value=60.0):
+            response = self.route(self.factory.get('/api/leaderboard/'))
+        self.assertEqual(response.content, b'default')
+    
+    async def test_async_stack_uses_the_replica(self):
+        """Test that an async view is routed when process_view runs in another thread"""
+        async def view(request):
+            return HttpResponse(ReadReplicaRouter().db_for_read(Leaderboard))
+        view.replica_max_staleness = 30
+        
+        async def get_response(request):
+            # As Django's async handler runs a sync-only process_view
+            await sync_to_async(middleware.process_view)(request, view, (), {})
+            return await view(request)
+        middleware = ReadReplicaMiddleware(get_response)
+        response = await middleware(self.factory.get('/api/leaderboard/'))
+        self.assertEqual(response.content, b'replica')
+        self.assertEqual(ReadReplicaRouter().db_for_read(Leaderboard), 'default')
+    
+    async def test_asgi_requests_to_opted_in_endpoints(self):
+        """Test that opted-in sync and async endpoints answer under ASGI"""
+        with override_settings(OCTOFIT_READ_REPLICA=None):
+            for name in ('leaderboard-list', 'team-list', 'async-leaderboard-list', 'async-workout-list'):
+                response = await self.async_client.get(reverse(name))
+                self.assertEqual(response.status_code, status.HTTP_200_OK, name)
+
+
+@override_settings(
+    OCTOFIT_PROFILING=True,
+    OCTOFIT_API_CACHE_ENABLED=False,
+    MIDDLEWARE=['octofit_tracker.middleware.ProfilingMiddleware'] + settings.MIDDLEWARE
+)
+class ProfilingMiddlewareTests(APITestCase):
+    """Test cases for request profiling"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        profiling.metrics.reset()
+        for index in range(3):
+            Activity.objects.create(
+                user_id=f'user-{index}',
+                activity_type='Running',
+                duration=30,
+                calories=100,
+                date=timezone.now()
+            )
+    
+    def test_server_timing_and_metrics(self):
+        """Test the Server-Timing header and the /metrics counters"""
+        with self.assertLogs('octofit_tracker.profiling', 'INFO') as logs:
+            response = self.client.get(reverse('activity-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        timing = response['Server-Timing']
+        self.assertIn('db;dur=', timing)
+        self.assertIn('serialize;dur=', timing)
+        self.assertIn('render;dur=', timing)
+        self.assertIn('total;dur=', timing)
+        
+        entry = json.loads(logs.records[0].getMessage())
+        self.assertEqual(entry['view'], 'activity-list')
+        self.assertEqual(entry['queries'], 1)
+        self.assertEqual(entry['bytes'], len(response.content))
+        
+        body = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn('octofit_requests_total{view="activity-list",method="GET",status="200"} 1', body)
+        self.assertIn('octofit_section_calls_total{view="activity-list",section="db"} 1', body)
+        self.assertIn('octofit_request_duration_seconds_count{view="activity-list"} 1', body)
+    
+    def test_repeated_queries_are_flagged(self):
+        """Test that an N+1 pattern is logged as a warning"""
+        def view(request):
+            for activity in Activity.objects.all():
+                list(Activity.objects.filter(user_id=activity.user_id))
+            return HttpResponse('ok')
+        
+        with override_settings(OCTOFIT_PROFILING_REPEAT_THRESHOLD=3):
+            with self.assertLogs('octofit_tracker.profiling', 'WARNING') as logs:
+                ProfilingMiddleware(view)(RequestFactory().get('/n-plus-one/'))
+        entry = json.loads(logs.records[0].getMessage())
+        self.assertEqual(entry['queries'], 4)
+        self.assertEqual(entry['repeated_queries'][0]['count'], 3)
+    
+    def test_metrics_disabled_without_profiling(self):
+        """Test that /metrics is a 404 unless profiling is on"""
+        with override_settings(OCTOFIT_PROFILING=False):
+            response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class HealthCheckTests(APITestCase):
+    """Test cases for the health endpoint"""
+    
+    def setUp(self):
+        self.client = APIClient()
+    
+    def test_healthy_database(self):
+        """Test that a reachable database reports ok with its round trip time"""
+        response = self.client.get(reverse('health'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['status'], 'ok')
+        self.assertIn('ping_ms', response.data['database'])
+        # Pool statistics are only collected on MongoDB
+        self.assertIsNone(response.data['database']['pools'])
+    
+    def test_unreachable_database(self):
+        """Test that a failed ping is a 503"""
+        with mock.patch('octofit_tracker.health.ping', side_effect=DatabaseError('down')):
+            response = self.client.get(reverse('health'))
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response.data['database']['error'], 'down')
+
+
 class APIRootTests(APITestCase):
     """Test cases for API root endpoint"""
     
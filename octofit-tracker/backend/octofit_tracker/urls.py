@@ -16,12 +16,16 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
+from . import async_views
 from .views import (
     api_root,
+    health_check,
+    metrics,
     UserViewSet,
     TeamViewSet,
     ActivityViewSet,
     LeaderboardViewSet,
+    TeamLeaderboardViewSet,
     WorkoutViewSet
 )
 import os
@@ -38,6 +42,8 @@ router = DefaultRouter()
 router.register(r'users', UserViewSet, basename='user')
 router.register(r'teams', TeamViewSet, basename='team')
 router.register(r'activities', ActivityViewSet, basename='activity')
+# Registered before 'leaderboard' so 'teams' is not taken for a leaderboard id
+router.register(r'leaderboard/teams', TeamLeaderboardViewSet, basename='team-leaderboard')
 router.register(r'leaderboard', LeaderboardViewSet, basename='leaderboard')
 router.register(r'workouts', WorkoutViewSet, basename='workout')
 
@@ -45,5 +51,10 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('', api_root, name='api-root'),
     path('api/', api_root, name='api-root'),
+    path('api/health/', health_check, name='health'),
+    path('metrics', metrics, name='metrics'),
+    path('api/async/leaderboard/', async_views.leaderboard_list, name='async-leaderboard-list'),
+    path('api/async/activities/', async_views.activity_list, name='async-activity-list'),
+    path('api/async/workouts/', async_views.workout_list, name='async-workout-list'),
     path('api/', include(router.urls)),
 ]
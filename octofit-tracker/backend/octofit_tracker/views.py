@@ -1,13 +1,38 @@
+import copy
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.utils import timezone
 from rest_framework import viewsets, status
-from rest_framework.decorators import api_view
+from rest_framework.decorators import action, api_view
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.parsers import JSONParser
 from rest_framework.response import Response
 from rest_framework.reverse import reverse
-from .models import User, Team, Activity, Leaderboard, Workout
+from . import analytics, export, health, leaderboard, profiling, stats, writebehind
+from .caching import CachedResponseMixin
+from .expand import load_expansions, parse_expand
+from .fastpath import FastListMixin
+from .filters import activity_filter_values, filter_activities, parse_date_param
+from .models import User, Team, Activity, Leaderboard, TeamLeaderboard, Workout
+from .pagination import (
+    UserCursorPagination,
+    TeamCursorPagination,
+    ActivityCursorPagination,
+    LeaderboardCursorPagination,
+    LeaderboardWindowCursorPagination,
+    TeamLeaderboardCursorPagination,
+    WorkoutCursorPagination
+)
+from .parsers import NDJSONParser
 from .serializers import (
     UserSerializer, 
     TeamSerializer, 
     ActivitySerializer, 
     LeaderboardSerializer, 
+    LeaderboardWindowSerializer,
+    TeamLeaderboardSerializer,
     WorkoutSerializer
 )
 
@@ -22,45 +47,406 @@ def api_root(request, format=None):
         'teams': reverse('team-list', request=request, format=format),
         'activities': reverse('activity-list', request=request, format=format),
         'leaderboard': reverse('leaderboard-list', request=request, format=format),
+        'team_leaderboard': reverse('team-leaderboard-list', request=request, format=format),
         'workouts': reverse('workout-list', request=request, format=format),
     })
 
 
-class UserViewSet(viewsets.ModelViewSet):
+@api_view(['GET'])
+def health_check(request, format=None):
+    """
+    Database reachability and connection pool usage for this process
+    """
+    healthy, database = health.database_health()
+    return Response(
+        {'status': 'ok' if healthy else 'unavailable', 'database': database},
+        status=status.HTTP_200_OK if healthy else status.HTTP_503_SERVICE_UNAVAILABLE
+    )
+
+
+def metrics(request):
+    """
+    Per-view request metrics for this process in the Prometheus text format
+    """
+    if not settings.OCTOFIT_PROFILING:
+        raise Http404('Profiling is disabled.')
+    return HttpResponse(profiling.metrics.render(), content_type='text/plain; version=0.0.4')
+
+
+class ExpandMixin:
+    """
+    Supports ``?expand=`` on read responses.
+
+    The referenced users/teams for the serialized page (or single object)
+    are fetched up front with one batched lookup per relation and handed to
+    the serializer through its context.
+    """
+    expandable = ()
+
+    def get_serializer(self, *args, **kwargs):
+        instance = args[0] if args else kwargs.get('instance')
+        if instance is not None and self.request.method == 'GET' and self.expandable:
+            expand = parse_expand(self.request, self.expandable)
+            if expand:
+                objects = instance if isinstance(instance, (list, tuple)) else [instance]
+                kwargs.setdefault('context', self.get_serializer_context())
+                kwargs['context']['expansions'] = load_expansions(objects, expand)
+        return super().get_serializer(*args, **kwargs)
+
+
+class UserViewSet(FastListMixin, ExpandMixin, viewsets.ModelViewSet):
     """
     ViewSet for viewing and editing User instances
     """
     queryset = User.objects.all()
     serializer_class = UserSerializer
+    pagination_class = UserCursorPagination
+    replica_max_staleness = 10
+    expandable = ('team',)
+
+    def perform_create(self, serializer):
+        user = serializer.save()
+        leaderboard.record_membership_change(str(user.id), None, user.team_id)
+
+    def perform_update(self, serializer):
+        old_team_id = serializer.instance.team_id
+        user = serializer.save()
+        leaderboard.record_membership_change(str(user.id), old_team_id, user.team_id)
+
+    def perform_destroy(self, instance):
+        leaderboard.record_membership_change(str(instance.id), instance.team_id, None)
+        instance.delete()
+
+    @action(detail=True, methods=['get'])
+    def stats(self, request, pk=None):
+        """
+        Activity statistics for one user, grouped by ``?group_by=``.
+
+        ``activity_type``, ``date_from`` and ``date_to`` narrow the activities.
+        """
+        user = self.get_object()
+        params = request.query_params.copy()
+        params.pop('user_id', None)
+        group_by = stats.parse_group_by(params.get('group_by'))
+        if settings.OCTOFIT_ANALYTICS_CACHE:
+            filters = {**activity_filter_values(params), 'user_id': str(user.id)}
+            return Response(analytics.activity_stats(filters, group_by))
+        queryset = filter_activities(Activity.objects.filter(user_id=str(user.id)), params)
+        return Response(stats.activity_stats(queryset, group_by))
 
 
-class TeamViewSet(viewsets.ModelViewSet):
+class TeamViewSet(CachedResponseMixin, FastListMixin, viewsets.ModelViewSet):
     """
     ViewSet for viewing and editing Team instances
     """
     queryset = Team.objects.all()
     serializer_class = TeamSerializer
+    pagination_class = TeamCursorPagination
+    replica_max_staleness = 60
+    cache_resource = 'teams'
 
+    def perform_destroy(self, instance):
+        leaderboard.record_team_deleted(str(instance.id))
+        instance.delete()
 
-class ActivityViewSet(viewsets.ModelViewSet):
+
+class ActivityViewSet(FastListMixin, ExpandMixin, viewsets.ModelViewSet):
     """
     ViewSet for viewing and editing Activity instances
+
+    The list can be narrowed with ``user_id``, ``activity_type``,
+    ``date_from`` and ``date_to`` query parameters.
     """
     queryset = Activity.objects.all()
     serializer_class = ActivitySerializer
+    pagination_class = ActivityCursorPagination
+    replica_max_staleness = 10
+    expandable = ('user', 'team')
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action in ('list', 'export', 'stats'):
+            queryset = filter_activities(queryset, self.request.query_params)
+        return queryset
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.action == 'create':
+            context['idempotency_key'] = self.request.headers.get('Idempotency-Key')
+        return context
+
+    def create(self, request, *args, **kwargs):
+        """
+        Create an activity, or return the stored one with 200 when this is a
+        retry: the same client idempotency key, or the same user, type, date
+        and duration. With write-behind on, the activity is queued and the
+        response is 202; retries are dropped when the queue is flushed.
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        if settings.OCTOFIT_WRITE_BEHIND:
+            return self.enqueue([serializer.validated_data], serializer.data)
+        key = serializer.validated_data['idempotency_key']
+        existing = Activity.objects.filter(idempotency_key=key).first()
+        if existing is None:
+            try:
+                with transaction.atomic():
+                    self.perform_create(serializer)
+            except IntegrityError:
+                # A concurrent retry won the race for the key
+                existing = Activity.objects.filter(idempotency_key=key).first()
+                if existing is None:
+                    raise
+        if existing is not None:
+            return Response(self.get_serializer(existing).data, status=status.HTTP_200_OK)
+        headers = self.get_success_headers(serializer.data)
+        return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
+
+    def perform_create(self, serializer):
+        activity = serializer.save()
+        leaderboard.record_activity_created(activity)
+
+    def enqueue(self, items, data):
+        """
+        Queue validated activities for write-behind storage and answer 202
+        with ``data``, or 503 when the queue is full.
+        """
+        try:
+            writebehind.enqueue(items)
+        except writebehind.QueueFull:
+            return Response(
+                {'detail': 'Too many activities waiting to be stored. Try again later.'},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={'Retry-After': str(settings.OCTOFIT_WRITE_BEHIND_RETRY_AFTER)}
+            )
+        return Response(data, status=status.HTTP_202_ACCEPTED)
 
+    def perform_update(self, serializer):
+        old_activity = copy.copy(serializer.instance)
+        activity = serializer.save()
+        leaderboard.record_activity_updated(old_activity, activity)
 
-class LeaderboardViewSet(viewsets.ModelViewSet):
+    def perform_destroy(self, instance):
+        leaderboard.record_activity_deleted(instance)
+        instance.delete()
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """
+        Stream every matching activity as NDJSON (default) or CSV.
+
+        ``?output=csv`` selects CSV and ``?compress=gzip`` gzips the stream.
+        ``after_date`` and ``after_id`` resume after the last row received;
+        the usual activity filters apply as well.
+        """
+        params = request.query_params
+        output = params.get('output', 'ndjson')
+        if output not in export.EXPORT_FORMATS:
+            raise ValidationError({'output': f'Choose from: {", ".join(export.EXPORT_FORMATS)}.'})
+
+        after_date = params.get('after_date')
+        after_id = params.get('after_id')
+        if after_id and not after_id.isdigit():
+            raise ValidationError({'after_id': 'Must be an activity id.'})
+        queryset = export.after_watermark(
+            self.get_queryset(),
+            parse_date_param('after_date', after_date) if after_date else None,
+            int(after_id) if after_id else None,
+        )
+        chunks = export.batch_text(export.encode_lines(
+            export.iter_activities(queryset, settings.OCTOFIT_EXPORT_CHUNK_SIZE), output
+        ))
+
+        filename = f'activities.{output}'
+        if params.get('compress') == 'gzip':
+            chunks = export.gzip_chunks(chunks)
+            filename += '.gz'
+            content_type = 'application/gzip'
+        else:
+            content_type = export.EXPORT_FORMATS[output]
+
+        response = StreamingHttpResponse(chunks, content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+    @action(detail=False, methods=['get'])
+    def stats(self, request):
+        """
+        Statistics over the matching activities, grouped by ``?group_by=``
+        (``activity_type`` and/or one of ``day``, ``week``, ``month``).
+        Served from the columnar cache when OCTOFIT_ANALYTICS_CACHE is on.
+        """
+        group_by = stats.parse_group_by(request.query_params.get('group_by'))
+        if settings.OCTOFIT_ANALYTICS_CACHE:
+            filters = activity_filter_values(request.query_params)
+            return Response(analytics.activity_stats(filters, group_by))
+        return Response(stats.activity_stats(self.get_queryset(), group_by))
+
+    @action(detail=False, methods=['post'], parser_classes=[JSONParser, NDJSONParser])
+    def bulk(self, request):
+        """
+        Create many activities at once from a JSON array or NDJSON body.
+
+        Valid items are inserted in chunks with bulk_create and the leaderboard
+        is updated once for the whole batch. Invalid items are skipped and
+        reported by their position in the request. Items that repeat a stored
+        activity (or an earlier item) by idempotency key are not inserted
+        again; the activity holding the key is returned for each of them.
+        With write-behind on, valid items are queued instead and the response
+        is 202 with the number queued.
+        """
+        items = request.data
+        if not isinstance(items, list):
+            return Response(
+                {'detail': 'Expected a JSON array or NDJSON body of activities.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(items) > settings.OCTOFIT_BULK_MAX_ITEMS:
+            return Response(
+                {'detail': f'At most {settings.OCTOFIT_BULK_MAX_ITEMS} activities per request.'},
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+            )
+
+        serializer = self.get_serializer(data=items, many=True)
+        valid, errors = serializer.validate_items()
+
+        if settings.OCTOFIT_WRITE_BEHIND and valid:
+            return self.enqueue(
+                [attrs for _, attrs in valid],
+                {'queued': len(valid), 'failed': len(errors), 'errors': errors}
+            )
+
+        created, duplicates = [], []
+        if valid:
+            with transaction.atomic():
+                created, duplicates = serializer.ingest([attrs for _, attrs in valid])
+                leaderboard.record_activities_created(created)
+
+        if errors:
+            accepted = created or duplicates
+            response_status = status.HTTP_207_MULTI_STATUS if accepted else status.HTTP_400_BAD_REQUEST
+        elif created:
+            response_status = status.HTTP_201_CREATED
+        else:
+            response_status = status.HTTP_200_OK
+        return Response(
+            {
+                'created': len(created),
+                'duplicates': len(duplicates),
+                'failed': len(errors),
+                'errors': errors,
+                'existing': [
+                    {'index': valid[position][0], 'activity': ActivitySerializer(activity).data}
+                    for position, activity in duplicates
+                ],
+            },
+            status=response_status
+        )
+
+
+class LeaderboardViewSet(CachedResponseMixin, FastListMixin, ExpandMixin, viewsets.ModelViewSet):
     """
     ViewSet for viewing and editing Leaderboard instances
+
+    ``?window=day|week|month`` ranks users by their points in the period
+    containing ``?at=YYYY-MM-DD`` (default today), read from rollup buckets.
+    ``?top=N`` returns the first N rows and ``?around=<user_id>&radius=K``
+    the K rows either side of a user, both without pagination. Ties share
+    competition ranks ("1224"); ``?ranking=dense`` ranks them densely
+    ("1223") instead.
     """
     queryset = Leaderboard.objects.all()
     serializer_class = LeaderboardSerializer
+    pagination_class = LeaderboardCursorPagination
+    replica_max_staleness = 30
+    expandable = ('user', 'team')
+    cache_resource = 'leaderboard'
+
+    def list(self, request, *args, **kwargs):
+        params = request.query_params
+        if params.get('ranking', 'competition') not in leaderboard.RANKING_METHODS:
+            raise ValidationError({
+                'ranking': f'Choose from: {", ".join(leaderboard.RANKING_METHODS)}.'
+            })
+        if 'top' in params or 'around' in params:
+            if 'window' in params:
+                raise ValidationError({'window': 'Cannot be combined with top or around.'})
+            return self.cached_response(self.list_slice, request)
+        if 'window' in params:
+            return self.cached_response(self.list_window, request)
+        return super().list(request, *args, **kwargs)
+
+    def _positive_int(self, name, default=None):
+        value = self.request.query_params.get(name)
+        if value is None and default is not None:
+            return default
+        if value is None or not value.isdigit() or int(value) < 1:
+            raise ValidationError({name: 'Must be a positive integer.'})
+        return min(int(value), self.paginator.max_page_size)
+
+    def list_slice(self, request):
+        if 'around' in request.query_params:
+            radius = self._positive_int('radius', default=5)
+            rows = leaderboard.entries_around(request.query_params['around'], radius)
+            if rows is None:
+                raise NotFound('No leaderboard entry for that user.')
+        else:
+            rows = leaderboard.top_entries(self._positive_int('top'))
+        serializer = self.get_serializer(rows, many=True)
+        return Response({'results': self.ranked(Leaderboard.objects.all(), serializer.data)})
+
+    def list_window(self, request):
+        period = request.query_params['window']
+        if period not in leaderboard.BUCKET_PERIODS:
+            raise ValidationError({
+                'window': f'Choose from: {", ".join(leaderboard.BUCKET_PERIODS)}.'
+            })
+        at = request.query_params.get('at')
+        at = parse_date_param('at', at) if at else timezone.now()
+
+        queryset = leaderboard.window_queryset(period, at)
+        paginator = LeaderboardWindowCursorPagination()
+        page = leaderboard.rank_window_page(
+            queryset, paginator.paginate_queryset(queryset, request, view=self)
+        )
+        serializer = self.get_serializer(page, many=True)
+        return paginator.get_paginated_response(self.ranked(queryset, serializer.data))
+
+    def ranked(self, queryset, rows):
+        """Serialized ``rows`` with the ranks asked for by ``?ranking=``"""
+        if self.request.query_params.get('ranking') == 'dense':
+            return leaderboard.apply_dense_ranks(queryset, rows)
+        return rows
+
+    def get_paginated_response(self, data):
+        return super().get_paginated_response(self.ranked(Leaderboard.objects.all(), data))
+
+    def get_serializer_class(self):
+        if self.action == 'list' and 'window' in self.request.query_params:
+            return LeaderboardWindowSerializer
+        return super().get_serializer_class()
+
+
+class TeamLeaderboardViewSet(CachedResponseMixin, FastListMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    ViewSet for viewing team standings
+
+    Rows are maintained incrementally as activities and team memberships
+    change, so listing them is a single scan of the rank index.
+    """
+    queryset = TeamLeaderboard.objects.all()
+    serializer_class = TeamLeaderboardSerializer
+    pagination_class = TeamLeaderboardCursorPagination
+    replica_max_staleness = 30
+    cache_resource = 'team-leaderboard'
 
 
-class WorkoutViewSet(viewsets.ModelViewSet):
+class WorkoutViewSet(CachedResponseMixin, FastListMixin, viewsets.ModelViewSet):
     """
     ViewSet for viewing and editing Workout instances
     """
     queryset = Workout.objects.all()
     serializer_class = WorkoutSerializer
+    pagination_class = WorkoutCursorPagination
+    replica_max_staleness = 300
+    cache_resource = 'workouts'
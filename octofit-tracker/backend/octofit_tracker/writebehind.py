@@ -0,0 +1,341 @@
+"""
+Write-behind activity ingestion.
+
+With OCTOFIT_WRITE_BEHIND on, POST /api/activities/ and the bulk endpoint
+validate the activities, append them to a local SQLite queue
+(OCTOFIT_WRITE_BEHIND_QUEUE) and answer 202 Accepted without touching the
+main database. A background thread in each process flushes the queue in
+batches of OCTOFIT_WRITE_BEHIND_BATCH_SIZE through the bulk ingestion path,
+so each flush is one deduplicating insert and one leaderboard update.
+``manage.py drain_activity_queue`` empties the queue from the command line,
+for example before a deploy or when the background thread is turned off
+(OCTOFIT_WRITE_BEHIND_FLUSH_INTERVAL = 0).
+
+Back-pressure: once OCTOFIT_WRITE_BEHIND_MAX_PENDING activities are waiting,
+new ones are refused with 503 and a Retry-After header.
+
+Delivery is at least once. A flusher claims a batch for
+OCTOFIT_WRITE_BEHIND_LEASE seconds and deletes it only after it is stored,
+so a batch claimed by a crashed process is flushed again later. Redelivered
+activities are dropped by their idempotency key.
+
+Activities are checked again when flushed: one whose user was deleted while
+it waited is moved to the queue's ``dead_letter`` table, with the reason,
+instead of being stored.
+
+A batch that fails to store is not retried straight away: its entries wait
+OCTOFIT_WRITE_BEHIND_RETRY_DELAY seconds (times their number of failures)
+while newer entries are flushed, are then retried one at a time so a bad
+entry cannot hold back the others, and are dead-lettered after
+OCTOFIT_WRITE_BEHIND_MAX_ATTEMPTS failures.
+
+The flush thread is started by the server entry points (wsgi.py, asgi.py)
+and by the first enqueue in a process, never by management commands.
+"""
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from collections import namedtuple
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils.dateparse import parse_datetime
+
+from . import leaderboard
+from .models import User
+from .serializers import ActivitySerializer
+
+logger = logging.getLogger(__name__)
+
+# Validated activity fields kept in the queue
+QUEUED_FIELDS = ('user_id', 'activity_type', 'duration', 'distance', 'calories', 'date', 'idempotency_key')
+
+
+# A claimed queue row: ``item`` is the decoded activity, ``payload`` as stored
+Entry = namedtuple('Entry', ['id', 'attempts', 'payload', 'item'])
+
+
+class QueueFull(Exception):
+    """Raised when accepting activities would exceed OCTOFIT_WRITE_BEHIND_MAX_PENDING"""
+
+
+class ActivityQueue:
+    """Durable FIFO of validated activities in a local SQLite file"""
+
+    def __init__(self, path):
+        self.path = str(path)
+        self.local = threading.local()
+        with self.connect() as db:
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS pending ('
+                ' id INTEGER PRIMARY KEY AUTOINCREMENT,'
+                ' payload TEXT NOT NULL,'
+                ' claimed_by TEXT,'
+                ' claimed_at REAL,'
+                ' attempts INTEGER NOT NULL DEFAULT 0,'
+                ' retry_at REAL)'
+            )
+            columns = {row[1] for row in db.execute('PRAGMA table_info(pending)')}
+            # Queue files written before retries were counted
+            if 'attempts' not in columns:
+                db.execute('ALTER TABLE pending ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0')
+                db.execute('ALTER TABLE pending ADD COLUMN retry_at REAL')
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS dead_letter ('
+                ' id INTEGER PRIMARY KEY AUTOINCREMENT,'
+                ' payload TEXT NOT NULL,'
+                ' reason TEXT NOT NULL,'
+                ' failed_at REAL NOT NULL)'
+            )
+
+    def connect(self):
+        """This thread's connection; autocommit, with explicit transactions"""
+        db = getattr(self.local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self.local.db = db
+        return _Transaction(db)
+
+    def pending(self):
+        with self.connect() as db:
+            return db.execute('SELECT COUNT(*) FROM pending').fetchone()[0]
+
+    def enqueue(self, items, max_pending):
+        """Append validated activity dicts; all or nothing under the limit"""
+        rows = [(json.dumps(_encode(item)),) for item in items]
+        with self.connect() as db:
+            waiting = db.execute('SELECT COUNT(*) FROM pending').fetchone()[0]
+            if waiting + len(rows) > max_pending:
+                raise QueueFull(waiting)
+            db.executemany('INSERT INTO pending (payload) VALUES (?)', rows)
+        return waiting + len(rows)
+
+    def claim(self, limit, lease):
+        """
+        Claim up to ``limit`` of the oldest entries that are neither claimed
+        (or their claim expired) nor waiting to be retried.
+
+        Returns a list of Entry; pass their ids to ack() once the items are
+        stored, or to fail() or dead_letter().
+        """
+        token = uuid.uuid4().hex
+        now = time.time()
+        with self.connect() as db:
+            db.execute(
+                'UPDATE pending SET claimed_by = ?, claimed_at = ? WHERE id IN ('
+                ' SELECT id FROM pending'
+                ' WHERE (claimed_at IS NULL OR claimed_at < ?) AND (retry_at IS NULL OR retry_at <= ?)'
+                ' ORDER BY id LIMIT ?)',
+                (token, now, now - lease, now, limit),
+            )
+            rows = db.execute(
+                'SELECT id, attempts, payload FROM pending WHERE claimed_by = ? ORDER BY id', (token,)
+            ).fetchall()
+        return [
+            Entry(entry_id, attempts, payload, _decode(json.loads(payload)))
+            for entry_id, attempts, payload in rows
+        ]
+
+    def ack(self, ids):
+        with self.connect() as db:
+            db.executemany('DELETE FROM pending WHERE id = ?', [(entry_id,) for entry_id in ids])
+
+    def fail(self, ids, retry_delay):
+        """Hand entries back after a failed flush, to be retried after a growing delay"""
+        now = time.time()
+        with self.connect() as db:
+            db.executemany(
+                'UPDATE pending SET claimed_by = NULL, claimed_at = NULL, attempts = attempts + 1,'
+                ' retry_at = ? + ? * (attempts + 1) WHERE id = ?',
+                [(now, retry_delay, entry_id) for entry_id in ids],
+            )
+
+    def dead_letter(self, entries, reason):
+        """Move entries that cannot be stored out of the queue, for inspection or replay"""
+        now = time.time()
+        with self.connect() as db:
+            db.executemany(
+                'INSERT INTO dead_letter (payload, reason, failed_at) VALUES (?, ?, ?)',
+                [(entry.payload, reason, now) for entry in entries],
+            )
+            db.executemany('DELETE FROM pending WHERE id = ?', [(entry.id,) for entry in entries])
+
+    def dead_lettered(self):
+        with self.connect() as db:
+            return db.execute('SELECT COUNT(*) FROM dead_letter').fetchone()[0]
+
+
+class _Transaction:
+    """``BEGIN IMMEDIATE`` ... ``COMMIT``, or ``ROLLBACK`` on error"""
+
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        self.db.execute('BEGIN IMMEDIATE')
+        return self.db
+
+    def __exit__(self, exc_type, exc, tb):
+        self.db.execute('ROLLBACK' if exc_type else 'COMMIT')
+
+
+def _encode(item):
+    item = {field: item.get(field) for field in QUEUED_FIELDS}
+    item['date'] = item['date'].isoformat()
+    return item
+
+
+def _decode(item):
+    item['date'] = parse_datetime(item['date'])
+    return item
+
+
+_lock = threading.Lock()
+_queues = {}
+_worker = None
+_wake = threading.Event()
+
+
+def get_queue():
+    """The queue at OCTOFIT_WRITE_BEHIND_QUEUE, opened once per process"""
+    path = str(settings.OCTOFIT_WRITE_BEHIND_QUEUE)
+    if path not in _queues:
+        with _lock:
+            if path not in _queues:
+                _queues[path] = ActivityQueue(path)
+    return _queues[path]
+
+
+def enqueue(items):
+    """
+    Queue validated activities for the background flush.
+
+    Returns the number of activities waiting; raises QueueFull when the
+    queue is at OCTOFIT_WRITE_BEHIND_MAX_PENDING.
+    """
+    waiting = get_queue().enqueue(items, settings.OCTOFIT_WRITE_BEHIND_MAX_PENDING)
+    start_worker()
+    if waiting >= settings.OCTOFIT_WRITE_BEHIND_BATCH_SIZE:
+        _wake.set()
+    return waiting
+
+
+def flush(queue=None, batch_size=None):
+    """
+    Store one batch from the queue; returns the number of entries taken.
+
+    The batch goes through ActivityListSerializer.ingest(), so retries and
+    redelivered entries are dropped by idempotency key, and the leaderboard
+    is updated once for the batch. Entries of users deleted since they were
+    queued are dead-lettered. Entries that failed before are stored one at a
+    time; a failure is logged and counted against the entries involved.
+    """
+    queue = queue or get_queue()
+    batch_size = batch_size or settings.OCTOFIT_WRITE_BEHIND_BATCH_SIZE
+    entries = queue.claim(batch_size, settings.OCTOFIT_WRITE_BEHIND_LEASE)
+    groups = [[entry] for entry in entries if entry.attempts]
+    fresh = [entry for entry in entries if not entry.attempts]
+    if fresh:
+        groups.append(fresh)
+    for group in groups:
+        try:
+            _store(queue, group, batch_size)
+        except Exception as exc:
+            logger.exception('Write-behind flush of %d activities failed', len(group))
+            _record_failure(queue, group, exc)
+    return len(entries)
+
+
+def _store(queue, entries, batch_size):
+    serializer = ActivitySerializer(many=True, context={'batch_size': batch_size})
+    with transaction.atomic():
+        deleted = _deleted_users([entry.item for entry in entries])
+        orphans = [entry for entry in entries if entry.item['user_id'] in deleted]
+        created, _ = serializer.ingest([entry.item for entry in entries if entry.item['user_id'] not in deleted])
+        leaderboard.record_activities_created(created)
+    if orphans:
+        queue.dead_letter(orphans, 'user deleted')
+        logger.warning('Dead-lettered %d queued activities of deleted users', len(orphans))
+    queue.ack([entry.id for entry in entries if entry.item['user_id'] not in deleted])
+
+
+def _record_failure(queue, entries, exc):
+    """Schedule a retry of failed entries, or dead-letter those out of attempts"""
+    max_attempts = settings.OCTOFIT_WRITE_BEHIND_MAX_ATTEMPTS
+    exhausted = [entry for entry in entries if entry.attempts + 1 >= max_attempts]
+    if exhausted:
+        queue.dead_letter(exhausted, f'failed {max_attempts} times, last: {exc!r}')
+        logger.error('Dead-lettered %d queued activities after %d failures', len(exhausted), max_attempts)
+    queue.fail(
+        [entry.id for entry in entries if entry.attempts + 1 < max_attempts],
+        settings.OCTOFIT_WRITE_BEHIND_RETRY_DELAY,
+    )
+
+
+def _deleted_users(items):
+    """
+    The user ids of ``items`` that name a User no longer stored.
+
+    Like synchronous writes, activities may name users that were never
+    stored; only ids that can be User keys are checked, with one query.
+    """
+    user_ids = leaderboard.valid_user_ids({item['user_id'] for item in items})
+    if not user_ids:
+        return set()
+    stored = {str(pk) for pk in User.objects.filter(pk__in=user_ids).values_list('pk', flat=True)}
+    return set(user_ids) - stored
+
+
+def drain(queue=None, batch_size=None):
+    """Flush until the queue has nothing claimable left; returns the entries taken"""
+    total = 0
+    while True:
+        taken = flush(queue, batch_size)
+        if not taken:
+            return total
+        total += taken
+
+
+def _run():
+    while True:
+        _wake.wait(settings.OCTOFIT_WRITE_BEHIND_FLUSH_INTERVAL)
+        _wake.clear()
+        close_old_connections()
+        try:
+            drain()
+        except Exception:
+            # The queue itself failed; claimed entries return after their lease
+            logger.exception('Write-behind flush failed')
+        finally:
+            close_old_connections()
+
+
+def start_worker():
+    """
+    Start this process's flush thread, unless the flush interval is 0.
+
+    Called on enqueue, which also restarts the thread in a process forked
+    since it started, and by start_server_worker().
+    """
+    global _worker
+    if (_worker is None or not _worker.is_alive()) and settings.OCTOFIT_WRITE_BEHIND_FLUSH_INTERVAL > 0:
+        with _lock:
+            if _worker is None or not _worker.is_alive():
+                _worker = threading.Thread(target=_run, name='octofit-write-behind', daemon=True)
+                _worker.start()
+
+
+def start_server_worker():
+    """
+    Start the flush thread in a server process when write-behind is on, so
+    entries left by an earlier process are stored before the next enqueue.
+    Called from wsgi.py and asgi.py rather than AppConfig.ready(), which
+    also runs for every management command.
+    """
+    if settings.OCTOFIT_WRITE_BEHIND:
+        start_worker()